@@ -0,0 +1,534 @@
+"""Cache partilhada (por processo) de snapshots de tabelas Airtable.
+
+Todas as sessões Streamlit do mesmo processo leem daqui, por isso 30 pais a abrir
+o dashboard custam um único download por tabela enquanto o snapshot for válido.
+
+- A chave é ``(base_id, nome_tabela, campos)``; ``campos=None`` é a tabela completa.
+  Pedidos com projeção (``fields=``) reaproveitam um snapshot completo válido e, se
+  algum campo não existir na base, recaem sobre o download completo.
+- Cada snapshot expira ao fim de ``CACHE_TTL_SEGUNDOS`` (ou do ``ttl`` indicado);
+  um snapshot expirado é atualizado pela sincronização incremental.
+- ``invalidar_cache`` força nova leitura completa; ``aplicar_escritas`` funde nos
+  snapshots as respostas das escritas feitas pela app, sem novo download.
+- Os snapshots são também gravados em disco (``snapshot_store``); depois de um
+  restart a tabela é hidratada daí e segue logo para a sincronização incremental.
+- ``sincronizar=True`` atualiza mesmo dentro do TTL. A sincronização incremental só
+  descarrega os registos criados/alterados desde a última sincronização
+  (``LAST_MODIFIED_TIME()``) e deteta apagados com uma passagem leve só de ids.
+- A filtragem por role/utilizador é feita depois, sobre cópias (ver ``data_utils``).
+"""
+
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from pyairtable import Api
+
+import snapshot_store
+from data_utils import META_SNAPSHOT
+
+
+CACHE_TTL_SEGUNDOS = 300
+MAX_DOWNLOADS_PARALELOS = 6
+# Campos calculados (lookup/rollup) não mexem no LAST_MODIFIED_TIME(); de 6 em 6 horas
+# a sincronização incremental dá lugar a um download completo. Fora disso (também
+# depois de um restart) decide o carimbo da última sincronização.
+RESYNC_COMPLETO_SEGUNDOS = 6 * 3600
+# Margem para diferenças de relógio entre este servidor e o Airtable.
+MARGEM_SINCRONIZACAO = timedelta(seconds=60)
+
+Campos = Optional[Tuple[str, ...]]
+_CacheKey = Tuple[str, str, Campos]
+
+
+@dataclass
+class TableSnapshot:
+    """Conteúdo de uma tabela num dado momento, partilhado entre sessões."""
+
+    base_id: str
+    nome: str
+    df: pd.DataFrame
+    versao: int
+    carregado_em: float
+    sincronizado_em: Optional[datetime] = None
+    completo_em: Optional[float] = None
+    campos: Campos = None
+    # Marcado por `marcar_desatualizado` após escritas: a próxima leitura sincroniza o delta.
+    invalidado: bool = False
+
+    def expirado(self, ttl: float) -> bool:
+        return self.invalidado or (ttl >= 0 and (time.monotonic() - self.carregado_em) > ttl)
+
+
+_LOCK = threading.Lock()
+_SNAPSHOTS: Dict[_CacheKey, TableSnapshot] = {}
+_LOCKS_TABELA: Dict[_CacheKey, threading.Lock] = {}
+_VERSOES = itertools.count(1)
+# Projeções que falharam por campo inexistente: vão diretas ao download completo.
+_PROJECOES_INVALIDAS: set = set()
+_CAMPOS_PRIMARIOS: Dict[Tuple[str, str], Optional[str]] = {}
+
+
+def normalizar_campos(campos: Optional[Iterable[str]]) -> Campos:
+    """Forma canónica de uma lista de campos (ordenada, sem repetidos) para usar como chave."""
+    if campos is None:
+        return None
+    return tuple(sorted(set(campos)))
+
+
+def _lock_tabela(chave: _CacheKey) -> threading.Lock:
+    with _LOCK:
+        lock = _LOCKS_TABELA.get(chave)
+        if lock is None:
+            lock = threading.Lock()
+            _LOCKS_TABELA[chave] = lock
+        return lock
+
+
+def registos_para_dataframe(registos: Iterable[dict]) -> pd.DataFrame:
+    """Converte registos Airtable em DataFrame com a coluna `id`."""
+    return pd.DataFrame([{"id": r["id"], **r.get("fields", {})} for r in registos])
+
+
+def _erro_campo_inexistente(exc: Exception) -> bool:
+    return "UNKNOWN_FIELD_NAME" in str(exc).upper()
+
+
+def _descarregar_tabela(api: Api, base_id: str, nome: str, campos: Campos = None) -> Tuple[pd.DataFrame, Campos]:
+    """Descarrega a tabela (projetada em `campos`, se possível) e devolve os campos efetivamente pedidos."""
+    tabela = api.table(base_id, nome)
+    chave = (base_id, nome, campos)
+    if campos is not None and chave not in _PROJECOES_INVALIDAS:
+        try:
+            return registos_para_dataframe(tabela.all(fields=list(campos))), campos
+        except Exception as exc:
+            if not _erro_campo_inexistente(exc):
+                raise
+            _PROJECOES_INVALIDAS.add(chave)
+    return registos_para_dataframe(tabela.all()), None
+
+
+def guardar_snapshot(
+    base_id: str,
+    nome: str,
+    df: pd.DataFrame,
+    *,
+    sincronizado_em: Optional[datetime] = None,
+    completo: bool = True,
+    campos: Campos = None,
+    chave_campos: Campos = None,
+    delta: Optional[dict] = None,
+) -> TableSnapshot:
+    """Substitui o snapshot partilhado de uma tabela e devolve-o.
+
+    `campos` são os campos que o DataFrame contém (None = todos); `chave_campos` a
+    projeção pedida, que identifica o snapshot na cache. `delta` descreve, para quem
+    memoiza estruturas por versão, o que mudou desde a versão anterior.
+    """
+    agora = time.monotonic()
+    anterior = obter_snapshot(base_id, nome, chave_campos)
+    versao = next(_VERSOES)
+    _marcar_versao(df, base_id, nome, versao, delta)
+    snapshot = TableSnapshot(
+        base_id=base_id,
+        nome=nome,
+        df=df,
+        versao=versao,
+        carregado_em=agora,
+        sincronizado_em=sincronizado_em,
+        completo_em=agora if completo or anterior is None else anterior.completo_em,
+        campos=campos,
+    )
+    with _LOCK:
+        _SNAPSHOTS[(base_id, nome, chave_campos)] = snapshot
+    snapshot_store.guardar(
+        base_id,
+        nome,
+        chave_campos,
+        df,
+        versao=snapshot.versao,
+        sincronizado_em=sincronizado_em,
+        completo_em_epoch=_monotonic_para_epoch(snapshot.completo_em),
+        campos=campos,
+    )
+    return snapshot
+
+
+def copia_para_sessao(df: pd.DataFrame) -> pd.DataFrame:
+    """Cópia de um snapshot para uma sessão, sem ``META_SNAPSHOT``.
+
+    A sessão pode alterar a sua cópia; os índices memoizados pela versão do snapshot
+    (``data_utils``) só valem para o snapshot partilhado, que nunca é alterado.
+    """
+    copia = df.copy()
+    copia.attrs = {chave: valor for chave, valor in df.attrs.items() if chave != META_SNAPSHOT}
+    return copia
+
+
+def _marcar_versao(df: pd.DataFrame, base_id: str, nome: str, versao: int, delta: Optional[dict] = None) -> None:
+    """Identifica o snapshot em `df.attrs` (as cópias para as sessões perdem-no: `copia_para_sessao`)."""
+    df.attrs[META_SNAPSHOT] = {"base_id": base_id, "tabela": nome, "versao": versao, "delta": delta}
+
+
+def _monotonic_para_epoch(valor: Optional[float]) -> Optional[float]:
+    return None if valor is None else time.time() - (time.monotonic() - valor)
+
+
+def _epoch_para_monotonic(valor: Optional[float]) -> Optional[float]:
+    return None if valor is None else time.monotonic() - (time.time() - valor)
+
+
+def _hidratar(chave: _CacheKey) -> Optional[TableSnapshot]:
+    """Recupera do disco o snapshot de uma tabela (já expirado, para forçar a sincronização)."""
+    guardado = snapshot_store.carregar(*chave)
+    if guardado is None:
+        return None
+    versao = next(_VERSOES)
+    _marcar_versao(guardado.df, chave[0], chave[1], versao)
+    snapshot = TableSnapshot(
+        base_id=chave[0],
+        nome=chave[1],
+        df=guardado.df,
+        versao=versao,
+        carregado_em=float("-inf"),
+        sincronizado_em=guardado.sincronizado_em,
+        completo_em=_epoch_para_monotonic(guardado.completo_em_epoch),
+        campos=guardado.campos,
+    )
+    with _LOCK:
+        _SNAPSHOTS.setdefault(chave, snapshot)
+    return snapshot
+
+
+def _agora_utc() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _formula_alterados_desde(momento: datetime) -> str:
+    carimbo = momento.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    limite = f"DATETIME_PARSE('{carimbo}')"
+    return f"OR(IS_AFTER(LAST_MODIFIED_TIME(), {limite}), IS_AFTER(CREATED_TIME(), {limite}))"
+
+
+def aplicar_alteracoes(
+    df: pd.DataFrame,
+    alterados: pd.DataFrame,
+    ids_existentes: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """Funde registos alterados num DataFrame em cache.
+
+    Linhas com o mesmo `id` são substituídas, novas são acrescentadas e, se
+    `ids_existentes` for indicado, as que já não existem no Airtable são removidas.
+    """
+    base = df
+    if "id" in base.columns:
+        manter = pd.Series(True, index=base.index)
+        if ids_existentes is not None:
+            manter &= base["id"].isin(set(ids_existentes))
+        if not alterados.empty:
+            manter &= ~base["id"].isin(set(alterados["id"]))
+        base = base[manter]
+    if alterados.empty:
+        return base.reset_index(drop=True)
+    colunas = list(dict.fromkeys([*base.columns, *alterados.columns]))
+    return pd.concat([base, alterados], ignore_index=True).reindex(columns=colunas)
+
+
+def _coluna_leve(df: pd.DataFrame) -> Optional[str]:
+    """Campo usado na passagem só de ids (o Airtable devolve todos os campos se a lista vier vazia)."""
+    return next((c for c in df.columns if c != "id"), None)
+
+
+def _sincronizar_incremental(api: Api, chave: _CacheKey, snapshot: TableSnapshot) -> TableSnapshot:
+    inicio = _agora_utc()
+    tabela = api.table(snapshot.base_id, snapshot.nome)
+    formula = _formula_alterados_desde(snapshot.sincronizado_em - MARGEM_SINCRONIZACAO)
+    if snapshot.campos is not None:
+        alterados = registos_para_dataframe(tabela.all(formula=formula, fields=list(snapshot.campos)))
+    else:
+        alterados = registos_para_dataframe(tabela.all(formula=formula))
+    ids = [r["id"] for r in tabela.all(fields=[_coluna_leve(snapshot.df)])]
+
+    df_atual = snapshot.df
+    removidos = set(df_atual["id"]) - set(ids) if "id" in df_atual.columns else set()
+    if alterados.empty and not removidos:
+        # Nada mudou: mantém a versão (e as estruturas memoizadas sobre ela), só renova os carimbos.
+        atualizado = TableSnapshot(
+            base_id=snapshot.base_id,
+            nome=snapshot.nome,
+            df=df_atual,
+            versao=snapshot.versao,
+            carregado_em=time.monotonic(),
+            sincronizado_em=inicio,
+            completo_em=snapshot.completo_em,
+            campos=snapshot.campos,
+        )
+        with _LOCK:
+            _SNAPSHOTS[chave] = atualizado
+        snapshot_store.atualizar_sincronizacao(*chave, inicio)
+        return atualizado
+
+    return guardar_snapshot(
+        snapshot.base_id,
+        snapshot.nome,
+        aplicar_alteracoes(df_atual, alterados, ids),
+        sincronizado_em=inicio,
+        completo=False,
+        campos=snapshot.campos,
+        chave_campos=chave[2],
+        delta={
+            "desde": snapshot.versao,
+            "alterados": list(alterados["id"]) if not alterados.empty else [],
+            "removidos": sorted(removidos),
+        },
+    )
+
+
+def _pode_sincronizar(snapshot: Optional[TableSnapshot]) -> bool:
+    """Há carimbo de sincronização (delta + passagem de ids) e o completo não está vencido."""
+    return (
+        snapshot is not None
+        and snapshot.sincronizado_em is not None
+        and snapshot.completo_em is not None
+        and time.monotonic() - snapshot.completo_em <= RESYNC_COMPLETO_SEGUNDOS
+        and _coluna_leve(snapshot.df) is not None
+    )
+
+
+def obter_snapshot(base_id: str, nome: str, campos: Campos = None) -> Optional[TableSnapshot]:
+    """Devolve o snapshot em cache (mesmo expirado) sem ir ao Airtable."""
+    with _LOCK:
+        return _SNAPSHOTS.get((base_id, nome, campos))
+
+
+def _snapshot_valido(base_id: str, nome: str, campos: Campos, ttl: float) -> Optional[TableSnapshot]:
+    """Snapshot dentro do TTL para a projeção pedida; um completo também serve."""
+    for chave_campos in ((campos, None) if campos is not None else (None,)):
+        snapshot = obter_snapshot(base_id, nome, chave_campos)
+        if snapshot is not None and not snapshot.expirado(ttl):
+            return snapshot
+    return None
+
+
+def obter_tabela(
+    api: Api,
+    base_id: str,
+    nome: str,
+    *,
+    ttl: float = CACHE_TTL_SEGUNDOS,
+    sincronizar: bool = False,
+    campos: Optional[Iterable[str]] = None,
+) -> Tuple[TableSnapshot, bool]:
+    """Obtém o snapshot de uma tabela, descarregando-o se não existir ou estiver expirado.
+
+    Com `campos` só esses campos são pedidos ao Airtable (o DataFrame pode trazer mais
+    se vier de um snapshot completo ou do fallback). Com `sincronizar=True` o snapshot
+    existente é sempre atualizado, mesmo dentro do TTL. A atualização (também a de um
+    snapshot expirado) é incremental sempre que possível, com o download completo como
+    recurso. Pedidos
+    simultâneos para a mesma tabela esperam pelo primeiro download em vez de repetirem
+    a chamada. Devolve o snapshot e se houve pedidos ao Airtable.
+    """
+    campos = normalizar_campos(campos)
+    chave = (base_id, nome, campos)
+    snapshot = obter_snapshot(*chave)
+    if not sincronizar:
+        valido = _snapshot_valido(base_id, nome, campos, ttl)
+        if valido is not None:
+            return valido, False
+
+    with _lock_tabela(chave):
+        atual = obter_snapshot(*chave)
+        if atual is not None and atual is not snapshot and not atual.expirado(ttl):
+            # Outra sessão atualizou a tabela enquanto esperávamos.
+            return atual, False
+        if atual is None:
+            # Arranque a frio: parte do snapshot em disco e sincroniza só as diferenças.
+            atual = _hidratar(chave)
+        # Expirado, invalidado, hidratado ou pedido explícito: sempre que possível só o delta.
+        if _pode_sincronizar(atual):
+            try:
+                return _sincronizar_incremental(api, chave, atual), True
+            except Exception:
+                pass  # p.ex. campo usado na passagem de ids foi renomeado: faz download completo
+        inicio = _agora_utc()
+        df, campos_obtidos = _descarregar_tabela(api, base_id, nome, campos)
+        snapshot = guardar_snapshot(
+            base_id, nome, df, sincronizado_em=inicio, campos=campos_obtidos, chave_campos=campos
+        )
+        return snapshot, True
+
+
+def carregar_tabelas(
+    api: Api,
+    base_id: str,
+    nomes: Iterable[str],
+    *,
+    ttl: float = CACHE_TTL_SEGUNDOS,
+    sincronizar: bool = False,
+    campos_por_tabela: Optional[Dict[str, Iterable[str]]] = None,
+) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Exception]]:
+    """Carrega várias tabelas via cache partilhada, descarregando as que faltam em paralelo.
+
+    O ritmo de pedidos é controlado pelo limitador do cliente (ver ``airtable_client``).
+    `campos_por_tabela` indica a projeção de cada tabela (ausente = tabela completa).
+    Devolve cópias dos DataFrames sem ``META_SNAPSHOT`` (cada sessão pode alterá-las à vontade) e um
+    dicionário com os erros por tabela, para o chamador decidir como os mostrar.
+    """
+    nomes = list(dict.fromkeys(nomes))
+    dados: Dict[str, pd.DataFrame] = {}
+    erros: Dict[str, Exception] = {}
+    if not nomes:
+        return dados, erros
+
+    campos_por_tabela = campos_por_tabela or {}
+    with ThreadPoolExecutor(max_workers=min(MAX_DOWNLOADS_PARALELOS, len(nomes))) as executor:
+        futuros = {
+            nome: executor.submit(
+                obter_tabela,
+                api,
+                base_id,
+                nome,
+                ttl=ttl,
+                sincronizar=sincronizar,
+                campos=campos_por_tabela.get(nome),
+            )
+            for nome in nomes
+        }
+
+    for nome in nomes:
+        try:
+            snapshot, _ = futuros[nome].result()
+        except Exception as exc:
+            erros[nome] = exc
+            dados[nome] = pd.DataFrame()
+            continue
+        dados[nome] = copia_para_sessao(snapshot.df)
+    return dados, erros
+
+
+def invalidar_cache(base_id: Optional[str] = None, nomes: Optional[Iterable[str]] = None) -> List[_CacheKey]:
+    """Remove snapshots da cache partilhada.
+
+    Sem argumentos limpa tudo; com `base_id` limpa essa base; com `nomes` limita às tabelas indicadas.
+    """
+    nomes_set = set(nomes) if nomes is not None else None
+    with _LOCK:
+        removidas = [
+            chave
+            for chave in _SNAPSHOTS
+            if (base_id is None or chave[0] == base_id) and (nomes_set is None or chave[1] in nomes_set)
+        ]
+        for chave in removidas:
+            _SNAPSHOTS.pop(chave, None)
+    for chave in removidas:
+        snapshot_store.remover(*chave)
+    return removidas
+
+
+def aplicar_escritas(
+    base_id: str,
+    nome: str,
+    *,
+    criados: Iterable[dict] = (),
+    atualizados: Iterable[dict] = (),
+    apagados: Iterable[str] = (),
+) -> List[TableSnapshot]:
+    """Aplica aos snapshots em cache as respostas de escritas feitas pela própria app.
+
+    `criados`/`atualizados` são registos devolvidos pelo Airtable (já completos) e
+    `apagados` os ids removidos; não é preciso voltar a descarregar a tabela. A versão
+    avança com o respetivo ``delta`` (estruturas memoizadas recalculam); o carimbo de
+    sincronização e o TTL mantêm-se, para a sincronização seguinte continuar a apanhar
+    alterações de terceiros (e campos calculados noutras tabelas). Devolve os
+    snapshots alterados.
+    """
+    criados = [registo for registo in criados if registo.get("id")]
+    atualizados = [registo for registo in atualizados if registo.get("id")]
+    apagados = {str(registo_id) for registo_id in apagados if registo_id}
+    if not (criados or atualizados or apagados):
+        return []
+    with _LOCK:
+        chaves = [chave for chave in _SNAPSHOTS if chave[0] == base_id and chave[1] == nome]
+
+    alterados: List[TableSnapshot] = []
+    for chave in chaves:
+        with _lock_tabela(chave):
+            snapshot = obter_snapshot(*chave)
+            if snapshot is None or "id" not in snapshot.df.columns:
+                continue
+            existentes = set(snapshot.df["id"])
+            # Atualizações só para linhas conhecidas; criações só para linhas novas.
+            registos = [r for r in atualizados if r["id"] in existentes] + [r for r in criados if r["id"] not in existentes]
+            if snapshot.campos is not None:
+                registos = [
+                    {"id": r["id"], "fields": {k: v for k, v in r.get("fields", {}).items() if k in snapshot.campos}}
+                    for r in registos
+                ]
+            removidos = sorted(apagados & existentes)
+            if not registos and not removidos:
+                continue
+            df = snapshot.df[~snapshot.df["id"].isin(removidos)] if removidos else snapshot.df
+            df_registos = registos_para_dataframe(registos)
+            novo = guardar_snapshot(
+                base_id,
+                nome,
+                aplicar_alteracoes(df, df_registos),
+                sincronizado_em=snapshot.sincronizado_em,
+                completo=False,
+                campos=snapshot.campos,
+                chave_campos=chave[2],
+                delta={
+                    "desde": snapshot.versao,
+                    "alterados": [r["id"] for r in registos],
+                    "removidos": removidos,
+                },
+            )
+            novo = replace(novo, carregado_em=snapshot.carregado_em, invalidado=snapshot.invalidado)
+            with _LOCK:
+                _SNAPSHOTS[chave] = novo
+            alterados.append(novo)
+    return alterados
+
+
+def campo_primario(api: Api, base_id: str, nome: str) -> Optional[str]:
+    """Nome do campo primário da tabela (API de metadados), memoizado por processo.
+
+    Devolve None se o token não tiver acesso ao schema.
+    """
+    chave = (base_id, nome)
+    with _LOCK:
+        if chave in _CAMPOS_PRIMARIOS:
+            return _CAMPOS_PRIMARIOS[chave]
+    try:
+        schema = api.table(base_id, nome).schema()
+        valor: Optional[str] = schema.field(schema.primary_field_id).name
+    except Exception:
+        valor = None
+    with _LOCK:
+        _CAMPOS_PRIMARIOS[chave] = valor
+    return valor
+
+
+def marcar_desatualizado(base_id: str, nomes: Iterable[str]) -> int:
+    """Marca as tabelas indicadas como alteradas (p.ex. depois de uma escrita).
+
+    Ao contrário de `invalidar_cache`, o snapshot fica disponível: a próxima leitura
+    pede ao Airtable só o que mudou (sincronização incremental). Devolve quantos
+    snapshots foram marcados.
+    """
+    nomes_set = set(nomes)
+    marcados = 0
+    with _LOCK:
+        for chave, snapshot in list(_SNAPSHOTS.items()):
+            if chave[0] == base_id and chave[1] in nomes_set and not snapshot.invalidado:
+                _SNAPSHOTS[chave] = replace(snapshot, invalidado=True)
+                marcados += 1
+    return marcados
@@ -0,0 +1,92 @@
+"""Cliente Airtable partilhado com limite de pedidos por base.
+
+O Airtable aceita 5 pedidos/s por base. Em vez de pausas fixas entre tabelas, todos
+os pedidos (incluindo cada página de `.all()` e as escritas) passam por um
+token-bucket partilhado por processo, o que permite carregar tabelas em paralelo
+sem ultrapassar o limite.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, TypeVar
+from urllib.parse import urlparse
+
+from pyairtable import Api
+
+
+PEDIDOS_POR_SEGUNDO = 5
+# Máximo de registos por pedido nas operações em lote (batch_create/update/delete).
+TAMANHO_LOTE_AIRTABLE = 10
+
+_T = TypeVar("_T")
+
+
+class LimitadorTaxa:
+    """Token-bucket thread-safe: `taxa` pedidos por segundo, com rajadas até `capacidade`."""
+
+    def __init__(self, taxa: float = PEDIDOS_POR_SEGUNDO, capacidade: Optional[float] = None) -> None:
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade if capacidade is not None else taxa)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self) -> None:
+        """Bloqueia até existir um token disponível e consome-o."""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+                self._ultimo = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+
+_LOCK = threading.Lock()
+_LIMITADORES: Dict[str, LimitadorTaxa] = {}
+
+
+def obter_limitador(base_id: str) -> LimitadorTaxa:
+    """Limitador partilhado (por processo) para a base indicada."""
+    with _LOCK:
+        limitador = _LIMITADORES.get(base_id)
+        if limitador is None:
+            limitador = LimitadorTaxa()
+            _LIMITADORES[base_id] = limitador
+        return limitador
+
+
+def _base_id_do_url(url: str) -> Optional[str]:
+    """Extrai o id da base (`app...`) de um URL da API, se existir."""
+    for parte in urlparse(url).path.split("/"):
+        if parte.startswith("app"):
+            return parte
+    return None
+
+
+class ApiLimitada(Api):
+    """`Api` do pyairtable que respeita o limite de pedidos por base em todos os pedidos."""
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> Any:
+        base_id = _base_id_do_url(url)
+        if base_id:
+            obter_limitador(base_id).adquirir()
+        return super().request(method, url, *args, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def criar_api(token: str) -> ApiLimitada:
+    """Devolve o cliente partilhado para o token indicado."""
+    return ApiLimitada(token)
+
+
+def em_blocos(itens: Sequence[_T], tamanho: int = TAMANHO_LOTE_AIRTABLE) -> Iterator[List[_T]]:
+    """Parte `itens` em blocos do tamanho de um pedido em lote."""
+    for inicio in range(0, len(itens), tamanho):
+        yield list(itens[inicio : inicio + tamanho])
@@ -2,6 +2,8 @@ import streamlit as st
 from pyairtable import Api
 from typing import Any, Dict, List, Tuple
 
+from airtable_cache import obter_snapshot
+from airtable_client import criar_api
 from airtable_config import (
     clear_authentication,
     context_labels,
@@ -12,13 +14,14 @@ from airtable_config import (
 )
 from menu import _hide_streamlit_sidebar_nav
 from components.banner_convites import mostrar_convites
+from data_utils import formula_por_ids, ids_por_email, registo_tem_email
 
 st.set_page_config(page_title="Portal Lobitos - Login", page_icon="\U0001F43E", layout="centered")
 _hide_streamlit_sidebar_nav()
 
 def _obter_airtable_client() -> Tuple[Api, str]:
     token, base_id = get_airtable_credentials()
-    return Api(token), base_id
+    return criar_api(token), base_id
 
 
 def _normalizar_email(valor: str) -> str:
@@ -70,6 +73,22 @@ def _checkbox_marcado(valor: Any) -> bool:
     return False
 
 
+def _buscar_escuteiros_por_indice(email: str) -> List[Dict[str, Any]]:
+    """Localiza o email no snapshot partilhado de Escuteiros e relê esses registos no Airtable.
+
+    O snapshot só dá os ids (pode estar desatualizado, e no login nunca é descarregado
+    nem sincronizado); a senha e as permissões vêm sempre da leitura por ids.
+    Devolve lista vazia se o email não estiver no snapshot ou já não bater.
+    """
+    api, base_id = _obter_airtable_client()
+    snapshot = obter_snapshot(base_id, "Escuteiros")
+    ids = ids_por_email(snapshot.df, email) if snapshot is not None else []
+    if not ids:
+        return []
+    registos = api.table(base_id, "Escuteiros").all(formula=formula_por_ids(ids))
+    return [registo for registo in registos if registo_tem_email(registo, email)]
+
+
 def _buscar_escuteiros(email: str) -> List[Dict[str, Any]]:
     api, base_id = _obter_airtable_client()
     tabela = api.table(base_id, "Escuteiros")
@@ -83,6 +102,17 @@ def _buscar_escuteiros(email: str) -> List[Dict[str, Any]]:
     return tabela.all(formula=formula, max_records=50)
 
 
+def _filtrar_por_senha(registos: List[Dict[str, Any]], senha: str) -> List[Dict[str, Any]]:
+    correspondencias = []
+    for registo in registos:
+        senha_registo = registo.get("fields", {}).get("Senha_Painel")
+        if senha_registo is None:
+            continue
+        if str(senha_registo).strip() == senha.strip():
+            correspondencias.append(registo)
+    return correspondencias
+
+
 contextos_disponiveis = get_available_contexts()
 if not contextos_disponiveis:
     st.error("Nenhuma configuração Airtable encontrada. Crie blocos 'airtable_*' nos secrets.")
@@ -134,23 +164,24 @@ if st.button("Entrar no portal \U0001F680"):
         st.error("Indique email e senha.")
     else:
         with st.spinner("A validar credenciais..."):
+            # O índice local só encontra os ids; a senha é sempre validada com registos
+            # acabados de ler do Airtable. Sem o email no índice, procura por fórmula.
+            erro_consulta = None
+            registos: List[Dict[str, Any]] = []
             try:
-                registos = _buscar_escuteiros(email_normalizado)
+                registos = _buscar_escuteiros_por_indice(email_normalizado)
+                if not registos:
+                    registos = _buscar_escuteiros(email_normalizado)
             except Exception as exc:
-                st.error(f"Não consegui validar as credenciais: {exc}")
+                erro_consulta = exc
+            correspondencias = _filtrar_por_senha(registos, senha_input)
+
+            if erro_consulta is not None:
+                st.error(f"Não consegui validar as credenciais: {erro_consulta}")
             else:
                 if not registos:
                     st.error("Não encontrei escuteiros associados a este email.")
                 else:
-                    correspondencias = []
-                    for registo in registos:
-                        campos = registo.get("fields", {})
-                        senha_registo = campos.get("Senha_Painel")
-                        if senha_registo is None:
-                            continue
-                        if str(senha_registo).strip() == senha_input.strip():
-                            correspondencias.append(registo)
-
                     if not correspondencias:
                         st.error("Senha incorreta.")
                     else:
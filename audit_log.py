@@ -0,0 +1,136 @@
+"""Escrita em background das linhas do Audit Log.
+
+Gravar a auditoria não deve atrasar quem edita: as linhas são postas numa fila do
+processo e uma thread daemon escreve-as com ``batch_create`` (lotes de 10), com
+algumas tentativas espaçadas. As falhas ficam guardadas por sessão, base e tabela
+para a página da sessão que as registou as mostrar na execução seguinte
+(``erro_pendente``). Uma tabela sem acesso deixa de ser tentada durante
+``INDISPONIVEL_SEGUNDOS`` (o nome ou as permissões podem ser corrigidos entretanto).
+
+A fila vive só em memória: ao terminar normalmente, o processo espera até
+``ESPERA_SAIDA_SEGUNDOS`` que ela esvazie (``atexit``), mas linhas ainda na fila
+perdem-se se o processo for morto ou a espera acabar.
+"""
+
+from __future__ import annotations
+
+import atexit
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pyairtable import Api
+
+from airtable_client import em_blocos
+
+
+TENTATIVAS = 3
+ESPERA_BASE_SEGUNDOS = 2.0
+INDISPONIVEL_SEGUNDOS = 600.0
+# Falhas que nenhuma sessão veio buscar são esquecidas ao fim deste tempo.
+VALIDADE_ERROS_SEGUNDOS = 3600.0
+ESPERA_SAIDA_SEGUNDOS = 15.0
+
+_Chave = Tuple[str, str]
+_ChaveErro = Tuple[Optional[str], str, str]
+
+_FILA: "queue.Queue[Tuple[Api, Optional[str], str, str, List[dict]]]" = queue.Queue()
+_LOCK = threading.Lock()
+_ERROS: Dict[_ChaveErro, Tuple[str, bool, float]] = {}
+_INDISPONIVEIS: Dict[_Chave, float] = {}
+_THREAD: Optional[threading.Thread] = None
+
+
+def erro_sem_acesso(exc: Exception) -> bool:
+    """A tabela não existe ou o token não tem permissão (não adianta repetir)."""
+    mensagem = str(exc)
+    return "INVALID_PERMISSIONS_OR_MODEL_NOT_FOUND" in mensagem or "Forbidden" in mensagem
+
+
+def indisponivel(base_id: str, tabela: str) -> bool:
+    """A tabela falhou por falta de acesso há menos de ``INDISPONIVEL_SEGUNDOS``."""
+    with _LOCK:
+        ate = _INDISPONIVEIS.get((base_id, tabela))
+        if ate is not None and time.monotonic() >= ate:
+            del _INDISPONIVEIS[(base_id, tabela)]
+            ate = None
+    return ate is not None
+
+
+def registar(api: Api, base_id: str, tabela: str, linhas: List[dict], *, sessao: Optional[str] = None) -> None:
+    """Enfileira linhas (campos do Audit Log) para escrita em background.
+
+    `sessao` identifica quem registou: só essa sessão recebe as falhas em ``erro_pendente``.
+    """
+    if not linhas or indisponivel(base_id, tabela):
+        return
+    _FILA.put((api, sessao, base_id, tabela, list(linhas)))
+    _garantir_thread()
+
+
+def erro_pendente(base_id: str, tabela: str, *, sessao: Optional[str] = None) -> Optional[Tuple[str, bool]]:
+    """Devolve (e limpa) a última falha da escrita em background: ``(mensagem, sem_acesso)``."""
+    with _LOCK:
+        erro = _ERROS.pop((sessao, base_id, tabela), None)
+    return None if erro is None else erro[:2]
+
+
+def aguardar(timeout: Optional[float] = None) -> bool:
+    """Espera que a fila esvazie (útil em scripts); devolve False se o tempo acabar."""
+    limite = None if timeout is None else time.monotonic() + timeout
+    while _FILA.unfinished_tasks:
+        if limite is not None and time.monotonic() >= limite:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def _garantir_thread() -> None:
+    global _THREAD
+    with _LOCK:
+        if _THREAD is None or not _THREAD.is_alive():
+            if _THREAD is None:
+                atexit.register(aguardar, ESPERA_SAIDA_SEGUNDOS)
+            _THREAD = threading.Thread(target=_ciclo, name="audit-log", daemon=True)
+            _THREAD.start()
+
+
+def _guardar_erro(sessao: Optional[str], base_id: str, tabela: str, mensagem: str, sem_acesso: bool) -> None:
+    agora = time.monotonic()
+    with _LOCK:
+        for chave in [c for c, (_, _, quando) in _ERROS.items() if agora - quando > VALIDADE_ERROS_SEGUNDOS]:
+            del _ERROS[chave]
+        _ERROS[(sessao, base_id, tabela)] = (mensagem, sem_acesso, agora)
+        if sem_acesso:
+            _INDISPONIVEIS[(base_id, tabela)] = agora + INDISPONIVEL_SEGUNDOS
+
+
+def _escrever(api: Api, sessao: Optional[str], base_id: str, tabela: str, linhas: List[dict]) -> None:
+    if indisponivel(base_id, tabela):
+        return
+    destino = api.table(base_id, tabela)
+    for bloco in em_blocos(linhas):
+        for tentativa in range(TENTATIVAS):
+            try:
+                destino.batch_create(bloco)
+                break
+            except Exception as exc:
+                if erro_sem_acesso(exc):
+                    _guardar_erro(sessao, base_id, tabela, str(exc), True)
+                    return
+                if tentativa == TENTATIVAS - 1:
+                    _guardar_erro(sessao, base_id, tabela, str(exc), False)
+                else:
+                    time.sleep(ESPERA_BASE_SEGUNDOS * 2 ** tentativa)
+
+
+def _ciclo() -> None:
+    while True:
+        api, sessao, base_id, tabela, linhas = _FILA.get()
+        try:
+            _escrever(api, sessao, base_id, tabela, linhas)
+        except Exception as exc:
+            _guardar_erro(sessao, base_id, tabela, str(exc), False)
+        finally:
+            _FILA.task_done()
@@ -1,5 +1,15 @@
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Iterable
+
 import pandas as pd
 
+from snapshot_store import dataframe_para_registos
+
 
 def mapear_lista(valor, mapping):
     if isinstance(valor, list):
@@ -9,6 +19,43 @@ def mapear_lista(valor, mapping):
     return mapping.get(valor, valor)
 
 
+def mapear_serie(serie: pd.Series, mapping: dict) -> pd.Series:
+    """Equivalente vetorizado de `serie.apply(lambda v: mapear_lista(v, mapping))`.
+
+    Explode as listas de ids, resolve-os de uma vez via índice e volta a juntar por linha.
+    """
+    if serie.empty:
+        return pd.Series(index=serie.index, dtype=object)
+
+    posicoes = serie.reset_index(drop=True)
+    explodida = posicoes.explode()
+    try:
+        if isinstance(mapping, IndiceNomes):
+            resolvida = explodida.map(mapping.serie)
+        elif mapping:
+            resolvida = explodida.map(pd.Series(mapping, dtype=object))
+        else:
+            resolvida = explodida.copy()
+    except TypeError:
+        # Valores não hasheáveis (dicts, listas aninhadas): caminho célula a célula.
+        return serie.apply(lambda valor: mapear_lista(valor, mapping))
+    resolvida = resolvida.where(resolvida.notna(), explodida).astype(object)
+    resolvida = resolvida.where(resolvida.notna(), "")
+
+    repetidas = resolvida.index.duplicated(keep=False)
+    resultado = resolvida[~resolvida.index.duplicated()].copy()
+    if repetidas.any():
+        juntas = resolvida[repetidas].astype(str).groupby(level=0).agg(", ".join)
+        resultado.loc[juntas.index] = juntas
+    resultado.index = serie.index
+    return resultado
+
+
+def primeiro_mapa_preenchido(*mapas: dict) -> dict:
+    """Devolve o primeiro mapa não vazio (ordem de preferência das cascatas de nomes)."""
+    return next((mapa for mapa in mapas if mapa), {})
+
+
 def formatar_moeda_euro(valor) -> str:
     if pd.isna(valor):
         return ""
@@ -34,78 +81,332 @@ def formatar_moeda_euro(valor) -> str:
     return f"{texto}€"
 
 
-def construir_mapa_nomes_por_id(dataset: dict) -> dict[str, str]:
-    """Cria um dicionário id -> nome usando quaisquer tabelas já carregadas."""
+# Metadados que a cache partilhada (airtable_cache) coloca em `df.attrs` de cada snapshot.
+META_SNAPSHOT = "airtable_snapshot"
 
-    def _score_coluna(coluna: str) -> tuple[int, str]:
-        nome_lower = coluna.lower()
-        if nome_lower in {"nome", "name"}:
-            return (0, nome_lower)
-        if "nome" in nome_lower:
-            return (1, nome_lower)
-        if "name" in nome_lower:
-            return (2, nome_lower)
-        if "email" in nome_lower:
-            return (3, nome_lower)
-        return (4, nome_lower)
 
-    mapa: dict[str, str] = {}
-    for df in dataset.values():
-        if df is None or df.empty or "id" not in df.columns:
-            continue
+def metadados_snapshot(df: pd.DataFrame) -> dict | None:
+    """Devolve `{base_id, tabela, versao, delta}` se o DataFrame for um snapshot partilhado intacto."""
+    meta = df.attrs.get(META_SNAPSHOT) if isinstance(df, pd.DataFrame) else None
+    return meta if isinstance(meta, dict) else None
 
-        colunas_texto: list[str] = []
-        for coluna in df.columns:
-            if coluna == "id":
-                continue
-            serie = df[coluna]
-            if serie.dtype == object or serie.apply(lambda v: isinstance(v, list)).any():
-                colunas_texto.append(coluna)
 
-        if not colunas_texto:
-            continue
+class IndiceNomes(dict):
+    """Mapa id -> nome (lookup O(1)) com a Series de lookup pronta para `mapear_serie`.
 
-        colunas_texto.sort(key=_score_coluna)
+    Só de leitura: os índices memoizados são partilhados entre sessões (``dict(indice)``
+    dá uma cópia alterável).
+    """
 
-        for coluna in colunas_texto:
-            serie = df.set_index("id")[coluna].dropna()
-            if serie.empty:
-                continue
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._serie: pd.Series | None = None
+
+    def _so_leitura(self, *args, **kwargs):
+        raise TypeError("IndiceNomes é só de leitura; use dict(indice) para alterar uma cópia.")
+
+    __setitem__ = __delitem__ = __ior__ = _so_leitura
+    update = setdefault = pop = popitem = clear = _so_leitura
+
+    def nome(self, registo_id, padrao=None):
+        return self.get(registo_id, padrao)
+
+    @property
+    def serie(self) -> pd.Series:
+        if self._serie is None:
+            self._serie = pd.Series(self, dtype=object)
+        return self._serie
 
-            serie = serie.apply(lambda v: ", ".join(v) if isinstance(v, list) else v)
-            algum_mapeado = False
-            for idx, valor in serie.items():
-                if not isinstance(valor, str):
-                    valor = str(valor)
-                valor_limpo = valor.strip()
-                if not valor_limpo:
-                    continue
-                if idx not in mapa:
-                    mapa[idx] = valor_limpo
-                    algum_mapeado = True
-            if algum_mapeado:
-                break
 
+@dataclass
+class _IndiceTabela:
+    versao: int
+    colunas_texto: tuple[str, ...]
+    coluna: str | None
+    mapa: dict[str, str]
+
+
+_LOCK_INDICES = threading.Lock()
+_INDICES_POR_TABELA: dict[tuple[str, str], _IndiceTabela] = {}
+_INDICES_COMPOSTOS: "OrderedDict[tuple, IndiceNomes]" = OrderedDict()
+_MAX_INDICES_COMPOSTOS = 32
+
+
+def _score_coluna_nome(coluna: str) -> tuple[int, str]:
+    nome_lower = coluna.lower()
+    if nome_lower in {"nome", "name"}:
+        return (0, nome_lower)
+    if "nome" in nome_lower:
+        return (1, nome_lower)
+    if "name" in nome_lower:
+        return (2, nome_lower)
+    if "email" in nome_lower:
+        return (3, nome_lower)
+    return (4, nome_lower)
+
+
+def _colunas_texto(df: pd.DataFrame) -> tuple[str, ...]:
+    # Colunas com listas têm sempre dtype object, por isso basta olhar para o dtype.
+    colunas = [coluna for coluna in df.columns if coluna != "id" and df[coluna].dtype == object]
+    return tuple(sorted(colunas, key=_score_coluna_nome))
+
+
+def _nomes_da_coluna(df: pd.DataFrame, coluna: str) -> dict[str, str]:
+    """id -> texto não vazio da coluna (listas unidas por ', '), primeiro id repetido ganha."""
+    textos = mapear_serie(df[coluna], {}).astype(str).str.strip().to_numpy()
+    preenchidos = df[coluna].notna().to_numpy() & (textos != "")
+    nomes = pd.Series(textos[preenchidos], index=df["id"].to_numpy()[preenchidos])
+    return nomes[~nomes.index.duplicated()].to_dict()
+
+
+def _construir_indice_tabela(df: pd.DataFrame, versao: int) -> _IndiceTabela:
+    colunas = _colunas_texto(df)
+    for coluna in colunas:
+        mapa = _nomes_da_coluna(df, coluna)
+        if mapa:
+            return _IndiceTabela(versao, colunas, coluna, mapa)
+    return _IndiceTabela(versao, colunas, None, {})
+
+
+def _atualizar_indice_tabela(
+    anterior: _IndiceTabela, df: pd.DataFrame, versao: int, delta: dict
+) -> _IndiceTabela | None:
+    """Aplica um delta (ids alterados/removidos) ao índice anterior; None se for preciso reconstruir."""
+    colunas = _colunas_texto(df)
+    if colunas != anterior.colunas_texto or anterior.coluna is None:
+        return None
+
+    alterados = set(delta.get("alterados") or ())
+    df_alterados = df[df["id"].isin(alterados)]
+    # Uma coluna prioritária que passe a ter valores mudaria a escolha da coluna de nomes.
+    for coluna in colunas[: colunas.index(anterior.coluna)]:
+        if _nomes_da_coluna(df_alterados, coluna):
+            return None
+
+    mapa = dict(anterior.mapa)
+    for registo_id in alterados | set(delta.get("removidos") or ()):
+        mapa.pop(registo_id, None)
+    mapa.update(_nomes_da_coluna(df_alterados, anterior.coluna))
+    if not mapa:
+        return None
+    return _IndiceTabela(versao, colunas, anterior.coluna, mapa)
+
+
+def _indice_tabela(df: pd.DataFrame) -> _IndiceTabela:
+    """Índice de nomes de uma tabela, memoizado pela versão do snapshot (e atualizado por deltas)."""
+    meta = metadados_snapshot(df)
+    if meta is None:
+        return _construir_indice_tabela(df, versao=-1)
+
+    chave = (meta["base_id"], meta["tabela"])
+    versao = meta["versao"]
+    with _LOCK_INDICES:
+        anterior = _INDICES_POR_TABELA.get(chave)
+    if anterior is not None and anterior.versao == versao:
+        return anterior
+
+    indice = None
+    delta = meta.get("delta")
+    if anterior is not None and delta and delta.get("desde") == anterior.versao:
+        indice = _atualizar_indice_tabela(anterior, df, versao, delta)
+    if indice is None:
+        indice = _construir_indice_tabela(df, versao)
+    with _LOCK_INDICES:
+        _INDICES_POR_TABELA[chave] = indice
+    return indice
+
+
+def construir_mapa_nomes_por_id(dataset: dict) -> IndiceNomes:
+    """Cria um dicionário id -> nome usando quaisquer tabelas já carregadas.
+
+    Para snapshots da cache partilhada o índice de cada tabela é construído uma vez por
+    versão (e atualizado com os deltas); o índice combinado é reaproveitado entre reruns
+    enquanto nenhuma tabela mudar de versão.
+    """
+    tabelas = [
+        df for df in dataset.values() if isinstance(df, pd.DataFrame) and not df.empty and "id" in df.columns
+    ]
+    metas = [metadados_snapshot(df) for df in tabelas]
+    chave = None
+    if all(meta is not None for meta in metas):
+        chave = tuple((meta["base_id"], meta["tabela"], meta["versao"]) for meta in metas)
+        with _LOCK_INDICES:
+            if chave in _INDICES_COMPOSTOS:
+                _INDICES_COMPOSTOS.move_to_end(chave)
+                return _INDICES_COMPOSTOS[chave]
+
+    nomes: dict[str, str] = {}
+    for df in tabelas:
+        for registo_id, nome in _indice_tabela(df).mapa.items():
+            nomes.setdefault(registo_id, nome)
+    mapa = IndiceNomes(nomes)
+
+    if chave is not None:
+        with _LOCK_INDICES:
+            _INDICES_COMPOSTOS[chave] = mapa
+            while len(_INDICES_COMPOSTOS) > _MAX_INDICES_COMPOSTOS:
+                _INDICES_COMPOSTOS.popitem(last=False)
     return mapa
 
 
+def normalizar_texto(valor: str) -> str:
+    """Minúsculas sem acentos, para comparar nomes de colunas/etiquetas."""
+    if not isinstance(valor, str):
+        return ""
+    texto = unicodedata.normalize("NFKD", str(valor))
+    return "".join(ch for ch in texto.lower() if not unicodedata.combining(ch))
+
+
+# Campos lógicos -> (candidatos por ordem de preferência, grupos de palavras-chave de recurso).
+CAMPOS_LOGICOS: dict[str, tuple[tuple[str, ...], tuple[tuple[str, ...], ...]]] = {
+    "escuteiro_estorno": (("Escuteiros", "Escuteiro", "Escuteiro(s)", "Escuteiros Relacionados"), ()),
+    "valor_estorno": (
+        ("Valor Estornado", "Valor Estorno", "Valor do Estorno", "Valor", "Valor (€)", "Valor Recebido"),
+        (),
+    ),
+    "data_estorno": (("Data do Estorno", "Date", "Data"), ()),
+    "meio_pagamento": (
+        ("Meio de Pagamento", "Método de Pagamento", "Metodo de Pagamento", "Método", "Metodo"),
+        (),
+    ),
+    "responsavel_estorno": (
+        (
+            "Quem Estornou?",
+            "Quem Estornou",
+            "Quem Recebeu?",
+            "Registado Por",
+            "Responsável",
+            "Criado Por",
+            "Quem devolveu o numerário?",
+            "Quem devolveu o numerario",
+        ),
+        (),
+    ),
+    "motivo_estorno": (
+        ("Tag_Cancelamento", "Tag Cancelamento", "Motivo do Estorno", "Motivo Estorno", "Motivo", "Tag"),
+        (),
+    ),
+    "categoria_recebimento": (("Tag_Recebimento", "Tag Recebimento", "Categoria", "Motivo", "Tag"), ()),
+    "tipo_cotas_nome": (("Tipo de Quotas", "Tipo de Cotas", "Nome", "Name", "Tipo", "Descrição"), ()),
+    "quota_tipo": (
+        ("Tipo", "Tipo de Quota", "Tipo da Quota", "Tipo de Cota", "Categoria", "Tipo de Pagamento"),
+        (("tipo", "quota"), ("tipo",)),
+    ),
+    "quota_periodo": (
+        ("Quota_periodo", "Quota Periodo", "Quota Período", "Quota período", "Quota - Período", "Período"),
+        (("quota", "periodo"), ("quota", "período"), ("periodo",)),
+    ),
+    "quota_data": (
+        (
+            "Data da Cobrança",
+            "Data da cobrança",
+            "Data cobrança",
+            "Data de Cobrança",
+            "Data de cobrança",
+            "Data",
+        ),
+        (("data", "cobranca"), ("data", "cobrança"), ("data",)),
+    ),
+    "quota_escuteiro": (
+        ("Escuteiro", "Escuteiros", "Nome do Escuteiro", "Nome do Escuteiro (from Escuteiros)", "Responsável"),
+        (("escuteiro",), ("nome", "escuteiro")),
+    ),
+    "quota_valor": (
+        ("Valor", "Valor (€)", "Valor da Quota", "Valor da quota", "Valor de Cobrança", "Valor Recebido"),
+        (("valor",), ("montante",)),
+    ),
+    "voluntariado_evento": (
+        (
+            "Record_ID Calendário (from Date ( calendário ))",
+            "Record_ID Calendário (from Date (calendário))",
+            "Record_ID Calendario (from Date ( calendario ))",
+            "Date ( calendário )",
+            "Date (calendário)",
+            "Date ( calendario )",
+        ),
+        (),
+    ),
+}
+
+_LOCK_COLUNAS = threading.Lock()
+_RESOLUCOES_COLUNAS: dict[tuple, str | None] = {}
+_MAX_RESOLUCOES_COLUNAS = 4096
+
+
+def _resolver_coluna_sem_cache(
+    colunas: tuple[str, ...],
+    candidatos: tuple[str, ...],
+    palavras_chave: tuple[tuple[str, ...], ...],
+    aproximado: bool,
+) -> str | None:
+    # Mesma ordem das funções que substitui: `escolher_coluna` (aproximado) nunca dava
+    # prioridade à grafia exata; os `_first_existing` das páginas só a aceitavam.
+    if not aproximado:
+        for candidato in candidatos:
+            if candidato in colunas:
+                return candidato
+    else:
+        normalizados = {col.lower().strip(): col for col in colunas}
+        for candidato in candidatos:
+            chave = candidato.lower().strip()
+            if chave in normalizados:
+                return normalizados[chave]
+        for candidato in candidatos:
+            chave = candidato.lower().strip()
+            for coluna in colunas:
+                if chave in coluna.lower().strip():
+                    return coluna
+
+    if palavras_chave:
+        colunas_norm = [(coluna, normalizar_texto(coluna)) for coluna in colunas]
+        for grupo in palavras_chave:
+            tokens = [normalizar_texto(token) for token in grupo if token]
+            if not tokens:
+                continue
+            for coluna, nome_norm in colunas_norm:
+                if all(token in nome_norm for token in tokens):
+                    return coluna
+    return None
+
+
+def resolver_coluna(
+    df: pd.DataFrame | None,
+    candidatos,
+    palavras_chave=(),
+    *,
+    aproximado: bool = False,
+) -> str | None:
+    """Primeira coluna existente entre `candidatos` (e, se nada bater, por palavras-chave).
+
+    A resolução é memoizada pelo esquema (tuplo de colunas) do DataFrame, por isso reruns
+    e chamadas repetidas não voltam a normalizar nomes. `aproximado` replica o
+    `escolher_coluna`: ignora maiúsculas e aceita correspondência parcial.
+    """
+    if df is None:
+        return None
+    colunas = tuple(str(coluna) for coluna in df.columns)
+    chave = (colunas, tuple(candidatos), tuple(tuple(grupo) for grupo in palavras_chave), aproximado)
+    with _LOCK_COLUNAS:
+        if chave in _RESOLUCOES_COLUNAS:
+            return _RESOLUCOES_COLUNAS[chave]
+    resultado = _resolver_coluna_sem_cache(*chave)
+    with _LOCK_COLUNAS:
+        if len(_RESOLUCOES_COLUNAS) >= _MAX_RESOLUCOES_COLUNAS:
+            _RESOLUCOES_COLUNAS.clear()
+        _RESOLUCOES_COLUNAS[chave] = resultado
+    return resultado
+
+
+def resolver_campo(df: pd.DataFrame | None, campo: str, *, aproximado: bool = False) -> str | None:
+    """Coluna real do campo lógico `campo` (ver `CAMPOS_LOGICOS`) neste DataFrame."""
+    candidatos, palavras_chave = CAMPOS_LOGICOS[campo]
+    return resolver_coluna(df, candidatos, palavras_chave, aproximado=aproximado)
+
+
 def escolher_coluna(df: pd.DataFrame, candidatos: list[str]) -> str | None:
     if df is None or df.empty:
         return None
-
-    colunas = list(df.columns)
-    normalizados = {col.lower().strip(): col for col in colunas}
-    for candidato in candidatos:
-        chave = candidato.lower().strip()
-        if chave in normalizados:
-            return normalizados[chave]
-
-    for candidato in candidatos:
-        chave = candidato.lower().strip()
-        for coluna in colunas:
-            if chave in coluna.lower().strip():
-                return coluna
-    return None
+    return resolver_coluna(df, candidatos, aproximado=True)
 
 
 def preparar_dataframe_estornos(
@@ -168,52 +469,17 @@ def preparar_dataframe_estornos(
         if df_trabalho.empty:
             return pd.DataFrame()
 
-    coluna_escuteiro = escolher_coluna(df_trabalho, ["Escuteiros", "Escuteiro", "Escuteiro(s)", "Escuteiros Relacionados"])
-    coluna_valor = escolher_coluna(
-        df_trabalho,
-        [
-            "Valor Estornado",
-            "Valor Estorno",
-            "Valor do Estorno",
-            "Valor",
-            "Valor (€)",
-            "Valor Recebido",
-        ],
-    )
-    coluna_data = escolher_coluna(df_trabalho, ["Data do Estorno", "Date", "Data"])
-    coluna_meio = escolher_coluna(
-        df_trabalho,
-        ["Meio de Pagamento", "Método de Pagamento", "Metodo de Pagamento", "Método", "Metodo"],
-    )
-    coluna_responsavel = escolher_coluna(
-        df_trabalho,
-        [
-            "Quem Estornou?",
-            "Quem Estornou",
-            "Quem Recebeu?",
-            "Registado Por",
-            "Responsável",
-            "Criado Por",
-            "Quem devolveu o numerário?",
-            "Quem devolveu o numerario",
-        ],
-    )
-    coluna_motivo = escolher_coluna(
-        df_trabalho,
-        [
-            "Tag_Cancelamento",
-            "Tag Cancelamento",
-            "Motivo do Estorno",
-            "Motivo Estorno",
-            "Motivo",
-            "Tag",
-        ],
-    )
+    coluna_escuteiro = resolver_campo(df_trabalho, "escuteiro_estorno", aproximado=True)
+    coluna_valor = resolver_campo(df_trabalho, "valor_estorno", aproximado=True)
+    coluna_data = resolver_campo(df_trabalho, "data_estorno", aproximado=True)
+    coluna_meio = resolver_campo(df_trabalho, "meio_pagamento", aproximado=True)
+    coluna_responsavel = resolver_campo(df_trabalho, "responsavel_estorno", aproximado=True)
+    coluna_motivo = resolver_campo(df_trabalho, "motivo_estorno", aproximado=True)
 
     resultado = pd.DataFrame(index=df_trabalho.index)
 
     if coluna_escuteiro:
-        resultado["Escuteiro"] = df_trabalho[coluna_escuteiro].apply(lambda valor: mapear_lista(valor, escuteiros_map))
+        resultado["Escuteiro"] = mapear_serie(df_trabalho[coluna_escuteiro], escuteiros_map)
 
     if coluna_valor:
         def _extrair_valor(valor):
@@ -236,24 +502,13 @@ def preparar_dataframe_estornos(
         resultado["Data"] = pd.to_datetime(datas, errors="coerce").dt.normalize()
 
     if coluna_responsavel:
-        def _mapear_responsavel(valor):
-            if permissoes_map:
-                texto = mapear_lista(valor, permissoes_map)
-                if texto:
-                    return texto
-            if mapa_nomes_ids:
-                texto = mapear_lista(valor, mapa_nomes_ids)
-                if texto:
-                    return texto
-            if escuteiros_map:
-                texto = mapear_lista(valor, escuteiros_map)
-                if texto:
-                    return texto
-            return mapear_lista(valor, {})
-
-        resultado["Responsável"] = df_trabalho[coluna_responsavel].apply(_mapear_responsavel)
+        # Em cascata, o primeiro mapa não vazio resolve sempre (ids desconhecidos ficam como estão).
+        resultado["Responsável"] = mapear_serie(
+            df_trabalho[coluna_responsavel],
+            primeiro_mapa_preenchido(permissoes_map, mapa_nomes_ids, escuteiros_map),
+        )
     if coluna_motivo:
-        resultado["Categoria"] = df_trabalho[coluna_motivo].apply(lambda valor: mapear_lista(valor, {}))
+        resultado["Categoria"] = mapear_serie(df_trabalho[coluna_motivo], {})
 
     resultado = resultado.dropna(how="all")
     if "Valor (€)" in resultado.columns:
@@ -262,77 +517,84 @@ def preparar_dataframe_estornos(
     return resultado
 
 
-def preparar_dataframe_recebimentos(
-    dados: dict,
-) -> tuple[pd.DataFrame, dict[str, str], dict[str, str], dict[str, str]]:
-    """Normaliza e enriquece a tabela de Recebimento para reutilização nas vistas."""
-    df_rec = dados.get("Recebimento", pd.DataFrame())
-    df_rec_limpo = pd.DataFrame()
+COLUNAS_MOVIMENTOS = ["Escuteiro", "Valor (€)", "Categoria", "Meio de Pagamento", "Data", "Responsável"]
 
+
+def _movimentos_vazio() -> pd.DataFrame:
+    vazio = pd.DataFrame(columns=COLUNAS_MOVIMENTOS)
+    vazio["Valor (€)"] = pd.Series(dtype="float64")
+    vazio["Data"] = pd.Series(dtype="datetime64[ns]")
+    return vazio
+
+
+def _mapa_escuteiros(dados: dict) -> IndiceNomes:
     df_escuteiros = dados.get("Escuteiros", pd.DataFrame())
-    escuteiros_map: dict[str, str] = {}
     if isinstance(df_escuteiros, pd.DataFrame) and not df_escuteiros.empty and "id" in df_escuteiros.columns:
         for coluna_nome in ("Nome do Escuteiro", "Escuteiro", "Nome"):
             if coluna_nome in df_escuteiros.columns:
-                escuteiros_map = (
-                    df_escuteiros.set_index("id")[coluna_nome].dropna().to_dict()
-                )
-                break
-
-    coluna_categoria = escolher_coluna(
-        df_rec,
-        [
-            "Tag_Recebimento",
-            "Tag Recebimento",
-            "Categoria",
-            "Motivo",
-            "Tag",
-        ],
-    )
+                return IndiceNomes(df_escuteiros.set_index("id")[coluna_nome].dropna().to_dict())
+    return IndiceNomes()
+
 
-    if isinstance(df_rec, pd.DataFrame) and not df_rec.empty:
-        colunas_uteis = ["Escuteiros", "Valor Recebido", "Meio de Pagamento", "Date", "Quem Recebeu?"]
-        colunas_existentes = [c for c in colunas_uteis if c in df_rec.columns]
-        df_rec_limpo = df_rec[colunas_existentes].copy()
+def preparar_dataframe_recebimentos(
+    dados: dict,
+    *,
+    incluir_record_id: bool = False,
+) -> tuple[pd.DataFrame, dict[str, str], dict[str, str], dict[str, str]]:
+    """Normaliza e enriquece a tabela de Recebimento para reutilização nas vistas.
+
+    Com `incluir_record_id` acrescenta a coluna auxiliar `__record_id` (edição no dashboard).
+    """
+    df_rec = dados.get("Recebimento", pd.DataFrame())
+    colunas_saida = COLUNAS_MOVIMENTOS + (["__record_id"] if incluir_record_id else [])
 
-        df_rec_limpo = df_rec_limpo.rename(columns={
+    colunas_uteis = ["Escuteiros", "Valor Recebido", "Meio de Pagamento", "Date", "Quem Recebeu?"]
+    colunas_existentes = (
+        [col for col in colunas_uteis if col in df_rec.columns] if isinstance(df_rec, pd.DataFrame) else []
+    )
+    if not colunas_existentes:
+        vazio = _movimentos_vazio()
+        if incluir_record_id:
+            vazio["__record_id"] = pd.Series(dtype=object)
+        return vazio, IndiceNomes(), IndiceNomes(), construir_mapa_nomes_por_id(dados)
+
+    df_limpo = df_rec[colunas_existentes].copy().rename(
+        columns={
             "Escuteiros": "Escuteiro",
             "Valor Recebido": "Valor (€)",
-            "Meio de Pagamento": "Meio de Pagamento",
             "Date": "Data",
             "Quem Recebeu?": "Quem Recebeu",
-        })
+        }
+    )
+    if incluir_record_id:
+        df_limpo["__record_id"] = df_rec["id"] if "id" in df_rec.columns else ""
 
-        if coluna_categoria:
-            def _normalizar_categoria(valor):
-                if isinstance(valor, list):
-                    return ", ".join(str(item) for item in valor if str(item).strip())
-                return valor
+    coluna_categoria = escolher_coluna(df_rec, list(CAMPOS_LOGICOS["categoria_recebimento"][0]))
+    if coluna_categoria:
+        def _normalizar_categoria(valor):
+            if isinstance(valor, list):
+                return ", ".join(str(item) for item in valor if str(item).strip())
+            return valor
 
-            df_rec_limpo["Categoria"] = df_rec[coluna_categoria].apply(_normalizar_categoria)
+        df_limpo["Categoria"] = df_rec[coluna_categoria].apply(_normalizar_categoria)
 
-        if escuteiros_map and "Escuteiro" in df_rec_limpo.columns:
-            df_rec_limpo["Escuteiro"] = df_rec_limpo["Escuteiro"].apply(
-                lambda valor: mapear_lista(valor, escuteiros_map)
-            )
+    escuteiros_map = _mapa_escuteiros(dados)
+    if escuteiros_map and "Escuteiro" in df_limpo.columns:
+        df_limpo["Escuteiro"] = mapear_serie(df_limpo["Escuteiro"], escuteiros_map)
 
     df_permissoes = dados.get("Permissoes", pd.DataFrame())
-    permissoes_map: dict[str, str] = {}
+    permissoes_map = IndiceNomes()
     if isinstance(df_permissoes, pd.DataFrame) and not df_permissoes.empty:
         permissoes_map = construir_mapa_nomes_por_id({"Permissoes": df_permissoes})
 
     mapa_nomes_ids = construir_mapa_nomes_por_id(dados)
 
-    if not df_rec_limpo.empty and "Quem Recebeu" in df_rec_limpo.columns:
-        df_rec_original = dados.get("Recebimento", pd.DataFrame())
-        candidatos_quem_recebeu = []
-        if isinstance(df_rec_original, pd.DataFrame):
-            candidatos_quem_recebeu = [
-                col
-                for col in df_rec_original.columns
-                if col not in {"Quem Recebeu?", "Quem recebeu?_OLD"}
-                and col.lower().startswith("quem recebeu")
-            ]
+    if "Quem Recebeu" in df_limpo.columns:
+        candidatos_quem_recebeu = [
+            col
+            for col in df_rec.columns
+            if col not in {"Quem Recebeu?", "Quem recebeu?_OLD"} and col.lower().startswith("quem recebeu")
+        ]
 
         def _score_coluna(coluna: str) -> tuple[int, str]:
             nome_lower = coluna.lower()
@@ -342,52 +604,383 @@ def preparar_dataframe_recebimentos(
                 return (1, nome_lower)
             return (2, nome_lower)
 
-        coluna_nome_quem_recebeu = None
         if candidatos_quem_recebeu:
-            candidatos_quem_recebeu.sort(key=_score_coluna)
-            coluna_nome_quem_recebeu = candidatos_quem_recebeu[0]
-
-        if coluna_nome_quem_recebeu and isinstance(df_rec_original, pd.DataFrame):
-            df_rec_limpo["Quem Recebeu"] = df_rec_original[coluna_nome_quem_recebeu].apply(
-                lambda valor: mapear_lista(valor, {})
-            )
-        elif permissoes_map:
-            df_rec_limpo["Quem Recebeu"] = df_rec_limpo["Quem Recebeu"].apply(
-                lambda valor: mapear_lista(valor, permissoes_map)
-            )
-        elif mapa_nomes_ids:
-            df_rec_limpo["Quem Recebeu"] = df_rec_limpo["Quem Recebeu"].apply(
-                lambda valor: mapear_lista(valor, mapa_nomes_ids)
-            )
-        elif escuteiros_map:
-            df_rec_limpo["Quem Recebeu"] = df_rec_limpo["Quem Recebeu"].apply(
-                lambda valor: mapear_lista(valor, escuteiros_map)
+            coluna_nome_quem_recebeu = sorted(candidatos_quem_recebeu, key=_score_coluna)[0]
+            df_limpo["Quem Recebeu"] = mapear_serie(df_rec[coluna_nome_quem_recebeu], {})
+        elif permissoes_map or mapa_nomes_ids or escuteiros_map:
+            df_limpo["Quem Recebeu"] = mapear_serie(
+                df_limpo["Quem Recebeu"],
+                primeiro_mapa_preenchido(permissoes_map, mapa_nomes_ids, escuteiros_map),
             )
 
-    if not df_rec_limpo.empty and "Valor (€)" in df_rec_limpo.columns:
-        df_rec_limpo["Valor (€)"] = pd.to_numeric(df_rec_limpo["Valor (€)"], errors="coerce")
+    if "Valor (€)" in df_limpo.columns:
+        df_limpo["Valor (€)"] = pd.to_numeric(df_limpo["Valor (€)"], errors="coerce")
+    else:
+        df_limpo["Valor (€)"] = pd.Series(dtype="float64")
 
-    if not df_rec_limpo.empty and "Data" in df_rec_limpo.columns:
-        df_rec_limpo["Data"] = pd.to_datetime(df_rec_limpo["Data"], errors="coerce").dt.normalize()
+    if "Data" in df_limpo.columns:
+        df_limpo["Data"] = pd.to_datetime(df_limpo["Data"], errors="coerce").dt.normalize()
+    else:
+        df_limpo["Data"] = pd.Series(dtype="datetime64[ns]")
 
-    colunas_desejadas = ["Escuteiro", "Valor (€)", "Categoria", "Meio de Pagamento", "Data", "Responsável"]
+    if "Categoria" in df_limpo.columns:
+        df_limpo["Categoria"] = mapear_serie(df_limpo["Categoria"], {})
+    else:
+        df_limpo["Categoria"] = ""
 
-    if not df_rec_limpo.empty:
-        if "Categoria" in df_rec_limpo.columns:
-            df_rec_limpo["Categoria"] = df_rec_limpo["Categoria"].apply(lambda valor: mapear_lista(valor, {}))
-        else:
-            df_rec_limpo["Categoria"] = ""
+    if "Quem Recebeu" in df_limpo.columns:
+        df_limpo.rename(columns={"Quem Recebeu": "Responsável"}, inplace=True)
+    else:
+        df_limpo["Responsável"] = ""
+
+    for coluna in ("Escuteiro", "Categoria", "Meio de Pagamento", "Responsável"):
+        if coluna not in df_limpo.columns:
+            df_limpo[coluna] = ""
+
+    return df_limpo[colunas_saida], escuteiros_map, permissoes_map, mapa_nomes_ids
+
+
+def normalizar_dataframe_movimentos(df: pd.DataFrame | None) -> pd.DataFrame:
+    """Garante as colunas/tipos comuns de recebimentos e estornos (mantém `__record_id` se existir)."""
+    if df is None or not isinstance(df, pd.DataFrame) or df.empty:
+        return _movimentos_vazio()
+
+    resultado = df.copy()
+    if "Valor (€)" in resultado.columns:
+        resultado["Valor (€)"] = pd.to_numeric(resultado["Valor (€)"], errors="coerce")
+    else:
+        resultado["Valor (€)"] = pd.Series(dtype="float64")
+
+    if "Data" in resultado.columns:
+        resultado["Data"] = pd.to_datetime(resultado["Data"], errors="coerce").dt.normalize()
+    else:
+        resultado["Data"] = pd.Series(dtype="datetime64[ns]")
+
+    for coluna in COLUNAS_MOVIMENTOS:
+        if coluna not in resultado.columns:
+            resultado[coluna] = ""
+
+    colunas_ordem = COLUNAS_MOVIMENTOS + (["__record_id"] if "__record_id" in resultado.columns else [])
+    return resultado[colunas_ordem]
+
+
+@dataclass(frozen=True)
+class MovimentosFinanceiros:
+    """Recebimentos e estornos normalizados, mais os mapas de nomes usados para os resolver."""
+
+    recebimentos: pd.DataFrame
+    estornos: pd.DataFrame
+    escuteiros_map: dict
+    permissoes_map: dict
+    mapa_nomes_ids: dict
+
+    def copia(self) -> "MovimentosFinanceiros":
+        # Os DataFrames memoizados são partilhados entre sessões: cada chamador recebe cópias
+        # (os mapas são `IndiceNomes`, só de leitura).
+        return MovimentosFinanceiros(
+            self.recebimentos.copy(),
+            self.estornos.copy(),
+            self.escuteiros_map,
+            self.permissoes_map,
+            self.mapa_nomes_ids,
+        )
+
+
+_MOVIMENTOS_MEMO: "OrderedDict[tuple, MovimentosFinanceiros]" = OrderedDict()
+_MAX_MOVIMENTOS_MEMO = 16
+
+
+def _chave_versoes(dados: dict) -> tuple | None:
+    """Chave (tabela, versão) de todos os snapshots do dataset; None se algum não for um snapshot intacto."""
+    chave = []
+    for nome, df in sorted(dados.items(), key=lambda item: item[0]):
+        if not isinstance(df, pd.DataFrame):
+            continue
+        meta = metadados_snapshot(df)
+        if meta is None:
+            if df.empty and not len(df.columns):
+                continue  # tabela opcional em falta
+            return None
+        chave.append((nome, meta["base_id"], meta["tabela"], meta["versao"]))
+    return tuple(chave)
+
+
+def preparar_movimentos_financeiros(dados: dict, *, incluir_record_id: bool = False) -> MovimentosFinanceiros:
+    """Pipeline único de recebimentos/estornos, memoizado pelas versões dos snapshots.
+
+    Chamadas sobre os snapshots partilhados (com ``META_SNAPSHOT``) reaproveitam os
+    DataFrames já normalizados; cópias de sessão, que podem ter sido alteradas, são
+    sempre recalculadas.
+    """
+    chave_versoes = _chave_versoes(dados)
+    chave = None if chave_versoes is None else (chave_versoes, incluir_record_id)
+    if chave is not None:
+        with _LOCK_INDICES:
+            memo = _MOVIMENTOS_MEMO.get(chave)
+            if memo is not None:
+                _MOVIMENTOS_MEMO.move_to_end(chave)
+        if memo is not None:
+            return memo.copia()
+
+    df_rec, escuteiros_map, permissoes_map, mapa_nomes_ids = preparar_dataframe_recebimentos(
+        dados, incluir_record_id=incluir_record_id
+    )
+    df_estornos = normalizar_dataframe_movimentos(
+        preparar_dataframe_estornos(dados, escuteiros_map, permissoes_map, mapa_nomes_ids)
+    )
+    resultado = MovimentosFinanceiros(df_rec, df_estornos, escuteiros_map, permissoes_map, mapa_nomes_ids)
+
+    if chave is not None:
+        with _LOCK_INDICES:
+            _MOVIMENTOS_MEMO[chave] = resultado
+            while len(_MOVIMENTOS_MEMO) > _MAX_MOVIMENTOS_MEMO:
+                _MOVIMENTOS_MEMO.popitem(last=False)
+    return resultado.copia()
+
+
+COLUNAS_EMAIL_LOGIN = ("Email", "Email Alternativo")
 
-        if "Quem Recebeu" in df_rec_limpo.columns:
-            df_rec_limpo.rename(columns={"Quem Recebeu": "Responsável"}, inplace=True)
-        else:
-            df_rec_limpo["Responsável"] = ""
 
-        for coluna in colunas_desejadas:
-            if coluna not in df_rec_limpo.columns:
-                df_rec_limpo[coluna] = ""
-        df_rec_limpo = df_rec_limpo[colunas_desejadas]
+@dataclass
+class _IndiceEmails:
+    versao: int
+    ids_por_email: dict[str, list[str]]
+    registos: dict[str, dict]
+
+
+_INDICES_EMAILS: dict[tuple[str, str], _IndiceEmails] = {}
+
+
+def _emails_do_registo(registo: dict) -> set[str]:
+    emails: set[str] = set()
+    for coluna in COLUNAS_EMAIL_LOGIN:
+        valor = registo["fields"].get(coluna)
+        for item in valor if isinstance(valor, list) else [valor]:
+            if isinstance(item, str) and item.strip():
+                emails.add(item.strip().lower())
+    return emails
+
+
+def _indexar_registos(indice: _IndiceEmails, df: pd.DataFrame) -> None:
+    for registo in dataframe_para_registos(df):
+        indice.registos[registo["id"]] = registo
+        for email in _emails_do_registo(registo):
+            indice.ids_por_email.setdefault(email, []).append(registo["id"])
+
+
+def _indice_emails(df: pd.DataFrame) -> _IndiceEmails:
+    """Índice email -> registos de Escuteiros, memoizado pela versão do snapshot e atualizado por deltas."""
+    meta = metadados_snapshot(df)
+    versao = meta["versao"] if meta else -1
+    chave = (meta["base_id"], meta["tabela"]) if meta else None
+    with _LOCK_INDICES:
+        anterior = _INDICES_EMAILS.get(chave) if chave else None
+    if anterior is not None and anterior.versao == versao:
+        return anterior
+
+    delta = meta.get("delta") if meta else None
+    if anterior is not None and delta and delta.get("desde") == anterior.versao:
+        afetados = set(delta.get("alterados") or ()) | set(delta.get("removidos") or ())
+        indice = _IndiceEmails(
+            versao,
+            {email: list(ids) for email, ids in anterior.ids_por_email.items()},
+            dict(anterior.registos),
+        )
+        for registo_id in afetados:
+            registo = indice.registos.pop(registo_id, None)
+            for email in _emails_do_registo(registo) if registo else ():
+                ids = indice.ids_por_email.get(email, [])
+                if registo_id in ids:
+                    ids.remove(registo_id)
+                if not ids:
+                    indice.ids_por_email.pop(email, None)
+        _indexar_registos(indice, df[df["id"].isin(set(delta.get("alterados") or ()))])
     else:
-        df_rec_limpo = pd.DataFrame(columns=colunas_desejadas)
+        indice = _IndiceEmails(versao, {}, {})
+        if "id" in df.columns:
+            _indexar_registos(indice, df)
+
+    if chave:
+        with _LOCK_INDICES:
+            _INDICES_EMAILS[chave] = indice
+    return indice
+
+
+def ids_por_email(df_escuteiros: pd.DataFrame, email: str) -> list[str]:
+    """Ids de Escuteiros com `email` em Email/Email Alternativo segundo o snapshot.
+
+    Lookup O(1) sobre um índice construído uma vez por versão do snapshot partilhado.
+    Serve só para localizar registos: o snapshot pode estar desatualizado, por isso
+    senhas e permissões têm de ser lidas de novo no Airtable.
+    """
+    if df_escuteiros is None or df_escuteiros.empty:
+        return []
+    indice = _indice_emails(df_escuteiros)
+    return list(indice.ids_por_email.get((email or "").strip().lower(), []))
+
+
+def registo_tem_email(registo: dict, email: str) -> bool:
+    """O registo (formato Airtable) tem `email` em Email/Email Alternativo."""
+    return (email or "").strip().lower() in _emails_do_registo(registo)
+
+
+def _contem_algum_id(valor, ids: set[str]) -> bool:
+    if isinstance(valor, list):
+        return any(item in ids for item in valor)
+    if pd.isna(valor):
+        return False
+    return valor in ids
 
-    return df_rec_limpo, escuteiros_map, permissoes_map, mapa_nomes_ids
+
+def _literal_formula(valor) -> str:
+    """Texto entre aspas, com escapes, para usar numa fórmula Airtable."""
+    return json.dumps(str(valor), ensure_ascii=False)
+
+
+def _formula_ou(termos: list[str]) -> str:
+    return termos[0] if len(termos) == 1 else f"OR({', '.join(termos)})"
+
+
+def formula_por_ids(ids: Iterable[str]) -> str:
+    """`filterByFormula` que devolve só os registos com os ids indicados."""
+    return _formula_ou([f"RECORD_ID()={_literal_formula(i)}" for i in sorted(set(ids))])
+
+
+def formula_campo_igual(campo: str, valores: Iterable[str]) -> str:
+    """`filterByFormula` para registos em que o campo de texto `campo` vale algum dos `valores`."""
+    return _formula_ou([f"{{{campo}}}={_literal_formula(v)}" for v in sorted(set(valores))])
+
+
+def formula_link_contem(campo: str, valores: Iterable[str]) -> str:
+    """`filterByFormula` para registos cujo link `campo` inclua algum dos `valores`.
+
+    Nas fórmulas um link vale os campos primários dos registos ligados (não os ids);
+    a comparação é feita entre separadores, mas nomes com vírgulas podem dar falsos
+    positivos, por isso o resultado deve ser confirmado pelos ids.
+    """
+    lista = f'", " & ARRAYJOIN({{{campo}}}, ", ") & ", "'
+    return _formula_ou([f"FIND({_literal_formula(f', {v}, ')}, {lista})" for v in sorted(set(valores))])
+
+
+# Chaves da sessão com as linhas da família autenticada (role "pais").
+TABELAS_DA_FAMILIA = {"Escuteiros": "Escuteiros da família", "Pedidos": "Pedidos da família"}
+# Colunas de Escuteiros que qualquer sessão pode ver (nomes para resolver links).
+COLUNAS_NOMES_ESCUTEIROS = ["id", "Nome do Escuteiro"]
+
+
+def filtrar_dados_por_utilizador(dados: dict, role: str | None, user: dict | None) -> dict:
+    """Separa as linhas que a família autenticada pode ver das tabelas partilhadas.
+
+    Apenas o role "pais" sem acesso total é filtrado: os Escuteiros associados e os
+    Pedidos desses escuteiros ficam em ``TABELAS_DA_FAMILIA`` (é aí que o painel dos
+    pais os mostra). "Escuteiros" fica com todos os escuteiros mas só id e nome, para
+    as outras vistas resolverem links; "Pedidos" completos saem da sessão. Se as chaves
+    da família já vierem preenchidas (filtro feito no Airtable), são essas as filtradas.
+    """
+    if role != "pais" or not user or user.get("all_access"):
+        return dados
+
+    ids = {str(valor) for valor in (user.get("escuteiros_ids") or []) if valor}
+    if not ids:
+        return dados
+
+    filtrados = dict(dados)
+
+    df_escuteiros = dados.get("Escuteiros")
+    if isinstance(df_escuteiros, pd.DataFrame) and not df_escuteiros.empty and "id" in df_escuteiros.columns:
+        colunas = [c for c in COLUNAS_NOMES_ESCUTEIROS if c in df_escuteiros.columns]
+        nomes = df_escuteiros[colunas].copy()
+        nomes.attrs.pop(META_SNAPSHOT, None)
+        filtrados["Escuteiros"] = nomes
+
+    df_familia = dados.get(TABELAS_DA_FAMILIA["Escuteiros"], df_escuteiros)
+    if isinstance(df_familia, pd.DataFrame) and not df_familia.empty and "id" in df_familia.columns:
+        familia = df_familia[df_familia["id"].isin(ids)].reset_index(drop=True)
+        familia.attrs.pop(META_SNAPSHOT, None)
+        filtrados[TABELAS_DA_FAMILIA["Escuteiros"]] = familia
+
+    df_pedidos = filtrados.pop("Pedidos", None)
+    df_pedidos = dados.get(TABELAS_DA_FAMILIA["Pedidos"], df_pedidos)
+    if isinstance(df_pedidos, pd.DataFrame) and not df_pedidos.empty:
+        coluna = next((c for c in ("Escuteiros", "Escuteiro") if c in df_pedidos.columns), None)
+        if coluna:
+            mask = df_pedidos[coluna].apply(lambda valor: _contem_algum_id(valor, ids))
+            familia = df_pedidos[mask].reset_index(drop=True)
+            familia.attrs.pop(META_SNAPSHOT, None)
+            filtrados[TABELAS_DA_FAMILIA["Pedidos"]] = familia
+
+    return filtrados
+
+DIAS_SEMANA = ["Segunda-feira", "Terça-feira", "Quarta-feira", "Quinta-feira", "Sexta-feira", "Sábado", "Domingo"]
+
+
+def _domingo_de_pascoa(ano: int) -> date:
+    """Algoritmo de Meeus/Jones/Butcher (calendário gregoriano)."""
+    a, b, c = ano % 19, ano // 100, ano % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mes = (h + l - 7 * m + 114) // 31
+    dia = (h + l - 7 * m + 114) % 31 + 1
+    return date(ano, mes, dia)
+
+
+def feriados_nacionais(ano: int) -> dict[date, str]:
+    """Feriados nacionais portugueses (fixos e móveis) de um ano."""
+    pascoa = _domingo_de_pascoa(ano)
+    return {
+        date(ano, 1, 1): "Ano Novo",
+        pascoa - timedelta(days=2): "Sexta-feira Santa",
+        pascoa: "Páscoa",
+        date(ano, 4, 25): "Dia da Liberdade",
+        date(ano, 5, 1): "Dia do Trabalhador",
+        pascoa + timedelta(days=60): "Corpo de Deus",
+        date(ano, 6, 10): "Dia de Portugal",
+        date(ano, 8, 15): "Assunção de Nossa Senhora",
+        date(ano, 10, 5): "Implantação da República",
+        date(ano, 11, 1): "Dia de Todos os Santos",
+        date(ano, 12, 1): "Restauração da Independência",
+        date(ano, 12, 8): "Imaculada Conceição",
+        date(ano, 12, 25): "Natal",
+    }
+
+
+def gerar_datas_recorrentes(
+    inicio: date,
+    fim: date,
+    dia_semana: int,
+    *,
+    intervalo_semanas: int = 1,
+    excluir: Iterable[date] = (),
+    excluir_feriados: bool = False,
+) -> tuple[list[date], list[tuple[date, str]]]:
+    """Datas no `dia_semana` (0 = segunda) entre `inicio` e `fim`, a cada `intervalo_semanas`.
+
+    Devolve as datas a criar e as excluídas com o motivo (feriado ou exclusão manual).
+    """
+    if fim < inicio:
+        raise ValueError("A data de fim tem de ser posterior à de início.")
+    if intervalo_semanas < 1:
+        raise ValueError("O intervalo tem de ser de pelo menos uma semana.")
+    excluir = set(excluir)
+    feriados: dict[date, str] = {}
+    if excluir_feriados:
+        for ano in range(inicio.year, fim.year + 1):
+            feriados.update(feriados_nacionais(ano))
+
+    datas: list[date] = []
+    excluidas: list[tuple[date, str]] = []
+    atual = inicio + timedelta(days=(dia_semana - inicio.weekday()) % 7)
+    while atual <= fim:
+        if atual in feriados:
+            excluidas.append((atual, feriados[atual]))
+        elif atual in excluir:
+            excluidas.append((atual, "Excluída"))
+        else:
+            datas.append(atual)
+        atual += timedelta(weeks=intervalo_semanas)
+    return datas, excluidas
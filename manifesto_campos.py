@@ -0,0 +1,120 @@
+"""Campos Airtable pedidos por cada vista, role e tabela (`fields=[...]` nos loaders).
+
+Tabelas ausentes do manifesto são descarregadas por inteiro. Só entram aqui tabelas
+cujos consumidores leem colunas por nome exato: as vistas que procuram colunas por
+candidatos/palavras-chave (``escolher_coluna``, ``construir_mapa_nomes_por_id``,
+páginas que partilham ``dados_cache``) precisam da tabela completa.
+Se algum campo listado não existir na base, o loader recai sobre o download completo.
+
+Vistas: ``home`` (``dados_cache``), ``estatisticas`` e ``tombola`` (``_table_df``, por
+chave de ``TOMBOLA_TABLE_*``). Na ``home`` só Escuteiros é projetado (as outras tabelas
+são lidas por candidatos); os pais veem o painel da família, tesoureiro e admin
+também a tesouraria e a conta corrente, e o admin os registos recentes.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Tuple
+
+
+_ESTATISTICAS_ESCUTEIROS = (
+    "Nome do Escuteiro",
+    "Conta Corrente",
+    "Quota Mensal",
+    "Quota Anual",
+)
+_ESTATISTICAS_MENU = (
+    "Data (from Publicação Filtro)",
+    "Date (from Marcação dos Pais na preparação do Lanche)",
+    "Count (Pedidos)",
+    "Cancelado ?",
+    "Lanches",
+    "Bebidas",
+    "Fruta",
+)
+_ESTATISTICAS_VOLUNTARIADO = (
+    "Cancelado",
+    "Week Nun Pai Voluntário",
+)
+
+_ESTATISTICAS = {
+    "Escuteiros": _ESTATISTICAS_ESCUTEIROS,
+    "Publicar Menu do Scouts": _ESTATISTICAS_MENU,
+    "Voluntariado Pais": _ESTATISTICAS_VOLUNTARIADO,
+}
+
+_ESCUTEIROS_PAINEL = (
+    "Nome do Escuteiro",
+    "ID_Escuteiro",
+    "Pre_Field escolha semanal lanches",
+    "Link Forms_Voluntariado Pre_Field",
+    "Conta Corrente",
+    "Lanches",
+    "Numero de Lanches",
+    "Valores doados",
+    "Saldo Lanches",
+    "Vls recebidos lanches",
+    "Vls Estornados Lanches",
+    "Saldo Quota Mensal",
+    "Vls recebidos quotas mensal",
+    "Vls Estornados Quotas Mensal",
+    "Saldo Quota Anual",
+    "Vls recebidos quotas anual",
+    "Vls Estornados Quotas Anual",
+)
+_ESCUTEIROS_TESOURARIA = _ESCUTEIROS_PAINEL + (
+    "Escuteiro",
+    "Valores recebidos",
+    "Valor Estornado",
+    "Quota Mensal",
+    "Quota Anual",
+)
+# Painel "Registos recentes" do admin.
+_ESCUTEIROS_ADMIN = _ESCUTEIROS_TESOURARIA + (
+    "Created",
+    "Email",
+    "Status Inativo",
+)
+
+_TOMBOLA = {
+    "INVENTARIO": ("NomeItem", "Categoria", "QuantidadeAtual", "Estado", "CaixaAtual"),
+    "CAIXAS": ("CodigoCaixa", "Descricao", "Local", "Estado"),
+    "PATROCINADORES": ("Nome",),
+    "EVENTOS": ("NomeEvento",),
+    "REGISTO_PATROCINIOS": (
+        "Patrocinador",
+        "PatrocinadorNome",
+        "DescricaoItem",
+        "Quantidade",
+        "Estado",
+        "Processado",
+        "Categoria",
+        "Observacoes",
+        "CaixaSugerida",
+        "Evento",
+    ),
+}
+
+MANIFESTO_CAMPOS: Dict[str, Dict[str, Dict[str, Tuple[str, ...]]]] = {
+    "estatisticas": {
+        "pais": _ESTATISTICAS,
+        "tesoureiro": _ESTATISTICAS,
+        "admin": _ESTATISTICAS,
+    },
+    "home": {
+        "pais": {"Escuteiros": _ESCUTEIROS_PAINEL},
+        "tesoureiro": {"Escuteiros": _ESCUTEIROS_TESOURARIA},
+        "admin": {"Escuteiros": _ESCUTEIROS_ADMIN},
+    },
+    # Os pais só chegam aqui com permissão CCP; a página é a mesma para todos.
+    "tombola": {
+        "pais": _TOMBOLA,
+        "tesoureiro": _TOMBOLA,
+        "admin": _TOMBOLA,
+    },
+}
+
+
+def campos_por_tabela(vista: str, role: str | None) -> Dict[str, Tuple[str, ...]]:
+    """Projeções declaradas para a vista/role indicados (vazio = tudo completo)."""
+    return dict(MANIFESTO_CAMPOS.get(vista, {}).get(role or "", {}))
@@ -2,6 +2,7 @@
 import streamlit as st
 from menu import menu_with_redirect
 from airtable_config import context_labels
+from data_utils import resolver_campo, resolver_coluna
 
 menu_with_redirect()
 
@@ -16,13 +17,6 @@ df_cal = dados.get("Calendario", pd.DataFrame())
 df_vol = dados.get("Voluntariado Pais", pd.DataFrame())
 
 
-def _first_existing(df: pd.DataFrame, candidates: list[str]) -> str | None:
-    for candidate in candidates:
-        if candidate in df.columns:
-            return candidate
-    return None
-
-
 def _listar_nomes(valor) -> list[str]:
     if isinstance(valor, list):
         return [str(v).strip() for v in valor if pd.notna(v) and str(v).strip()]
@@ -55,16 +49,8 @@ else:
     voluntarios_por_evento: dict[str, list[str]] = {}
     if df_vol is not None and not df_vol.empty:
         df_vol = df_vol.copy()
-        col_link = _first_existing(
-            df_vol,
-            [
-                "Record_ID Calendário (from Date ( calendário ))",
-                "Record_ID Calendário (from Date (calendário))",
-                "Date ( calendário )",
-                "Date (calendário)",
-            ],
-        )
-        cancel_col = _first_existing(df_vol, ["Cancelado"])
+        col_link = resolver_campo(df_vol, "voluntariado_evento")
+        cancel_col = resolver_coluna(df_vol, ["Cancelado"])
         if cancel_col:
             # A coluna pode vir como texto do Airtable, por isso normalizamos para booleano.
             serie_cancel = df_vol[cancel_col]
@@ -3,6 +3,7 @@ import streamlit as st
 from urllib.parse import urlparse, urlunparse
 from menu import menu_with_redirect
 from airtable_config import context_labels, resolve_form_url
+from data_utils import TABELAS_DA_FAMILIA, resolver_campo, resolver_coluna
 
 menu_with_redirect()
 
@@ -24,7 +25,9 @@ st.title("Voluntariado dos Pais")
 dados = st.session_state.get("dados_cache", {})
 df = dados.get("Voluntariado Pais", pd.DataFrame())
 df_cal = dados.get("Calendario", pd.DataFrame())
+# Nomes de todos os escuteiros (links) e, para o formulário, as linhas da família.
 df_esc = dados.get("Escuteiros", pd.DataFrame())
+df_esc_familia = dados.get(TABELAS_DA_FAMILIA["Escuteiros"], df_esc)
 
 
 def normalizar_url_airtable(valor_url, fallback: str) -> str:
@@ -56,20 +59,13 @@ def normalizar_url_airtable(valor_url, fallback: str) -> str:
     return urlunparse(normalizado)
 
 
-def _first_existing(df: pd.DataFrame, candidates: list[str]) -> str | None:
-    for candidate in candidates:
-        if candidate in df.columns:
-            return candidate
-    return None
-
-
 if df is None or df.empty:
     st.info("Ainda não existem voluntários registados.")
     df_valid = pd.DataFrame()
 else:
     df_valid = df.copy()
 
-    cancel_col = _first_existing(df_valid, ["Cancelado"])
+    cancel_col = resolver_coluna(df_valid, ["Cancelado"])
     if cancel_col and cancel_col in df_valid.columns:
         cancelados = (
             df_valid[cancel_col]
@@ -86,15 +82,7 @@ else:
 highlight = df_valid.head(3) if not df_valid.empty else pd.DataFrame()
 if not highlight.empty:
     st.markdown("### Obrigado aos últimos voluntários!")
-    col_link = _first_existing(
-        df_valid,
-        [
-            "Record_ID Calendário (from Date ( calendário ))",
-            "Record_ID Calendário (from Date (calendário))",
-            "Date ( calendário )",
-            "Date (calendário)",
-        ],
-    )
+    col_link = resolver_campo(df_valid, "voluntariado_evento")
     if col_link and not df_cal.empty and "id" in df_cal.columns:
         cal_map = df_cal.set_index("id").get("Data", pd.Series(dtype=str)).to_dict()
     else:
@@ -132,7 +120,7 @@ st.markdown(
 
 iframe_src = DEFAULT_VOLUNT_FORM_URL
 
-df_esc_form = df_esc.copy() if df_esc is not None else pd.DataFrame()
+df_esc_form = df_esc_familia.copy() if df_esc_familia is not None else pd.DataFrame()
 if not df_esc_form.empty and "id" in df_esc_form.columns:
     if allowed_escuteiros:
         df_esc_form = df_esc_form[df_esc_form["id"].isin(allowed_escuteiros)]
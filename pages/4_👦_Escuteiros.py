@@ -4,6 +4,7 @@ import streamlit as st
 from urllib.parse import urlparse, urlunparse
 from menu import menu_with_redirect
 from airtable_config import context_labels, resolve_form_url
+from data_utils import TABELAS_DA_FAMILIA, resolver_coluna
 
 DEFAULT_LANCHE_FORM_URL = resolve_form_url("DEFAULT_LANCHE_FORM_URL", "Formulário de Escolha dos Lanches")
 
@@ -55,16 +56,12 @@ def normalizar_url_airtable(valor_url, fallback: str) -> str:
     return urlunparse(normalizado)
 
 
-def _first_existing(frame: pd.DataFrame, columns: list[str]) -> str | None:
-    if frame is None or frame.empty:
-        return None
-    for col in columns:
-        if col in frame.columns:
-            return col
-    return None
-
 df_menu = dados.get("Publicar Menu do Scouts", pd.DataFrame())
-recipes_name_col = _first_existing(df_recipes, ['Menu', 'Nome', 'Nome do Item']) if df_recipes is not None else None
+recipes_name_col = (
+    resolver_coluna(df_recipes, ['Menu', 'Nome', 'Nome do Item'])
+    if df_recipes is not None and not df_recipes.empty
+    else None
+)
 recipes_map = {}
 if recipes_name_col:
     recipes_map = df_recipes.set_index('id')[recipes_name_col].dropna().astype(str).to_dict()
@@ -250,7 +247,7 @@ st.markdown(
     """
 )
 
-df_escuteiros = dados.get("Escuteiros", pd.DataFrame())
+df_escuteiros = dados.get(TABELAS_DA_FAMILIA["Escuteiros"], dados.get("Escuteiros", pd.DataFrame()))
 
 if df_escuteiros is None or df_escuteiros.empty or "id" not in df_escuteiros.columns:
     st.warning("Ainda não existem escuteiros registados ou a tabela está incompleta.")
@@ -5,22 +5,18 @@ from datetime import date, datetime, timedelta
 import altair as alt
 import pandas as pd
 import streamlit as st
-from pyairtable import Api
 
+from airtable_cache import carregar_tabelas
+from airtable_client import criar_api
 from airtable_config import context_labels, current_context, get_airtable_credentials
-from data_utils import (
-    formatar_moeda_euro,
-    preparar_dataframe_estornos,
-    preparar_dataframe_recebimentos,
-)
+from data_utils import formatar_moeda_euro, preparar_movimentos_financeiros
+from manifesto_campos import campos_por_tabela
 from menu import menu_with_redirect
 
 
-@st.cache_data(ttl=300)
-def carregar_todas_as_tabelas(base_id: str, role: str, token: str) -> dict[str, pd.DataFrame]:
-    api = Api(token)
-    dados: dict[str, pd.DataFrame] = {}
-
+def carregar_todas_as_tabelas(api, base_id: str, role: str) -> dict[str, pd.DataFrame]:
+    # Sem st.cache_data: a cache partilhada já versiona os snapshots e aplica as escritas da app;
+    # uma segunda camada com TTL próprio voltaria a servir dados até 5 minutos desatualizados.
     tabelas_por_role = {
         "pais": [
             "Pedidos",
@@ -53,14 +49,13 @@ def carregar_todas_as_tabelas(base_id: str, role: str, token: str) -> dict[str,
         ],
     }
 
-    for nome in tabelas_por_role.get(role, []):
-        try:
-            registros = api.table(base_id, nome).all()
-            linhas = [{"id": reg["id"], **reg["fields"]} for reg in registros]
-            dados[nome] = pd.DataFrame(linhas)
-        except Exception:
-            dados[nome] = pd.DataFrame()
-
+    # Erros ficam como DataFrame vazio, tal como antes (as estatísticas toleram tabelas em falta).
+    dados, _ = carregar_tabelas(
+        api,
+        base_id,
+        tabelas_por_role.get(role, []),
+        campos_por_tabela=campos_por_tabela("estatisticas", role),
+    )
     return dados
 
 
@@ -187,10 +182,11 @@ def main():
 
     role = st.session_state.get("role", "tesoureiro")
     AIRTABLE_TOKEN, BASE_ID = get_airtable_credentials()
-    dados = carregar_todas_as_tabelas(BASE_ID, role, AIRTABLE_TOKEN)
+    dados = carregar_todas_as_tabelas(criar_api(AIRTABLE_TOKEN), BASE_ID, role)
 
-    df_rec_limpo, escuteiros_map, permissoes_map, mapa_nomes_ids = preparar_dataframe_recebimentos(dados)
-    df_estornos = preparar_dataframe_estornos(dados, escuteiros_map, permissoes_map, mapa_nomes_ids)
+    movimentos = preparar_movimentos_financeiros(dados)
+    df_rec_limpo = movimentos.recebimentos
+    df_estornos = movimentos.estornos
     df_cotas = dados.get("Escuteiros", pd.DataFrame())
     df_menu = dados.get("Publicar Menu do Scouts", pd.DataFrame())
     df_volunt = dados.get("Voluntariado Pais", pd.DataFrame())
@@ -4,18 +4,26 @@ import io
 
 import pandas as pd
 import streamlit as st
-from pyairtable import Api
 
+import tombola_fila
+from airtable_cache import copia_para_sessao, obter_tabela
+from airtable_client import criar_api
 from airtable_config import context_labels, get_tombola_credentials, get_tombola_table_ref
+from manifesto_campos import campos_por_tabela
 from menu import menu_with_redirect
-from tombola_schema import ensure_tombola_schema
+from snapshot_store import dataframe_para_registos
+from tombola_reconciliacao import ESTADO_DIVERGENTE, ESTADO_OK, corrigir_divergencias, reconciliar
+from tombola_schema import ensure_tombola_schema, tabelas_em_falta
 from tombola_utils import (
+    IndiceInventario,
     ajustar_stock_item,
+    campos_movimento_em_falta,
     criar_movimento,
-    encontrar_item_por_nome,
+    criar_registo,
     normalizar_nome_item,
     processar_movimentos_lote,
-    registrar_entrada,
+    processar_patrocinios_lote,
+    snapshot_item,
     transferir_item_caixa,
 )
 
@@ -47,7 +55,8 @@ except RuntimeError as exc:
     st.info("Defina TOMBOLA_AIRTABLE_BASE_ID e TOMBOLA_AIRTABLE_TOKEN nos secrets da secção.")
     st.stop()
 
-api = Api(AIRTABLE_TOKEN)
+api = criar_api(AIRTABLE_TOKEN)
+tombola_fila.iniciar_worker(api, BASE_ID)
 executado_por = (st.session_state.get("user", {}).get("email") or "").strip()
 if not executado_por:
     st.error("Não foi possível identificar o utilizador autenticado (email).")
@@ -64,6 +73,11 @@ TABLES = {
 }
 
 
+# Leituras vêm da cache partilhada; as escritas em tombola_utils marcam as tabelas
+# afetadas e a leitura seguinte sincroniza só o delta.
+TTL_TABELAS_TOMBOLA = 120
+
+
 def _table_ref(chave: str) -> str:
     return TABLES[chave]
 
@@ -71,10 +85,7 @@ def _table_ref(chave: str) -> str:
 
 
 def _tabelas_em_falta() -> list[str]:
-    base = api.base(BASE_ID)
-    tabelas = base.tables()
-    disponiveis = {tbl.name for tbl in tabelas} | {tbl.id for tbl in tabelas}
-    return [ref for ref in TABLES.values() if ref not in disponiveis]
+    return tabelas_em_falta(api, BASE_ID, TABLES)
 
 
 def _is_schema_related_error(exc: Exception) -> bool:
@@ -97,7 +108,8 @@ def _auto_bootstrap_schema(trigger: str = "startup") -> bool:
     st.session_state[chave_execucao] = True
 
     try:
-        resultado = ensure_tombola_schema(api, BASE_ID, TABLES)
+        # Fora do arranque foi detetado um erro de schema: o snapshot em cache pode estar desatualizado.
+        resultado = ensure_tombola_schema(api, BASE_ID, TABLES, forcar=trigger != "startup")
     except Exception as exc:
         st.warning(f"Não foi possível auto-inicializar o schema da Tômbola: {exc}")
         return False
@@ -129,22 +141,97 @@ def _auto_bootstrap_schema(trigger: str = "startup") -> bool:
     return True
 
 
-def _table_df(nome_tabela: str) -> pd.DataFrame:
+def _table_df(nome_tabela: str, *, sincronizar: bool = False) -> pd.DataFrame:
     """Stock real vive no Inventário; Movimentos é auditoria e tabelas suportam contexto."""
+    # Cache partilhada entre sessões; `sincronizar=True` força o delta antes de operações críticas.
+    projecoes = campos_por_tabela("tombola", role)
+    campos = next((projecoes[chave] for chave, ref in TABLES.items() if ref == nome_tabela and chave in projecoes), None)
+    opcoes = {"ttl": TTL_TABELAS_TOMBOLA, "sincronizar": sincronizar, "campos": campos}
     try:
-        registos = api.table(BASE_ID, nome_tabela).all()
+        snapshot, _ = obter_tabela(api, BASE_ID, nome_tabela, **opcoes)
     except Exception as exc:
         if _is_schema_related_error(exc):
             _auto_bootstrap_schema(trigger=nome_tabela)
             try:
-                registos = api.table(BASE_ID, nome_tabela).all()
+                snapshot, _ = obter_tabela(api, BASE_ID, nome_tabela, **opcoes)
             except Exception as retry_exc:
                 st.warning(f"Não foi possível carregar a tabela '{nome_tabela}' após auto-correção de schema: {retry_exc}")
                 return pd.DataFrame()
         else:
             st.warning(f"Não foi possível carregar a tabela '{nome_tabela}': {exc}")
             return pd.DataFrame()
-    return pd.DataFrame([{"id": r["id"], **r.get("fields", {})} for r in registos])
+    df = copia_para_sessao(snapshot.df)
+    # Instante da sincronização: permite às operações de stock reutilizar linhas deste frame.
+    df.attrs["obtido_em"] = snapshot.sincronizado_em.timestamp() if snapshot.sincronizado_em else 0.0
+    return df
+
+
+def _item_snapshot(df_inv: pd.DataFrame, item_id: str) -> dict | None:
+    """Snapshot do item a partir do inventário já carregado (evita reler o registo ao gravar)."""
+    if df_inv.empty or "QuantidadeAtual" not in df_inv.columns:
+        return None
+    registos = dataframe_para_registos(df_inv[df_inv["id"] == item_id])
+    if not registos:
+        return None
+    return snapshot_item(registos[0], obtido_em=df_inv.attrs.get("obtido_em", 0.0))
+
+
+def _stock_projetado(df_inv: pd.DataFrame) -> pd.DataFrame:
+    """Inventário com as operações da fila local ainda por sincronizar já aplicadas."""
+    pendentes = tombola_fila.deltas_pendentes(BASE_ID)
+    if df_inv.empty or not pendentes:
+        return df_inv
+    df = df_inv.copy()
+    df["Pendente"] = df["id"].map(pendentes).fillna(0).astype(int)
+    base = pd.to_numeric(df.get("QuantidadeAtual"), errors="coerce").fillna(0)
+    df["QuantidadeAtual"] = base + df["Pendente"]
+    return df
+
+
+def _quantidade_item(df_inv: pd.DataFrame, item_id: str) -> float:
+    if df_inv.empty or "QuantidadeAtual" not in df_inv.columns:
+        return 0.0
+    valores = pd.to_numeric(df_inv.loc[df_inv["id"] == item_id, "QuantidadeAtual"], errors="coerce")
+    return float(valores.fillna(0).sum())
+
+
+def _render_fila_sincronizacao(item_label: dict[str, str]) -> None:
+    if not tombola_fila.ativa():
+        return
+    contagem = tombola_fila.resumo(BASE_ID)
+    pendentes = sum(contagem.get(estado, 0) for estado in tombola_fila.ESTADOS_PENDENTES)
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    col1.metric("Por sincronizar", pendentes)
+    col2.metric("Sincronizadas", contagem.get("sincronizado", 0))
+    col3.metric("Com erro", contagem.get("erro", 0))
+    if col4.button("Sincronizar agora", key="btn_sincronizar_fila_tombola"):
+        resultado = tombola_fila.sincronizar(api, BASE_ID)
+        if resultado.get("pendente"):
+            st.warning(f"{resultado['pendente']} operação(ões) continuam por sincronizar (sem ligação ao Airtable?).")
+        st.rerun()
+    if contagem.get("erro"):
+        st.warning("Há operações rejeitadas pelo Airtable (ver coluna Erro); o stock delas não foi aplicado.")
+
+    operacoes = tombola_fila.listar(BASE_ID, limite=20)
+    if operacoes:
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {
+                        "Registado": pd.to_datetime(op.criado_em, unit="s").strftime("%d/%m %H:%M:%S"),
+                        "Tipo": op.tipo,
+                        "Item": item_label.get(op.item_id, op.item_id),
+                        "Quantidade": op.quantidade,
+                        "Estado": op.estado,
+                        "Tentativas": op.tentativas,
+                        "Erro": op.ultimo_erro or "",
+                    }
+                    for op in operacoes
+                ]
+            ),
+            use_container_width=True,
+            hide_index=True,
+        )
 
 
 def _caixa_display_label(registo: dict) -> str:
@@ -155,13 +242,6 @@ def _caixa_display_label(registo: dict) -> str:
     return descricao or codigo or "Sem identificação"
 
 
-def _safe_int(valor) -> int:
-    try:
-        return int(valor)
-    except (TypeError, ValueError):
-        return 0
-
-
 COLUNAS_LOTE_OBRIGATORIAS = ["NomeItem", "Tipo", "Quantidade"]
 COLUNAS_LOTE_OPCIONAIS = ["Notas", "Categoria", "Evento"]
 COLUNAS_LOTE = COLUNAS_LOTE_OBRIGATORIAS + COLUNAS_LOTE_OPCIONAIS
@@ -221,194 +301,157 @@ def _ler_arquivo_lote(uploaded_file) -> pd.DataFrame:
     raise ValueError("Formato inválido. Use CSV, XLSX ou XLS.")
 
 
-def _validar_e_preparar_lote(df_lote: pd.DataFrame, inventario_registos: list[dict], evento_por_nome: dict[str, str]) -> tuple[pd.DataFrame, list[dict]]:
+def _texto_serie(serie: pd.Series) -> pd.Series:
+    return serie.where(serie.notna(), "").astype(str).str.strip()
+
+
+def _normalizar_serie(serie: pd.Series) -> pd.Series:
+    """`normalizar_nome_item` aplicado à coluna inteira."""
+    return (
+        _texto_serie(serie)
+        .str.lower()
+        .str.split()
+        .str.join(" ")
+        .str.normalize("NFKD")
+        .str.encode("ascii", "ignore")
+        .str.decode("ascii")
+    )
+
+
+def _validar_e_preparar_lote(df_lote: pd.DataFrame, inventario: IndiceInventario, evento_por_nome: dict[str, str]) -> tuple[pd.DataFrame, list[dict]]:
     colunas_em_falta = [col for col in COLUNAS_LOTE_OBRIGATORIAS if col not in df_lote.columns]
     if colunas_em_falta:
         raise ValueError(f"Colunas obrigatórias em falta: {', '.join(colunas_em_falta)}")
+    if df_lote.empty:
+        return pd.DataFrame(), []
 
     lote = df_lote.copy()
     for coluna in COLUNAS_LOTE:
         if coluna not in lote.columns:
             lote[coluna] = ""
 
-    preview_rows: list[dict] = []
-    movimentos: list[dict] = []
-    tipos_validos = {"Entrada", "Saída", "Ajuste"}
-
-    for index, row in lote.iterrows():
-        numero_linha = int(index) + 2
-        nome_item = str(row.get("NomeItem") or "").strip()
-        tipo = str(row.get("Tipo") or "").strip()
-        notas = str(row.get("Notas") or "").strip()
-        categoria = str(row.get("Categoria") or "").strip()
-        evento_nome = str(row.get("Evento") or "").strip()
-        quantidade_raw = row.get("Quantidade")
-
-        erros: list[str] = []
-        quantidade = None
-
-        if not nome_item:
-            erros.append("NomeItem em falta")
-        if tipo not in tipos_validos:
-            erros.append("Tipo inválido (Entrada/Saída/Ajuste)")
-
-        try:
-            quantidade = int(float(quantidade_raw))
-            if quantidade <= 0 or float(quantidade_raw) != float(quantidade):
-                raise ValueError
-        except (TypeError, ValueError):
-            erros.append("Quantidade inválida (inteiro > 0)")
-
-        if tipo in {"Saída", "Ajuste"} and not notas:
-            erros.append("Notas obrigatórias para Saída/Ajuste")
-
-        item_registo = encontrar_item_por_nome(inventario_registos, nome_item)
-        item_id = item_registo.get("id") if item_registo else None
-        nome_normalizado = normalizar_nome_item(nome_item)
-        existe_item = bool(item_id)
-
-        sugestao_erro_item = ""
-        if tipo in {"Saída", "Ajuste"} and not existe_item:
-            mensagem_item_inexistente = (
-                "Item não encontrado no inventário. "
-                "Para novo item, use Entrada antes de Saída/Ajuste."
-            )
-            erros.append(mensagem_item_inexistente)
-            sugestao_erro_item = "Registe primeiro uma Entrada para criar o item no inventário."
-
-        evento_id = None
-        if evento_nome:
-            evento_id = evento_por_nome.get(normalizar_nome_item(evento_nome))
-            if not evento_id:
-                erros.append("Evento não encontrado")
+    nome_item = _texto_serie(lote["NomeItem"])
+    tipo = _texto_serie(lote["Tipo"])
+    notas = _texto_serie(lote["Notas"])
+    categoria = _texto_serie(lote["Categoria"])
+    evento_nome = _texto_serie(lote["Evento"])
+    nome_normalizado = _normalizar_serie(lote["NomeItem"])
+
+    quantidade_num = pd.to_numeric(lote["Quantidade"], errors="coerce")
+    quantidade_valida = (
+        quantidade_num.notna()
+        & (quantidade_num != float("inf"))
+        & (quantidade_num > 0)
+        & (quantidade_num % 1 == 0)
+    )
 
-        preview_row = {
-            "Linha": numero_linha,
+    item_id = nome_normalizado.map(inventario.ids_por_nome())
+    existe_item = item_id.notna()
+    evento_id = _normalizar_serie(evento_nome).map(evento_por_nome)
+    exige_notas = tipo.isin(["Saída", "Ajuste"])
+    item_inexistente = exige_notas & ~existe_item
+
+    verificacoes = [
+        (nome_item == "", "NomeItem em falta"),
+        (~tipo.isin(["Entrada", "Saída", "Ajuste"]), "Tipo inválido (Entrada/Saída/Ajuste)"),
+        (~quantidade_valida, "Quantidade inválida (inteiro > 0)"),
+        (exige_notas & (notas == ""), "Notas obrigatórias para Saída/Ajuste"),
+        (
+            item_inexistente,
+            "Item não encontrado no inventário. Para novo item, use Entrada antes de Saída/Ajuste.",
+        ),
+        ((evento_nome != "") & evento_id.isna(), "Evento não encontrado"),
+    ]
+    erros = pd.Series("", index=lote.index)
+    for mascara, mensagem in verificacoes:
+        erros = erros.mask(mascara, erros + (erros != "").map({True: " | ", False: ""}) + mensagem)
+    valida = erros == ""
+
+    preview_df = pd.DataFrame(
+        {
+            "Linha": lote.index.astype(int) + 2,
             "NomeItem": nome_item,
             "NomeNormalizado": nome_normalizado,
             "Tipo": tipo,
-            "Quantidade": quantidade_raw,
+            "Quantidade": lote["Quantidade"],
             "Categoria": categoria,
             "Evento": evento_nome,
-            "ItemExistente": "Sim" if existe_item else "Não",
-            "Estado": "Erro" if erros else "OK",
-            "Erros": " | ".join(erros),
+            "ItemExistente": existe_item.map({True: "Sim", False: "Não"}),
+            "Estado": valida.map({True: "OK", False: "Erro"}),
+            "Erros": erros,
         }
-        if sugestao_erro_item:
-            preview_row["Sugestão"] = sugestao_erro_item
-        preview_rows.append(preview_row)
-
-        if not erros:
-            movimentos.append(
-                {
-                    "indice": numero_linha,
-                    "nome_item": nome_item,
-                    "tipo": tipo,
-                    "quantidade": quantidade,
-                    "notas": notas,
-                    "categoria": categoria,
-                    "evento_id": evento_id,
-                }
-            )
-
-    preview_df = pd.DataFrame(preview_rows)
-    if "Sugestão" in preview_df.columns:
-        preview_df["Sugestão"] = preview_df["Sugestão"].fillna("")
+    )
+    if item_inexistente.any():
+        preview_df["Sugestão"] = item_inexistente.map(
+            {True: "Registe primeiro uma Entrada para criar o item no inventário.", False: ""}
+        )
 
-    return preview_df, movimentos
+    validos = pd.DataFrame(
+        {
+            "indice": preview_df["Linha"],
+            "nome_item": nome_item,
+            "tipo": tipo,
+            "quantidade": quantidade_num.where(valida, 0).astype(int),
+            "notas": notas,
+            "categoria": categoria,
+            "evento_id": evento_id.astype(object).where(evento_id.notna(), None),
+        }
+    )[valida]
+    return preview_df.reset_index(drop=True), validos.to_dict("records")
 
 
 def _ensure_patrocinador_id(nome: str) -> str | None:
     nome = (nome or "").strip()
     if not nome:
         return None
-    tabela = api.table(BASE_ID, _table_ref("PATROCINADORES"))
-    try:
-        registos = tabela.all()
-    except Exception:
-        return None
-    for reg in registos:
-        if normalizar_nome_item(reg.get("fields", {}).get("Nome")) == normalizar_nome_item(nome):
-            return reg["id"]
-    novo = tabela.create({"Nome": nome})
+    df_patrocinadores = _table_df(_table_ref("PATROCINADORES"))
+    if not df_patrocinadores.empty and "Nome" in df_patrocinadores.columns:
+        alvo = normalizar_nome_item(nome)
+        for reg_id, reg_nome in zip(df_patrocinadores["id"], df_patrocinadores["Nome"]):
+            if normalizar_nome_item(reg_nome) == alvo:
+                return reg_id
+    novo = criar_registo(api, BASE_ID, "PATROCINADORES", {"Nome": nome})
     return novo.get("id")
 
 
-def _processar_patrocinio(registo: dict) -> None:
-    campos = registo.get("fields", {})
-    if campos.get("Processado"):
-        raise ValueError("Este patrocínio já foi processado.")
-
-    descricao = str(campos.get("DescricaoItem") or "").strip()
-    quantidade = _safe_int(campos.get("Quantidade"))
-    if not descricao or quantidade <= 0:
-        raise ValueError("Registo inválido: DescricaoItem e Quantidade > 0 são obrigatórios.")
-
-    tabela_inventario = api.table(BASE_ID, _table_ref("INVENTARIO"))
-    inventario_registos = tabela_inventario.all()
-    item_existente = encontrar_item_por_nome(inventario_registos, descricao)
-
-    caixa_sugerida = campos.get("CaixaSugerida")
-    caixa_sugerida_id = caixa_sugerida[0] if isinstance(caixa_sugerida, list) and caixa_sugerida else None
-    categoria = campos.get("Categoria")
-    patrocinador = campos.get("Patrocinador")
-    patrocinador_id = patrocinador[0] if isinstance(patrocinador, list) and patrocinador else None
-    if not patrocinador_id:
-        patrocinador_id = _ensure_patrocinador_id(str(campos.get("PatrocinadorNome") or ""))
-    evento = campos.get("Evento")
-    evento_id = evento[0] if isinstance(evento, list) and evento else None
-
-    if item_existente:
-        item_id = item_existente["id"]
-        registrar_entrada(
-            api,
-            BASE_ID,
-            item_id=item_id,
-            quantidade=quantidade,
-            executado_por=executado_por,
-            evento_id=evento_id,
-            caixa_destino_id=caixa_sugerida_id,
-            patrocinador_id=patrocinador_id,
-            origem_entrada="Patrocínio",
-            notas=str(campos.get("Observacoes") or "").strip(),
-        )
-    else:
-        campos_novo = {
-            "NomeItem": descricao,
-            "QuantidadeAtual": quantidade,
-            "Estado": "Disponível",
-            "Ativo": True,
-        }
-        if categoria:
-            campos_novo["Categoria"] = categoria
-        if caixa_sugerida_id:
-            campos_novo["CaixaAtual"] = [caixa_sugerida_id]
-        novo = tabela_inventario.create(campos_novo)
-        item_id = novo["id"]
-        criar_movimento(
-            api,
-            BASE_ID,
-            tipo="Entrada",
-            item_id=item_id,
-            quantidade=quantidade,
-            executado_por=executado_por,
-            evento_id=evento_id,
-            caixa_destino_id=caixa_sugerida_id,
-            origem_entrada="Patrocínio",
-            patrocinador_id=patrocinador_id,
-            notas=str(campos.get("Observacoes") or "").strip(),
-        )
+def _processar_patrocinios(registo_ids: list[str]) -> list[dict]:
+    """Converte em stock os patrocínios indicados, num único lote (ver `processar_patrocinios_lote`)."""
+    # Estado "Processado" e stock de partida têm de estar atuais: sincroniza o delta antes de gravar.
+    df_registos = _table_df(_table_ref("REGISTO_PATROCINIOS"), sincronizar=True)
+    por_id = {registo["id"]: registo for registo in dataframe_para_registos(df_registos)}
+    registos = [por_id.get(reg_id, {"id": reg_id, "fields": {"Processado": True}}) for reg_id in registo_ids]
 
-    api.table(BASE_ID, _table_ref("REGISTO_PATROCINIOS")).update(registo["id"], {"Processado": True, "Estado": "Recebido"})
+    df_patrocinadores = _table_df(_table_ref("PATROCINADORES"))
+    patrocinadores = {}
+    if not df_patrocinadores.empty and "Nome" in df_patrocinadores.columns:
+        for reg_id, reg_nome in zip(df_patrocinadores["id"], df_patrocinadores["Nome"]):
+            patrocinadores.setdefault(normalizar_nome_item(reg_nome), reg_id)
+
+    inventario = IndiceInventario(dataframe_para_registos(_table_df(_table_ref("INVENTARIO"), sincronizar=True)))
+    return processar_patrocinios_lote(
+        api,
+        BASE_ID,
+        registos=registos,
+        executado_por=executado_por,
+        inventario=inventario,
+        patrocinadores=patrocinadores,
+    )
 
 
 st.title("🎁 Guarda Material - Tômbola")
 _auto_bootstrap_schema()
+_movimentos_sem_campos = campos_movimento_em_falta(BASE_ID, _table_ref("MOVIMENTOS"))
+if _movimentos_sem_campos:
+    st.warning(
+        f"A tabela Movimentos não tem os campos {', '.join(_movimentos_sem_campos)}: os movimentos são "
+        "gravados sem eles (reconciliação só por Tipo/Quantidade, reenvios da fila sem deteção de duplicados). "
+        "Crie-os ou dê ao token permissão de escrita de schema."
+    )
 
 
 def _render_ver_stock() -> None:
     st.subheader("📦 Ver stock")
-    df_inv = _table_df(_table_ref("INVENTARIO"))
+    df_inv = _stock_projetado(_table_df(_table_ref("INVENTARIO")))
     df_caixas = _table_df(_table_ref("CAIXAS"))
     caixa_label = {
         str(row.get("id") or "").strip(): _caixa_display_label(row)
@@ -439,7 +482,7 @@ def _render_ver_stock() -> None:
     if df_inv.empty:
         st.info("Ainda não existem itens no inventário.")
     else:
-        vis = [c for c in ["NomeItem", "Categoria", "QuantidadeAtual", "Estado", "CaixaAtual"] if c in df_inv.columns]
+        vis = [c for c in ["NomeItem", "Categoria", "QuantidadeAtual", "Pendente", "Estado", "CaixaAtual"] if c in df_inv.columns]
         df_vis = df_inv[vis].copy()
         if "CaixaAtual" in df_vis.columns:
             def _formatar_caixa(v: object) -> str:
@@ -538,7 +581,7 @@ def _render_receber_doacao() -> None:
                 if evento_pat:
                     campos_patrocinio["Evento"] = [evento_pat]
 
-                api.table(BASE_ID, _table_ref("REGISTO_PATROCINIOS")).create(campos_patrocinio)
+                criar_registo(api, BASE_ID, "REGISTO_PATROCINIOS", campos_patrocinio)
                 st.success("Patrocínio pendente criado com sucesso.")
                 st.rerun()
             except Exception as exc:
@@ -580,41 +623,17 @@ def _render_receber_doacao() -> None:
         key="patrocinios_pendentes_editor",
     )
 
-    if st.button("Processar selecionados", key="proc_pat_lote"):
+    col_proc1, col_proc2 = st.columns(2)
+    if col_proc1.button("Processar selecionados", key="proc_pat_lote"):
         selecionados = tabela_editada[tabela_editada["Selecionar"] == True]
         if selecionados.empty:
             st.warning("Selecione pelo menos um registo para processar.")
         else:
-            relatorio = []
-            tabela_patrocinios = api.table(BASE_ID, _table_ref("REGISTO_PATROCINIOS"))
-            for _, row in selecionados.iterrows():
-                reg_id = row["id"]
-                descricao = row.get("DescricaoItem") or reg_id
-                try:
-                    registo = tabela_patrocinios.get(reg_id)
-                    if registo.get("fields", {}).get("Processado"):
-                        raise ValueError("Este patrocínio já tinha sido processado.")
-                    _processar_patrocinio(registo)
-                    relatorio.append(
-                        {
-                            "Registo": reg_id,
-                            "DescricaoItem": descricao,
-                            "Resultado": "Sucesso",
-                            "Mensagem": "Patrocínio processado com sucesso.",
-                        }
-                    )
-                except Exception as exc:
-                    relatorio.append(
-                        {
-                            "Registo": reg_id,
-                            "DescricaoItem": descricao,
-                            "Resultado": "Erro",
-                            "Mensagem": str(exc),
-                        }
-                    )
-
-            st.session_state["patrocinios_batch_relatorio"] = relatorio
+            st.session_state["patrocinios_batch_relatorio"] = _processar_patrocinios(selecionados["id"].tolist())
             st.rerun()
+    if col_proc2.button(f"Processar todos os pendentes ({len(pendentes)})", key="proc_pat_todos"):
+        st.session_state["patrocinios_batch_relatorio"] = _processar_patrocinios(pendentes["id"].tolist())
+        st.rerun()
 
 
 def _render_preparar_evento() -> None:
@@ -632,7 +651,10 @@ def _render_preparar_evento() -> None:
         if not nome.strip() or not local.strip():
             st.error("NomeEvento e Local são obrigatórios.")
         else:
-            api.table(BASE_ID, _table_ref("EVENTOS")).create(
+            criar_registo(
+                api,
+                BASE_ID,
+                "EVENTOS",
                 {
                     "NomeEvento": nome.strip(),
                     "Tipo": tipo,
@@ -676,21 +698,46 @@ def _render_preparar_evento() -> None:
             st.error("Notas são obrigatórias para registar saídas.")
         else:
             try:
-                ajustar_stock_item(
-                    api,
-                    BASE_ID,
-                    item_id=item_id,
-                    delta=-int(qtd),
-                    executado_por=executado_por,
-                    tipo_movimento="Saída",
-                    evento_id=evento_id,
-                    notas=notas,
-                )
-                st.success("Saída registada.")
+                if tombola_fila.ativa():
+                    # Valida contra o stock projetado (cache + fila por sincronizar), como o "Ver stock".
+                    disponivel = _quantidade_item(_stock_projetado(df_inv), item_id)
+                    if int(qtd) > disponivel:
+                        raise ValueError(
+                            f"Stock insuficiente: {disponivel:g} disponível(eis), já descontadas as operações por sincronizar."
+                        )
+                    # Grava no diário local (instantâneo); o worker envia ao Airtable em background.
+                    # `stock_atual` é o da cache: o enfileirar volta a somar a fila dentro do lock,
+                    # pelo que duas saídas concorrentes não passam ambas a validação.
+                    tombola_fila.enfileirar(
+                        BASE_ID,
+                        tipo="Saída",
+                        item_id=item_id,
+                        quantidade=int(qtd),
+                        executado_por=executado_por,
+                        stock_atual=_quantidade_item(df_inv, item_id),
+                        evento_id=evento_id,
+                        notas=notas,
+                    )
+                    st.success("Saída registada (a sincronizar com o Airtable).")
+                else:
+                    ajustar_stock_item(
+                        api,
+                        BASE_ID,
+                        item_id=item_id,
+                        delta=-int(qtd),
+                        executado_por=executado_por,
+                        tipo_movimento="Saída",
+                        evento_id=evento_id,
+                        notas=notas,
+                        item=_item_snapshot(df_inv, item_id),
+                    )
+                    st.success("Saída registada.")
                 st.rerun()
             except Exception as exc:
                 st.error(str(exc))
 
+    _render_fila_sincronizacao(item_label)
+
 
 def render_operacional() -> None:
     st.markdown("### Operações principais")
@@ -751,7 +798,7 @@ def render_ferramentas_avancadas() -> None:
                     campos["Categoria"] = categoria.strip()
                 if caixa_id:
                     campos["CaixaAtual"] = [caixa_id]
-                novo = api.table(BASE_ID, _table_ref("INVENTARIO")).create(campos)
+                novo = criar_registo(api, BASE_ID, "INVENTARIO", campos)
                 criar_movimento(
                     api,
                     BASE_ID,
@@ -760,6 +807,7 @@ def render_ferramentas_avancadas() -> None:
                     quantidade=int(quantidade),
                     executado_por=executado_por,
                     notas="Inventário inicial",
+                    delta=int(quantidade),
                 )
                 st.success("Item criado e movimento de ajuste inicial registado.")
                 st.rerun()
@@ -792,6 +840,7 @@ def render_ferramentas_avancadas() -> None:
                             executado_por=executado_por,
                             tipo_movimento=tipo,
                             notas=notas,
+                            item=_item_snapshot(df_inv, item_id),
                         )
                         st.success("Stock atualizado com sucesso.")
                         st.rerun()
@@ -889,6 +938,7 @@ def render_ferramentas_avancadas() -> None:
 
                     linhas_validas.append(
                         {
+                            "linha": numero_linha,
                             "item_id": item_id_resolvido,
                             "tipo": tipo_linha,
                             "quantidade": quantidade_int,
@@ -902,24 +952,51 @@ def render_ferramentas_avancadas() -> None:
                     for erro in erros_validacao:
                         st.warning(erro)
 
-                for linha in linhas_validas:
-                    delta = linha["quantidade"]
-                    if linha["tipo"] == "Saída":
-                        delta = -delta
-                    try:
-                        ajustar_stock_item(
-                            api,
-                            BASE_ID,
-                            item_id=linha["item_id"],
-                            delta=delta,
-                            executado_por=executado_por,
-                            tipo_movimento=linha["tipo"],
-                            notas=linha["notas"],
+                if linhas_validas:
+                    # Mesmo caminho da importação: escritas agrupadas por item, em blocos e com reposição.
+                    inventario_atual = IndiceInventario(
+                        dataframe_para_registos(_table_df(_table_ref("INVENTARIO"), sincronizar=True))
+                    )
+                    registo_por_id = {registo["id"]: registo for registo in inventario_atual.registos}
+                    movimentos_manuais = []
+                    for linha in linhas_validas:
+                        registo = registo_por_id.get(linha["item_id"])
+                        nome_item = (registo or {}).get("fields", {}).get("NomeItem")
+                        # O lote agrupa por nome: um nome repetido apontaria para outro registo.
+                        if registo is None or inventario_atual.procurar(nome_item) is not registo:
+                            falhadas += 1
+                            st.warning(
+                                f"Linha {linha['linha']}: item {linha['item_id']} sem nome único no inventário; "
+                                "registe-o individualmente."
+                            )
+                            continue
+                        movimentos_manuais.append(
+                            {
+                                "indice": linha["linha"],
+                                "nome_item": nome_item,
+                                "tipo": linha["tipo"],
+                                "quantidade": linha["quantidade"],
+                                "notas": linha["notas"],
+                            }
                         )
-                        processadas += 1
-                    except Exception as exc:
-                        falhadas += 1
-                        st.warning(f"Falha ao processar item {linha['item_id']}: {exc}")
+                    if movimentos_manuais:
+                        try:
+                            relatorio = processar_movimentos_lote(
+                                api,
+                                BASE_ID,
+                                movimentos=movimentos_manuais,
+                                executado_por=executado_por,
+                                inventario=inventario_atual,
+                            )
+                        except Exception as exc:
+                            falhadas += len(movimentos_manuais)
+                            st.warning(f"Falha ao processar o lote: {exc}")
+                        else:
+                            processadas += relatorio["processados"]
+                            falhadas += relatorio["erros"]
+                            for resultado in relatorio["resultados"]:
+                                if resultado["Estado"] == "Erro":
+                                    st.warning(f"Linha {resultado['Linha']}: {resultado['Mensagem']}")
 
                 st.info(
                     "Resumo do lote — "
@@ -950,6 +1027,7 @@ def render_ferramentas_avancadas() -> None:
                             quantidade=int(qty_transfer),
                             executado_por=executado_por,
                             notas=notas_transfer,
+                            item=_item_snapshot(df_inv, item_transfer),
                         )
                         st.success("Transferência registada.")
                         st.rerun()
@@ -983,7 +1061,7 @@ def render_ferramentas_avancadas() -> None:
             if ficheiro_lote is not None:
                 try:
                     df_lote = _ler_arquivo_lote(ficheiro_lote)
-                    registos_inventario = api.table(BASE_ID, _table_ref("INVENTARIO")).all()
+                    inventario_lote = IndiceInventario(dataframe_para_registos(_table_df(_table_ref("INVENTARIO"))))
                     df_eventos_lote = _table_df(_table_ref("EVENTOS"))
                     evento_por_nome = {}
                     if not df_eventos_lote.empty and "NomeEvento" in df_eventos_lote.columns:
@@ -1012,7 +1090,7 @@ def render_ferramentas_avancadas() -> None:
 
                     preview_lote, movimentos_lote = _validar_e_preparar_lote(
                         df_lote_editado,
-                        inventario_registos=registos_inventario,
+                        inventario=inventario_lote,
                         evento_por_nome=evento_por_nome,
                     )
 
@@ -1043,11 +1121,16 @@ def render_ferramentas_avancadas() -> None:
                     elif not movimentos_lote:
                         st.warning("Nenhuma linha válida para processar.")
                     elif st.button("Processar lote", key="btn_processar_lote_importacao"):
+                        # O stock de partida tem de estar atualizado: sincroniza o delta antes de gravar.
+                        inventario_atual = IndiceInventario(
+                            dataframe_para_registos(_table_df(_table_ref("INVENTARIO"), sincronizar=True))
+                        )
                         relatorio = processar_movimentos_lote(
                             api,
                             BASE_ID,
                             movimentos=movimentos_lote,
                             executado_por=executado_por,
+                            inventario=inventario_atual,
                         )
                         relatorio["linhas_ignoradas_erro"] = linhas_ignoradas_erro
                         st.success(
@@ -1081,7 +1164,10 @@ def render_ferramentas_avancadas() -> None:
             if not codigo.strip() or not local.strip():
                 st.error("CodigoCaixa e Local são obrigatórios.")
             else:
-                api.table(BASE_ID, _table_ref("CAIXAS")).create(
+                criar_registo(
+                    api,
+                    BASE_ID,
+                    "CAIXAS",
                     {
                         "CodigoCaixa": codigo.strip(),
                         "Descricao": descricao.strip(),
@@ -1148,6 +1234,36 @@ def render_ferramentas_avancadas() -> None:
         if df_inv.empty:
             st.info("Ainda não existem itens no inventário.")
 
+        st.subheader("Reconciliação com Movimentos")
+        st.caption(
+            "Compara o stock do Inventário com a soma dos Movimentos por item. "
+            "Também disponível na linha de comandos: `python tombola_reconciliacao.py --contexto ...`."
+        )
+        if st.button("Verificar stock", key="btn_reconciliar_tombola"):
+            st.session_state["tombola_reconciliacao"] = reconciliar(
+                _table_df(_table_ref("INVENTARIO"), sincronizar=True),
+                _table_df(_table_ref("MOVIMENTOS"), sincronizar=True),
+            )
+        relatorio = st.session_state.get("tombola_reconciliacao")
+        if relatorio is not None:
+            problemas = relatorio[relatorio["estado"] != ESTADO_OK]
+            if problemas.empty:
+                st.success(f"Inventário coerente com os movimentos ({len(relatorio.index)} itens).")
+            else:
+                st.warning(f"{len(problemas.index)} itens com diferenças.")
+                st.dataframe(problemas, use_container_width=True, hide_index=True)
+                total_divergentes = int((problemas["estado"] == ESTADO_DIVERGENTE).sum())
+                if total_divergentes and st.button(
+                    f"Corrigir {total_divergentes} itens divergentes", key="btn_corrigir_reconciliacao_tombola"
+                ):
+                    try:
+                        corrigidos = corrigir_divergencias(api, BASE_ID, relatorio, tabela=_table_ref("INVENTARIO"))
+                    except Exception as exc:
+                        st.error(f"Não foi possível corrigir o inventário: {exc}")
+                    else:
+                        st.session_state.pop("tombola_reconciliacao", None)
+                        st.success(f"{corrigidos} itens corrigidos.")
+
 
 render_operacional()
 
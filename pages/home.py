@@ -5,17 +5,28 @@ from typing import Any, Optional
 import streamlit as st
 import pandas as pd
 import altair as alt
-from pyairtable import Api
 from menu import menu_with_redirect
 import locale
-import unicodedata
-import time
 from datetime import date, datetime, timedelta
 from urllib.parse import urlparse, urlunparse
 import streamlit.components.v1 as components
 import json
+import uuid
 from st_aggrid import AgGrid, DataReturnMode, GridOptionsBuilder, GridUpdateMode, JsCode
 import requests
+import audit_log
+from airtable_cache import (
+    CACHE_TTL_SEGUNDOS,
+    aplicar_alteracoes,
+    aplicar_escritas,
+    campo_primario,
+    carregar_tabelas,
+    copia_para_sessao,
+    normalizar_campos,
+    obter_snapshot,
+    registos_para_dataframe,
+)
+from airtable_client import criar_api, em_blocos
 from airtable_config import (
     context_labels,
     context_extra,
@@ -24,6 +35,21 @@ from airtable_config import (
     resolve_form_url,
 )
 from components.banner_convites import mostrar_convites
+from data_utils import (
+    COLUNAS_NOMES_ESCUTEIROS,
+    DIAS_SEMANA,
+    TABELAS_DA_FAMILIA,
+    filtrar_dados_por_utilizador,
+    formatar_moeda_euro,
+    formula_link_contem,
+    formula_por_ids,
+    gerar_datas_recorrentes,
+    mapear_serie,
+    normalizar_texto,
+    preparar_movimentos_financeiros,
+    resolver_campo,
+)
+from manifesto_campos import campos_por_tabela
 
 try:
     locale.setlocale(locale.LC_ALL, "pt_PT.UTF-8")
@@ -75,11 +101,68 @@ if secao_legenda:
     st.caption(secao_legenda)
 mostrar_convites("principal")
 AIRTABLE_TOKEN, BASE_ID = get_airtable_credentials()
-api = Api(AIRTABLE_TOKEN)
+api = criar_api(AIRTABLE_TOKEN)
+
+def _carregar_linhas_da_familia(base_id: str, nomes: list[str], *, forcar: bool = False) -> dict:
+    """Escuteiros e Pedidos só da família autenticada, filtrados no Airtable (`filterByFormula`).
+
+    Devolve as tabelas já nas chaves de `TABELAS_DA_FAMILIA`. Se a cache partilhada já
+    tiver a tabela válida, usa-a (sem pedidos). Tabelas que não for possível filtrar no
+    servidor ficam de fora e seguem pelo carregamento partilhado;
+    `filtrar_dados_por_utilizador` confirma sempre o resultado pelos ids.
+    """
+    ids = {str(valor) for valor in (user_info.get("escuteiros_ids") or []) if valor}
+    if not ids or user_info.get("all_access"):
+        return {}
+
+    projecoes = campos_por_tabela("home", role)
+
+    def _partilhada(nome: str) -> Optional[pd.DataFrame]:
+        if forcar:
+            return None
+        snapshot = obter_snapshot(base_id, nome, normalizar_campos(projecoes.get(nome)))
+        if snapshot is None or snapshot.expirado(CACHE_TTL_SEGUNDOS):
+            return None
+        return copia_para_sessao(snapshot.df)
+
+    dados: dict = {}
+    if "Escuteiros" in nomes:
+        df_esc = _partilhada("Escuteiros")
+        if df_esc is None:
+            tabela = api.table(base_id, "Escuteiros")
+            formula = formula_por_ids(ids)
+            try:
+                try:
+                    registos = tabela.all(formula=formula, fields=list(projecoes.get("Escuteiros") or ()) or None)
+                except Exception as exc:
+                    if "UNKNOWN_FIELD_NAME" not in str(exc).upper():
+                        raise
+                    registos = tabela.all(formula=formula)
+                df_esc = registos_para_dataframe(registos)
+            except Exception:
+                return dados
+        dados[TABELAS_DA_FAMILIA["Escuteiros"]] = df_esc
+
+    if "Pedidos" in nomes:
+        df_ped = _partilhada("Pedidos")
+        primario = campo_primario(api, base_id, "Escuteiros") if df_ped is None else None
+        df_esc = dados.get(TABELAS_DA_FAMILIA["Escuteiros"])
+        if df_ped is None and primario and isinstance(df_esc, pd.DataFrame) and primario in df_esc.columns:
+            valores = [str(v) for v in df_esc.loc[df_esc["id"].isin(ids), primario].dropna() if str(v).strip()]
+            for coluna in ("Escuteiros", "Escuteiro") if valores else ():
+                try:
+                    df_ped = registos_para_dataframe(
+                        api.table(base_id, "Pedidos").all(formula=formula_link_contem(coluna, valores))
+                    )
+                except Exception:
+                    continue  # campo com outro nome: tenta o seguinte
+                break
+        if df_ped is not None:
+            dados[TABELAS_DA_FAMILIA["Pedidos"]] = df_ped
+    return dados
 
-def carregar_todas_as_tabelas(base_id: str, role: str) -> dict:
-    dados = {}
 
+def carregar_todas_as_tabelas(base_id: str, role: str, *, forcar: bool = False) -> dict:
     # Mapear tabelas necessárias por role
     tabelas_por_role = {
         "pais": [
@@ -119,21 +202,30 @@ def carregar_todas_as_tabelas(base_id: str, role: str) -> dict:
     lista_tabelas = tabelas_por_role.get(role, [])
     tabelas_opcionais = {"Quotas", "Tipo de Cotas", "Estornos de Recebimento"}
 
-    for nome in lista_tabelas:
-        try:
-            tbl = api.table(base_id, nome)
-            records = tbl.all()
-            rows = [{"id": r["id"], **r["fields"]} for r in records]
-            dados[nome] = pd.DataFrame(rows)
-            time.sleep(0.25)  # evitar limite 5 requests/s
-        except Exception as e:
-            mensagem = str(e)
-            if nome in tabelas_opcionais and "INVALID_PERMISSIONS_OR_MODEL_NOT_FOUND" in mensagem:
-                dados[nome] = pd.DataFrame()
-                continue
-            st.warning(f"⚠️ Não consegui carregar a tabela {nome}: {e}")
-            dados[nome] = pd.DataFrame()
-    return dados
+    # Pais recebem só as linhas da família em Escuteiros/Pedidos (filtro no Airtable);
+    # de Escuteiros fica ainda a projeção só com nomes de todos, para resolver links.
+    da_familia = _carregar_linhas_da_familia(base_id, lista_tabelas, forcar=forcar) if role == "pais" else {}
+    campos = campos_por_tabela("home", role)
+    if TABELAS_DA_FAMILIA["Escuteiros"] in da_familia:
+        campos["Escuteiros"] = [c for c in COLUNAS_NOMES_ESCUTEIROS if c != "id"]
+    ja_carregadas = {"Pedidos"} if TABELAS_DA_FAMILIA["Pedidos"] in da_familia else set()
+
+    # A cache é partilhada entre sessões; cada sessão recebe cópias já filtradas.
+    # `forcar` faz uma sincronização incremental (só registos alterados/apagados).
+    dados, erros = carregar_tabelas(
+        api,
+        base_id,
+        [nome for nome in lista_tabelas if nome not in ja_carregadas],
+        sincronizar=forcar,
+        campos_por_tabela=campos,
+    )
+    dados.update(da_familia)
+    for nome, e in erros.items():
+        mensagem = str(e)
+        if nome in tabelas_opcionais and "INVALID_PERMISSIONS_OR_MODEL_NOT_FOUND" in mensagem:
+            continue
+        st.warning(f"⚠️ Não consegui carregar a tabela {nome}: {e}")
+    return filtrar_dados_por_utilizador(dados, role, user_info)
 
 def mostrar_barra_acoes(botoes: list[tuple[str, str]], espacador: int = 6) -> dict[str, bool]:
     """Renderiza uma barra de ações consistente e devolve o estado dos botões."""
@@ -159,11 +251,39 @@ def mostrar_barra_acoes(botoes: list[tuple[str, str]], espacador: int = 6) -> di
 REFRESH_BUTTON_LABEL = "🔄 Atualizar dados do Airtable"
 
 
-def atualizar_dados_cache() -> None:
-    st.session_state["dados_cache"] = carregar_todas_as_tabelas(BASE_ID, role)
+def atualizar_dados_cache(forcar: bool = True) -> None:
+    st.session_state["dados_cache"] = carregar_todas_as_tabelas(BASE_ID, role, forcar=forcar)
     st.session_state["last_update"] = datetime.now()
 
 
+def aplicar_escritas_cache(
+    nome: str,
+    *,
+    criados: list[dict] = (),
+    atualizados: list[dict] = (),
+    apagados: list[str] = (),
+) -> None:
+    """Funde as respostas de uma escrita na cache partilhada e na cópia da sessão (sem downloads)."""
+    aplicar_escritas(BASE_ID, nome, criados=criados, atualizados=atualizados, apagados=apagados)
+    dados = st.session_state.get("dados_cache")
+    if not isinstance(dados, dict) or not isinstance(dados.get(nome), pd.DataFrame):
+        return
+    campos = normalizar_campos(campos_por_tabela("home", role).get(nome))
+    snapshot = obter_snapshot(BASE_ID, nome, campos) or obter_snapshot(BASE_ID, nome)
+    if snapshot is not None:
+        dados.pop(nome, None)
+        dados.update(filtrar_dados_por_utilizador({nome: copia_para_sessao(snapshot.df)}, role, user_info))
+        return
+    atual = dados[nome]
+    if "id" not in atual.columns:
+        return
+    existentes = set(atual["id"])
+    df_registos = registos_para_dataframe(
+        [r for r in atualizados if r.get("id") in existentes] + [r for r in criados if r.get("id") not in existentes]
+    )
+    dados[nome] = aplicar_alteracoes(atual[~atual["id"].isin(set(apagados))], df_registos)
+
+
 def render_refresh_button(key_suffix: str, *, show_timestamp: bool = False) -> None:
     """Mostra o botão de atualização em múltiplos locais com feedback único."""
     button_key = f"refresh_{key_suffix}"
@@ -181,273 +301,6 @@ def render_refresh_button(key_suffix: str, *, show_timestamp: bool = False) -> N
         st.caption(f"🕒 Última atualização: {st.session_state['last_update'].strftime('%d/%m/%Y %H:%M:%S')}")
 
 
-def mapear_lista(valor, mapping):
-    if isinstance(valor, list):
-        return ", ".join(mapping.get(v, v) for v in valor)
-    if pd.isna(valor):
-        return ""
-    return mapping.get(valor, valor)
-
-
-def formatar_moeda_euro(valor) -> str:
-    if pd.isna(valor):
-        return ""
-
-    numero = valor
-    if isinstance(valor, str):
-        limpo = valor.replace("€", "").replace(" ", "")
-        if "," in limpo and "." in limpo:
-            limpo = limpo.replace(".", "").replace(",", ".")
-        elif "," in limpo:
-            limpo = limpo.replace(",", ".")
-        try:
-            numero = float(limpo)
-        except ValueError:
-            return valor
-    try:
-        numero = float(numero)
-    except (TypeError, ValueError):
-        return str(valor)
-
-    texto = f"{numero:,.2f}"
-    texto = texto.replace(",", "x").replace(".", ",").replace("x", ".")
-    return f"{texto}€"
-
-
-def _normalizar_texto(valor: str) -> str:
-    if not isinstance(valor, str):
-        return ""
-    texto = unicodedata.normalize("NFKD", str(valor))
-    return "".join(ch for ch in texto.lower() if not unicodedata.combining(ch))
-
-
-def construir_mapa_nomes_por_id(dataset: dict) -> dict[str, str]:
-    """Cria um dicionário id -> nome usando quaisquer tabelas já carregadas."""
-
-    def _score_coluna(coluna: str) -> tuple[int, str]:
-        nome_lower = coluna.lower()
-        if nome_lower in {"nome", "name"}:
-            return (0, nome_lower)
-        if "nome" in nome_lower:
-            return (1, nome_lower)
-        if "name" in nome_lower:
-            return (2, nome_lower)
-        if "email" in nome_lower:
-            return (3, nome_lower)
-        return (4, nome_lower)
-
-    mapa: dict[str, str] = {}
-    for df in dataset.values():
-        if df is None or df.empty or "id" not in df.columns:
-            continue
-
-        colunas_texto: list[str] = []
-        for coluna in df.columns:
-            if coluna == "id":
-                continue
-            serie = df[coluna]
-            if serie.dtype == object or serie.apply(lambda v: isinstance(v, list)).any():
-                colunas_texto.append(coluna)
-
-        if not colunas_texto:
-            continue
-
-        colunas_texto.sort(key=_score_coluna)
-
-        for coluna in colunas_texto:
-            serie = df.set_index("id")[coluna].dropna()
-            if serie.empty:
-                continue
-
-            serie = serie.apply(lambda v: ", ".join(str(x) for x in v) if isinstance(v, list) else v)
-            algum_mapeado = False
-            for idx, valor in serie.items():
-                if not isinstance(valor, str):
-                    valor = str(valor)
-                valor_limpo = valor.strip()
-                if not valor_limpo:
-                    continue
-                if idx not in mapa:
-                    mapa[idx] = valor_limpo
-                    algum_mapeado = True
-            if algum_mapeado:
-                break
-
-    return mapa
-
-
-def escolher_coluna(df: pd.DataFrame, candidatos: list[str]) -> str | None:
-    if df is None or df.empty:
-        return None
-
-    colunas = list(df.columns)
-    normalizados = {col.lower().strip(): col for col in colunas}
-    for candidato in candidatos:
-        chave = candidato.lower().strip()
-        if chave in normalizados:
-            return normalizados[chave]
-
-    for candidato in candidatos:
-        chave = candidato.lower().strip()
-        for coluna in colunas:
-            if chave in coluna.lower().strip():
-                return coluna
-    return None
-
-
-def preparar_dataframe_estornos(
-    dados: dict,
-    escuteiros_map: dict[str, str],
-    permissoes_map: dict[str, str],
-    mapa_nomes_ids: dict[str, str],
-) -> pd.DataFrame:
-    possiveis_tabelas = [
-        "Estorno de Recebimento",
-        "Estornos de Recebimento",
-        "Estorno Recebimento",
-        "Estorno",
-        "Estornos",
-    ]
-    df_origem = pd.DataFrame()
-    origem_utilizada = None
-    for nome in possiveis_tabelas:
-        df_candidato = dados.get(nome)
-        if isinstance(df_candidato, pd.DataFrame) and not df_candidato.empty:
-            df_origem = df_candidato.copy()
-            origem_utilizada = nome
-            break
-
-    if df_origem.empty:
-        df_receb = dados.get("Recebimento", pd.DataFrame())
-        if isinstance(df_receb, pd.DataFrame) and not df_receb.empty:
-            df_origem = df_receb.copy()
-            origem_utilizada = "Recebimento"
-        else:
-            return pd.DataFrame()
-
-    df_trabalho = df_origem.copy()
-    if origem_utilizada == "Recebimento":
-        mask_estorno = pd.Series(False, index=df_trabalho.index)
-
-        for coluna in ["Tipo de Movimento", "Tipo", "Categoria", "Movimento", "Motivo"]:
-            if coluna in df_trabalho.columns:
-                serie = df_trabalho[coluna].astype(str).str.lower()
-                mask_estorno = mask_estorno | serie.str.contains("estorno", na=False)
-
-        for coluna in ["É Estorno", "E Estorno", "Estorno?", "Estorno", "é Estorno", "é_estorno"]:
-            if coluna in df_trabalho.columns:
-                serie = df_trabalho[coluna]
-                if serie.dtype == bool:
-                    mask_estorno = mask_estorno | serie
-                else:
-                    serie_str = serie.astype(str).str.strip().str.lower()
-                    mask_estorno = mask_estorno | serie_str.isin({"1", "true", "verdadeiro", "sim", "yes"})
-
-        if "Valor Estornado" in df_trabalho.columns:
-            valores = pd.to_numeric(df_trabalho["Valor Estornado"], errors="coerce").fillna(0).abs()
-            mask_estorno = mask_estorno | (valores > 0)
-
-        if "Valor Recebido" in df_trabalho.columns:
-            valores = pd.to_numeric(df_trabalho["Valor Recebido"], errors="coerce")
-            mask_estorno = mask_estorno | (valores < 0)
-
-        df_trabalho = df_trabalho.loc[mask_estorno].copy()
-        if df_trabalho.empty:
-            return pd.DataFrame()
-
-    coluna_escuteiro = escolher_coluna(df_trabalho, ["Escuteiros", "Escuteiro", "Escuteiro(s)", "Escuteiros Relacionados"])
-    coluna_valor = escolher_coluna(
-        df_trabalho,
-        [
-            "Valor Estornado",
-            "Valor Estorno",
-            "Valor do Estorno",
-            "Valor",
-            "Valor (€)",
-            "Valor Recebido",
-        ],
-    )
-    coluna_data = escolher_coluna(df_trabalho, ["Data do Estorno", "Date", "Data"])
-    coluna_meio = escolher_coluna(
-        df_trabalho,
-        ["Meio de Pagamento", "Método de Pagamento", "Metodo de Pagamento", "Método", "Metodo"],
-    )
-    coluna_responsavel = escolher_coluna(
-        df_trabalho,
-        [
-            "Quem Estornou?",
-            "Quem Estornou",
-            "Quem Recebeu?",
-            "Registado Por",
-            "Responsável",
-            "Criado Por",
-            "Quem devolveu o numerário?",
-            "Quem devolveu o numerario",
-        ],
-    )
-    coluna_motivo = escolher_coluna(
-        df_trabalho,
-        [
-            "Tag_Cancelamento",
-            "Tag Cancelamento",
-            "Motivo do Estorno",
-            "Motivo Estorno",
-            "Motivo",
-            "Tag",
-        ],
-    )
-
-    resultado = pd.DataFrame(index=df_trabalho.index)
-
-    if coluna_escuteiro:
-        resultado["Escuteiro"] = df_trabalho[coluna_escuteiro].apply(lambda valor: mapear_lista(valor, escuteiros_map))
-
-    if coluna_valor:
-        def _extrair_valor(valor):
-            if isinstance(valor, list):
-                return valor[0] if valor else None
-            if isinstance(valor, dict) and "value" in valor:
-                return valor["value"]
-            return valor
-
-        valores = df_trabalho[coluna_valor].apply(_extrair_valor)
-        resultado["Valor (€)"] = pd.to_numeric(valores, errors="coerce").abs()
-
-    if coluna_meio:
-        resultado["Meio de Pagamento"] = df_trabalho[coluna_meio].apply(
-            lambda valor: valor[0] if isinstance(valor, list) and valor else valor
-        )
-
-    if coluna_data:
-        datas = df_trabalho[coluna_data].apply(lambda v: v[0] if isinstance(v, list) and v else v)
-        resultado["Data"] = pd.to_datetime(datas, errors="coerce").dt.normalize()
-
-    if coluna_responsavel:
-        def _mapear_responsavel(valor):
-            if permissoes_map:
-                texto = mapear_lista(valor, permissoes_map)
-                if texto:
-                    return texto
-            if mapa_nomes_ids:
-                texto = mapear_lista(valor, mapa_nomes_ids)
-                if texto:
-                    return texto
-            if escuteiros_map:
-                texto = mapear_lista(valor, escuteiros_map)
-                if texto:
-                    return texto
-            return mapear_lista(valor, {})
-
-        resultado["Responsável"] = df_trabalho[coluna_responsavel].apply(_mapear_responsavel)
-    if coluna_motivo:
-        resultado["Categoria"] = df_trabalho[coluna_motivo].apply(lambda valor: mapear_lista(valor, {}))
-
-    resultado = resultado.dropna(how="all")
-    if "Valor (€)" in resultado.columns:
-        resultado = resultado[resultado["Valor (€)"].notna()]
-
-    return resultado
-
 def mostrar_formulario(
     session_key: str,
     titulo: str,
@@ -533,7 +386,7 @@ def obter_form_url(extra_key: str, label: str) -> str:
 # 3) Cache e botão de refresh
 # ======================
 if "dados_cache" not in st.session_state:
-    atualizar_dados_cache()
+    atualizar_dados_cache(forcar=False)
 
 with st.sidebar:
     render_refresh_button("sidebar")
@@ -554,10 +407,11 @@ def dashboard_pais():
         render_refresh_button("pais")
     st.info("Aqui podem gerir lanches, voluntariado e acompanhar as atividades.")
 
-    df_pedidos = dados.get("Pedidos", pd.DataFrame())
+    # Pais só têm as linhas da família (chaves próprias); os outros roles, as tabelas completas.
+    df_pedidos = dados.get(TABELAS_DA_FAMILIA["Pedidos"], dados.get("Pedidos", pd.DataFrame()))
     df_calendario = dados.get("Calendario", pd.DataFrame())
     df_volunt = dados.get("Voluntariado Pais", pd.DataFrame())
-    df_escuteiros = dados.get("Escuteiros", pd.DataFrame())
+    df_escuteiros = dados.get(TABELAS_DA_FAMILIA["Escuteiros"], dados.get("Escuteiros", pd.DataFrame()))
     df_recipes = dados.get("Recipes", pd.DataFrame())
 
     if df_escuteiros is None or df_escuteiros.empty or "id" not in df_escuteiros.columns:
@@ -1375,170 +1229,6 @@ def dashboard_tesoureiro(dados: dict):
     st.divider()
     st.markdown("### 🧾 Recebimentos")
 
-    def _preparar_recebimentos(dados: dict) -> tuple[pd.DataFrame, dict[str, str], dict[str, str], dict[str, str]]:
-        df_rec = dados.get("Recebimento", pd.DataFrame())
-        expected_columns = ["Escuteiro", "Valor (€)", "Categoria", "Meio de Pagamento", "Data", "Responsável"]
-        if df_rec is None or df_rec.empty:
-            vazio = pd.DataFrame(columns=expected_columns)
-            vazio["Valor (€)"] = pd.Series(dtype="float64")
-            vazio["Data"] = pd.Series(dtype="datetime64[ns]")
-            return vazio, {}, {}, construir_mapa_nomes_por_id(dados)
-
-        colunas_uteis = ["Escuteiros", "Valor Recebido", "Meio de Pagamento", "Date", "Quem Recebeu?"]
-        if "id" in df_rec.columns and "id" not in colunas_uteis:
-            colunas_uteis.append("id")
-        colunas_existentes = [col for col in colunas_uteis if col in df_rec.columns]
-        if not colunas_existentes:
-            vazio = pd.DataFrame(columns=expected_columns)
-            vazio["Valor (€)"] = pd.Series(dtype="float64")
-            vazio["Data"] = pd.Series(dtype="datetime64[ns]")
-            return vazio, {}, {}, construir_mapa_nomes_por_id(dados)
-
-        df_limpo = df_rec[colunas_existentes].copy().rename(
-            columns={
-                "Escuteiros": "Escuteiro",
-                "Valor Recebido": "Valor (€)",
-                "Meio de Pagamento": "Meio de Pagamento",
-                "Date": "Data",
-                "Quem Recebeu?": "Quem Recebeu",
-            }
-        )
-        if "id" in df_limpo.columns:
-            df_limpo["__record_id"] = df_limpo["id"]
-            df_limpo.drop(columns=["id"], inplace=True)
-        else:
-            df_limpo["__record_id"] = ""
-
-        coluna_categoria = escolher_coluna(
-            df_rec,
-            [
-                "Tag_Recebimento",
-                "Tag Recebimento",
-                "Categoria",
-                "Motivo",
-                "Tag",
-            ],
-        )
-
-        if coluna_categoria and coluna_categoria in df_rec.columns:
-            def _normalizar_categoria(valor):
-                if isinstance(valor, list):
-                    return ", ".join(str(item) for item in valor if str(item).strip())
-                return valor
-
-            df_limpo["Categoria"] = df_rec[coluna_categoria].apply(_normalizar_categoria)
-
-        df_escuteiros = dados.get("Escuteiros", pd.DataFrame())
-        escuteiros_map: dict[str, str] = {}
-        if isinstance(df_escuteiros, pd.DataFrame) and not df_escuteiros.empty and "id" in df_escuteiros.columns:
-            for coluna_nome in ("Nome do Escuteiro", "Escuteiro", "Nome"):
-                if coluna_nome in df_escuteiros.columns:
-                    escuteiros_map = df_escuteiros.set_index("id")[coluna_nome].dropna().to_dict()
-                    break
-
-        if escuteiros_map and "Escuteiro" in df_limpo.columns:
-            df_limpo["Escuteiro"] = df_limpo["Escuteiro"].apply(lambda valor: mapear_lista(valor, escuteiros_map))
-
-        df_permissoes = dados.get("Permissoes", pd.DataFrame())
-        permissoes_map: dict[str, str] = {}
-        if isinstance(df_permissoes, pd.DataFrame) and not df_permissoes.empty:
-            permissoes_map = construir_mapa_nomes_por_id({"Permissoes": df_permissoes})
-
-        mapa_nomes_ids = construir_mapa_nomes_por_id(dados)
-
-        if "Quem Recebeu" in df_limpo.columns:
-            candidatos_quem_recebeu = [
-                coluna
-                for coluna in df_rec.columns
-                if coluna not in {"Quem Recebeu?", "Quem recebeu?_OLD"} and coluna.lower().startswith("quem recebeu")
-            ]
-
-            def _score_coluna(nome_coluna: str) -> tuple[int, str]:
-                nome_lower = nome_coluna.lower()
-                if "nome" in nome_lower or "name" in nome_lower:
-                    return (0, nome_lower)
-                if "lookup" in nome_lower:
-                    return (1, nome_lower)
-                return (2, nome_lower)
-
-            coluna_escolhida = None
-            if candidatos_quem_recebeu:
-                candidatos_quem_recebeu.sort(key=_score_coluna)
-                coluna_escolhida = candidatos_quem_recebeu[0]
-
-            if coluna_escolhida:
-                df_limpo["Quem Recebeu"] = df_rec[coluna_escolhida].apply(lambda valor: mapear_lista(valor, {}))
-            elif permissoes_map:
-                df_limpo["Quem Recebeu"] = df_limpo["Quem Recebeu"].apply(
-                    lambda valor: mapear_lista(valor, permissoes_map)
-                )
-            elif mapa_nomes_ids:
-                df_limpo["Quem Recebeu"] = df_limpo["Quem Recebeu"].apply(
-                    lambda valor: mapear_lista(valor, mapa_nomes_ids)
-                )
-            elif escuteiros_map:
-                df_limpo["Quem Recebeu"] = df_limpo["Quem Recebeu"].apply(
-                    lambda valor: mapear_lista(valor, escuteiros_map)
-                )
-
-        if "Valor (€)" in df_limpo.columns:
-            df_limpo["Valor (€)"] = pd.to_numeric(df_limpo["Valor (€)"], errors="coerce")
-        else:
-            df_limpo["Valor (€)"] = pd.Series(dtype="float64")
-
-        if "Data" in df_limpo.columns:
-            df_limpo["Data"] = pd.to_datetime(df_limpo["Data"], errors="coerce").dt.normalize()
-        else:
-            df_limpo["Data"] = pd.Series(dtype="datetime64[ns]")
-
-        if "Categoria" in df_limpo.columns:
-            df_limpo["Categoria"] = df_limpo["Categoria"].apply(lambda valor: mapear_lista(valor, {}))
-        else:
-            df_limpo["Categoria"] = ""
-
-        if "Quem Recebeu" in df_limpo.columns:
-            df_limpo.rename(columns={"Quem Recebeu": "Responsável"}, inplace=True)
-        else:
-            df_limpo["Responsável"] = ""
-
-        for coluna in ("Escuteiro", "Categoria", "Meio de Pagamento", "Responsável"):
-            if coluna not in df_limpo.columns:
-                df_limpo[coluna] = ""
-
-        df_limpo = df_limpo[expected_columns + ["__record_id"]]
-        return df_limpo, escuteiros_map, permissoes_map, mapa_nomes_ids
-
-    def _normalizar_estornos(df_estornos: pd.DataFrame | None) -> pd.DataFrame:
-        expected_columns = ["Escuteiro", "Valor (€)", "Categoria", "Meio de Pagamento", "Data", "Responsável"]
-        if df_estornos is None or not isinstance(df_estornos, pd.DataFrame) or df_estornos.empty:
-            vazio = pd.DataFrame(columns=expected_columns)
-            vazio["Valor (€)"] = pd.Series(dtype="float64")
-            vazio["Data"] = pd.Series(dtype="datetime64[ns]")
-            return vazio
-
-        resultado = df_estornos.copy()
-        if "Valor (€)" in resultado.columns:
-            resultado["Valor (€)"] = pd.to_numeric(resultado["Valor (€)"], errors="coerce")
-        else:
-            resultado["Valor (€)"] = pd.Series(dtype="float64")
-
-        if "Data" in resultado.columns:
-            resultado["Data"] = pd.to_datetime(resultado["Data"], errors="coerce").dt.normalize()
-        else:
-            resultado["Data"] = pd.Series(dtype="datetime64[ns]")
-
-        for coluna in expected_columns:
-            if coluna not in resultado.columns:
-                if coluna == "Valor (€)":
-                    resultado[coluna] = pd.Series(dtype="float64")
-                elif coluna == "Data":
-                    resultado[coluna] = pd.Series(dtype="datetime64[ns]")
-                else:
-                    resultado[coluna] = ""
-
-        colunas_ordem = expected_columns + ["__record_id"] if "__record_id" in resultado.columns else expected_columns
-        return resultado[colunas_ordem]
-
     def _formatar_dataframe_display(df: pd.DataFrame) -> pd.DataFrame:
         if df.empty:
             return df.copy()
@@ -1593,10 +1283,10 @@ def dashboard_tesoureiro(dados: dict):
         )
 
     df_rec_origem = dados.get("Recebimento", pd.DataFrame())
-    df_rec_limpo, escuteiros_map, permissoes_map, mapa_nomes_ids = _preparar_recebimentos(dados)
-    df_estornos = _normalizar_estornos(
-        preparar_dataframe_estornos(dados, escuteiros_map, permissoes_map, mapa_nomes_ids)
-    )
+    # Memoizado pelas versões dos snapshots: reruns de widgets não recalculam a normalização.
+    movimentos = preparar_movimentos_financeiros(dados, incluir_record_id=True)
+    df_rec_limpo = movimentos.recebimentos
+    df_estornos = movimentos.estornos
 
     def _obter_opcoes_meio_pagamento(df_origem: pd.DataFrame) -> list[str]:
         cache_key = f"meios_pagamento_{BASE_ID}"
@@ -1659,6 +1349,25 @@ def dashboard_tesoureiro(dados: dict):
             return "Audit Log"
         return str(nome).strip()
 
+    # Identifica a sessão na escrita em background: cada sessão só vê as suas falhas.
+    sessao_audit = st.session_state.setdefault("audit_log_sessao", uuid.uuid4().hex)
+
+    def _verificar_audit_log(nome_tabela_audit: str) -> Optional[str]:
+        """Recolhe falhas da escrita em background do Audit Log e guarda o aviso na sessão."""
+        falha = audit_log.erro_pendente(BASE_ID, nome_tabela_audit, sessao=sessao_audit)
+        if falha is None:
+            return None
+        mensagem_exc, sem_acesso = falha
+        if sem_acesso:
+            aviso = (
+                f"Os recebimentos foram atualizados, mas não foi possível registar no Audit Log "
+                f"(tabela '{nome_tabela_audit}'). Verifique o nome da tabela e as permissões do token."
+            )
+        else:
+            aviso = f"Falha ao registar no Audit Log: {mensagem_exc}"
+        st.session_state["audit_log_warning_message"] = aviso
+        return aviso
+
     periodo_key = "tesouraria_periodo_movimentos"
     hoje = pd.Timestamp.today().date()
     periodo_padrao: tuple[date, date] = (hoje, hoje)
@@ -1756,6 +1465,11 @@ def dashboard_tesoureiro(dados: dict):
 
     mensagem_sucesso_receb = st.session_state.pop("recebimentos_success_message", None)
     avisos_receb = st.session_state.pop("recebimentos_warning_messages", None)
+    aviso_audit_pendente = _verificar_audit_log(
+        st.session_state.get("audit_log_table_name") or _obter_nome_tabela_audit()
+    )
+    if aviso_audit_pendente:
+        avisos_receb = [*(avisos_receb or []), aviso_audit_pendente]
     if mensagem_sucesso_receb:
         st.success(mensagem_sucesso_receb)
     if avisos_receb:
@@ -1886,61 +1600,58 @@ def dashboard_tesoureiro(dados: dict):
                     if not nome_tabela_audit:
                         nome_tabela_audit = _obter_nome_tabela_audit()
                         st.session_state["audit_log_table_name"] = nome_tabela_audit
-                    audit_indisponivel = st.session_state.get("audit_log_indisponivel", False)
-                    tabela_audit = None
-                    if not audit_indisponivel:
-                        try:
-                            tabela_audit = api.table(BASE_ID, nome_tabela_audit)
-                        except Exception:
-                            tabela_audit = None
+                    _verificar_audit_log(nome_tabela_audit)
+                    audit_indisponivel = audit_log.indisponivel(BASE_ID, nome_tabela_audit)
 
-                    ids_sucesso: list[str] = []
+                    atualizados: list[dict] = []
                     erros: list[str] = []
-                    aviso_audit: str | None = (
-                        st.session_state.get("audit_log_warning_message") if audit_indisponivel else None
+                    aviso_audit: str | None = st.session_state.get("audit_log_warning_message") or (
+                        (
+                            f"Os recebimentos foram atualizados, mas a tabela '{nome_tabela_audit}' do Audit Log "
+                            "está inacessível; as alterações não foram registadas."
+                        )
+                        if audit_indisponivel
+                        else None
                     )
                     utilizador_atual = st.session_state.get("user", {}).get("email", "")
 
-                    for record_id, valor_antigo, valor_novo in alteracoes:
+                    for bloco in em_blocos(alteracoes):
                         try:
-                            tabela_receb.update(record_id, {"Meio de Pagamento": valor_novo})
-                            ids_sucesso.append(record_id)
-                        except Exception as exc:
-                            erros.append(f"{record_id}: {exc}")
-                            continue
-
-                        if tabela_audit is not None:
-                            try:
-                                tabela_audit.create(
-                                    {
-                                        "Tabela Alterada": "Recebimento",
-                                        "ID do Registo": record_id,
-                                        "Data da Mudança": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
-                                        "Informação Antes": f"Meio de Pagamento: {valor_antigo or '-'}",
-                                        "Informação Depois": f"Meio de Pagamento: {valor_novo or '-'}",
-                                        "Mudança Resumida (AI)": f"Alterado de {valor_antigo or '-'} para {valor_novo or '-'}",
-                                        "Usuário": utilizador_atual or "desconhecido",
-                                        "Origem da Mudança": "Streamlit",
-                                    }
+                            atualizados.extend(
+                                tabela_receb.batch_update(
+                                    [
+                                        {"id": record_id, "fields": {"Meio de Pagamento": valor_novo}}
+                                        for record_id, _, valor_novo in bloco
+                                    ]
                                 )
-                            except Exception as exc:
-                                mensagem_exc = str(exc)
-                                if (
-                                    "INVALID_PERMISSIONS_OR_MODEL_NOT_FOUND" in mensagem_exc
-                                    or "Forbidden" in mensagem_exc
-                                ):
-                                    aviso_audit = (
-                                        f"Os recebimentos foram atualizados, mas não foi possível registar no Audit Log "
-                                        f"(tabela '{nome_tabela_audit}'). Verifique o nome da tabela e as permissões do token."
-                                    )
-                                    st.session_state["audit_log_indisponivel"] = True
-                                    st.session_state["audit_log_warning_message"] = aviso_audit
-                                    tabela_audit = None
-                                else:
-                                    aviso_audit = f"Falha ao registar no Audit Log: {mensagem_exc}"
-                                    st.session_state["audit_log_warning_message"] = aviso_audit
-
-                        time.sleep(0.2)
+                            )
+                        except Exception as exc:
+                            erros.extend(f"{record_id}: {exc}" for record_id, _, _ in bloco)
+
+                    ids_sucesso = [registo["id"] for registo in atualizados]
+                    if ids_sucesso and not audit_indisponivel:
+                        data_mudanca = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+                        sucesso = set(ids_sucesso)
+                        audit_log.registar(
+                            api,
+                            BASE_ID,
+                            nome_tabela_audit,
+                            [
+                                {
+                                    "Tabela Alterada": "Recebimento",
+                                    "ID do Registo": record_id,
+                                    "Data da Mudança": data_mudanca,
+                                    "Informação Antes": f"Meio de Pagamento: {valor_antigo or '-'}",
+                                    "Informação Depois": f"Meio de Pagamento: {valor_novo or '-'}",
+                                    "Mudança Resumida (AI)": f"Alterado de {valor_antigo or '-'} para {valor_novo or '-'}",
+                                    "Usuário": utilizador_atual or "desconhecido",
+                                    "Origem da Mudança": "Streamlit",
+                                }
+                                for record_id, valor_antigo, valor_novo in alteracoes
+                                if record_id in sucesso
+                            ],
+                            sessao=sessao_audit,
+                        )
 
                     if ids_sucesso:
                         recentes = set(st.session_state.get("recebimentos_recent_ids", []))
@@ -1956,7 +1667,7 @@ def dashboard_tesoureiro(dados: dict):
                             mensagens_warn.append(aviso_audit)
                         if mensagens_warn:
                             st.session_state["recebimentos_warning_messages"] = mensagens_warn
-                        atualizar_dados_cache()
+                        aplicar_escritas_cache("Recebimento", atualizados=atualizados)
                         st.rerun()
 
                     if erros and not ids_sucesso:
@@ -2423,10 +2134,6 @@ def dashboard_tesoureiro(dados: dict):
 def dashboard_admin(dados: dict):
     st.markdown("## 👑 Dashboard Admin")
 
-    def refrescar_dados():
-        st.session_state["dados_cache"] = carregar_todas_as_tabelas(BASE_ID, role)
-        st.session_state["last_update"] = datetime.now()
-
     df_pedidos = dados.get("Pedidos", pd.DataFrame())
     df_calendario = dados.get("Calendario", pd.DataFrame())
     df_volunt = dados.get("Voluntariado Pais", pd.DataFrame())
@@ -2471,10 +2178,10 @@ def dashboard_admin(dados: dict):
         if "Date" in df_display.columns:
             df_display["Date"] = pd.to_datetime(df_display["Date"], errors="coerce").dt.strftime("%d/%m/%Y")
         if "Escuteiros" in df_display.columns:
-            df_display["Escuteiros"] = df_display["Escuteiros"].apply(lambda v: mapear_lista(v, escuteiros_map))
+            df_display["Escuteiros"] = mapear_serie(df_display["Escuteiros"], escuteiros_map)
         for coluna in ["Lanche", "Bebida", "Fruta"]:
             if coluna in df_display.columns:
-                df_display[coluna] = df_display[coluna].apply(lambda v: mapear_lista(v, recipes_map))
+                df_display[coluna] = mapear_serie(df_display[coluna], recipes_map)
         if "Senha_marcações" in df_display.columns:
             df_display["Senha_marcações"] = df_display["Senha_marcações"].fillna("")
         colunas_exibicao = [
@@ -2484,42 +2191,13 @@ def dashboard_admin(dados: dict):
         ]
         return df_display[colunas_exibicao]
 
-    def _first_existing_col(df_like, candidates):
-        for col_name in candidates:
-            if col_name in df_like.columns:
-                return col_name
-        return None
-
     tipo_cotas_map: dict[str, str] = {}
     if df_tipo_cotas is not None and not df_tipo_cotas.empty and "id" in df_tipo_cotas.columns:
-        col_tipo_nome = _first_existing_col(
-            df_tipo_cotas,
-            [
-                "Tipo de Quotas",
-                "Tipo de Cotas",
-                "Nome",
-                "Name",
-                "Tipo",
-                "Descrição",
-            ],
-        )
+        col_tipo_nome = resolver_campo(df_tipo_cotas, "tipo_cotas_nome")
         if col_tipo_nome:
             serie_map = df_tipo_cotas.set_index("id")[col_tipo_nome].dropna()
             tipo_cotas_map = {str(idx): str(valor) for idx, valor in serie_map.items()}
 
-    def _find_column_keywords(df_like: pd.DataFrame, keyword_groups: list[tuple[str, ...]]):
-        if df_like is None or df_like.empty:
-            return None
-        for keywords in keyword_groups:
-            tokens = [_normalizar_texto(token) for token in keywords if token]
-            if not tokens:
-                continue
-            for coluna in df_like.columns:
-                nome_norm = _normalizar_texto(coluna)
-                if all(token in nome_norm for token in tokens):
-                    return coluna
-        return None
-
     def _preparar_df_quotas(df_like: pd.DataFrame) -> pd.DataFrame:
         base_columns = [
             "Data da cobrança",
@@ -2537,46 +2215,9 @@ def dashboard_admin(dados: dict):
 
         df_display = df_like.copy()
 
-        tipo_col = _first_existing_col(
-            df_display,
-            [
-                "Tipo",
-                "Tipo de Quota",
-                "Tipo da Quota",
-                "Tipo de Cota",
-                "Categoria",
-                "Tipo de Pagamento",
-            ],
-        )
-        if not tipo_col:
-            tipo_col = _find_column_keywords(
-                df_display,
-                [
-                    ("tipo", "quota"),
-                    ("tipo",),
-                ],
-            )
+        tipo_col = resolver_campo(df_display, "quota_tipo")
 
-        periodo_col = _first_existing_col(
-            df_display,
-            [
-                "Quota_periodo",
-                "Quota Periodo",
-                "Quota Período",
-                "Quota período",
-                "Quota - Período",
-                "Período",
-            ],
-        )
-        if not periodo_col:
-            periodo_col = _find_column_keywords(
-                df_display,
-                [
-                    ("quota", "periodo"),
-                    ("quota", "período"),
-                    ("periodo",),
-                ],
-            )
+        periodo_col = resolver_campo(df_display, "quota_periodo")
         if not periodo_col and tipo_col:
             periodo_col = tipo_col
 
@@ -2610,7 +2251,7 @@ def dashboard_admin(dados: dict):
             df_display["__periodo_label"] = pd.Series("", index=df_display.index, dtype="object")
 
         def _detectar_tipo(texto: str) -> str:
-            texto_norm = _normalizar_texto(texto)
+            texto_norm = normalizar_texto(texto)
             if "mens" in texto_norm:
                 return "mensal"
             if "anu" in texto_norm:
@@ -2624,26 +2265,7 @@ def dashboard_admin(dados: dict):
                 _detectar_tipo
             )
 
-        data_col = _first_existing_col(
-            df_display,
-            [
-                "Data da Cobrança",
-                "Data da cobrança",
-                "Data cobrança",
-                "Data de Cobrança",
-                "Data de cobrança",
-                "Data",
-            ],
-        )
-        if not data_col:
-            data_col = _find_column_keywords(
-                df_display,
-                [
-                    ("data", "cobranca"),
-                    ("data", "cobrança"),
-                    ("data",),
-                ],
-            )
+        data_col = resolver_campo(df_display, "quota_data")
         if data_col:
             df_display["__data"] = pd.to_datetime(df_display[data_col], errors="coerce")
             df_display["Data da cobrança"] = df_display["__data"].dt.strftime("%d/%m/%Y")
@@ -2654,26 +2276,9 @@ def dashboard_admin(dados: dict):
             else:
                 df_display["Data da cobrança"] = ""
 
-        esc_col = _first_existing_col(
-            df_display,
-            [
-                "Escuteiro",
-                "Escuteiros",
-                "Nome do Escuteiro",
-                "Nome do Escuteiro (from Escuteiros)",
-                "Responsável",
-            ],
-        )
-        if not esc_col:
-            esc_col = _find_column_keywords(
-                df_display,
-                [
-                    ("escuteiro",),
-                    ("nome", "escuteiro"),
-                ],
-            )
+        esc_col = resolver_campo(df_display, "quota_escuteiro")
         if esc_col:
-            df_display["Escuteiro"] = df_display[esc_col].apply(lambda v: mapear_lista(v, escuteiros_map))
+            df_display["Escuteiro"] = mapear_serie(df_display[esc_col], escuteiros_map)
         else:
             df_display["Escuteiro"] = df_display.get("Escuteiro", "").fillna("").astype(str)
 
@@ -2701,25 +2306,7 @@ def dashboard_admin(dados: dict):
             except ValueError:
                 return None
 
-        valor_col = _first_existing_col(
-            df_display,
-            [
-                "Valor",
-                "Valor (€)",
-                "Valor da Quota",
-                "Valor da quota",
-                "Valor de Cobrança",
-                "Valor Recebido",
-            ],
-        )
-        if not valor_col:
-            valor_col = _find_column_keywords(
-                df_display,
-                [
-                    ("valor",),
-                    ("montante",),
-                ],
-            )
+        valor_col = resolver_campo(df_display, "quota_valor")
         if valor_col:
             df_display["Valor"] = df_display[valor_col].apply(_parse_valor)
         else:
@@ -2864,12 +2451,12 @@ def dashboard_admin(dados: dict):
             if not df_pedidos.empty and "Created" in df_pedidos.columns:
                 df_recent = df_pedidos.sort_values("Created", ascending=False).head(5).copy()
                 if "Escuteiros" in df_recent.columns:
-                    df_recent["Escuteiros"] = df_recent["Escuteiros"].apply(lambda v: mapear_lista(v, escuteiros_map))
+                    df_recent["Escuteiros"] = mapear_serie(df_recent["Escuteiros"], escuteiros_map)
                 if "Senha_marcações" in df_recent.columns:
                     df_recent["Senha_marcações"] = df_recent["Senha_marcações"].fillna("")
                 for coluna in ["Lanche", "Bebida", "Fruta"]:
                     if coluna in df_recent.columns:
-                        df_recent[coluna] = df_recent[coluna].apply(lambda v: mapear_lista(v, recipes_map))
+                        df_recent[coluna] = mapear_serie(df_recent[coluna], recipes_map)
                 cols = [
                     c
                     for c in ["Created", "Escuteiros", "Lanche", "Bebida", "Fruta", "Senha_marcações"]
@@ -3112,17 +2699,7 @@ def dashboard_admin(dados: dict):
                     df_volunt_valid = df_volunt_valid[
                         ~df_volunt_valid["Cancelado"].astype(str).str.lower().eq("true")
                     ]
-                coluna_ligacao = _first_existing_col(
-                    df_volunt_valid,
-                    [
-                        "Record_ID Calendário (from Date ( calendário ))",
-                        "Record_ID Calendário (from Date (calendário))",
-                        "Record_ID Calendario (from Date ( calendario ))",
-                        "Date ( calendário )",
-                        "Date (calendário)",
-                        "Date ( calendario )",
-                    ],
-                )
+                coluna_ligacao = resolver_campo(df_volunt_valid, "voluntariado_evento")
                 if coluna_ligacao:
                     for val in df_volunt_valid[coluna_ligacao].dropna():
                         if isinstance(val, list):
@@ -3273,14 +2850,110 @@ def dashboard_admin(dados: dict):
                     if local_novo is not None:
                         campos["Local"] = local_novo
                     try:
-                        api.table(BASE_ID, "Calendario").create(campos)
+                        criado = api.table(BASE_ID, "Calendario").create(campos)
                     except Exception as exc:
                         st.error(f"Não consegui criar o evento: {exc}")
                     else:
                         st.success("Evento criado com sucesso.")
-                        refrescar_dados()
+                        aplicar_escritas_cache("Calendario", criados=[criado])
                         st.rerun()
 
+            with st.expander("Criar eventos recorrentes", expanded=False):
+                st.caption("Gera um evento por semana no dia escolhido (p.ex. as atividades de sábado do ano escutista).")
+                col_inicio, col_fim, col_dia, col_intervalo = st.columns(4)
+                rec_inicio = col_inicio.date_input("Início", value=hoje.date(), key="admin_rec_inicio")
+                rec_fim = col_fim.date_input("Fim", value=(hoje + pd.DateOffset(months=9)).date(), key="admin_rec_fim")
+                rec_dia = col_dia.selectbox(
+                    "Dia da semana",
+                    options=list(range(7)),
+                    index=5,
+                    format_func=lambda i: DIAS_SEMANA[i],
+                    key="admin_rec_dia",
+                )
+                rec_intervalo = col_intervalo.number_input(
+                    "A cada (semanas)", min_value=1, max_value=4, value=1, step=1, key="admin_rec_intervalo"
+                )
+                rec_agenda = st.text_input("Agenda/Descrição", key="admin_rec_agenda")
+                rec_local = (
+                    st.text_input("Local", value="", key="admin_rec_local") if "Local" in df_cal_full.columns else None
+                )
+                col_prep, col_feriados, col_existentes = st.columns(3)
+                rec_prepara = col_prep.checkbox("Haverá preparação de Lanches?", value=True, key="admin_rec_prepara")
+                rec_feriados = col_feriados.checkbox("Excluir feriados nacionais", value=True, key="admin_rec_feriados")
+                rec_saltar = col_existentes.checkbox(
+                    "Saltar dias que já têm evento", value=True, key="admin_rec_saltar"
+                )
+                rec_excluir_txt = st.text_area(
+                    "Outras datas a excluir (uma por linha, dd/mm/aaaa)", key="admin_rec_excluir", height=80
+                )
+
+                excluir_datas = set()
+                datas_invalidas = []
+                for linha in rec_excluir_txt.splitlines():
+                    linha = linha.strip()
+                    if not linha:
+                        continue
+                    convertida = pd.to_datetime(linha, dayfirst=True, errors="coerce")
+                    if pd.isna(convertida):
+                        datas_invalidas.append(linha)
+                    else:
+                        excluir_datas.add(convertida.date())
+                if datas_invalidas:
+                    st.warning(f"Datas ignoradas (formato inválido): {', '.join(datas_invalidas)}")
+                if rec_saltar:
+                    excluir_datas.update(df_cal_full["__data"].dropna().dt.date)
+
+                try:
+                    datas_rec, excluidas_rec = gerar_datas_recorrentes(
+                        rec_inicio,
+                        rec_fim,
+                        int(rec_dia),
+                        intervalo_semanas=int(rec_intervalo),
+                        excluir=excluir_datas,
+                        excluir_feriados=rec_feriados,
+                    )
+                except ValueError as exc:
+                    st.error(str(exc))
+                    datas_rec, excluidas_rec = [], []
+
+                if datas_rec or excluidas_rec:
+                    preview = pd.DataFrame(
+                        [{"Data": d, "Dia": DIAS_SEMANA[d.weekday()], "Situação": "A criar"} for d in datas_rec]
+                        + [{"Data": d, "Dia": DIAS_SEMANA[d.weekday()], "Situação": f"Excluída ({motivo})"} for d, motivo in excluidas_rec]
+                    ).sort_values("Data")
+                    st.dataframe(preview, use_container_width=True, hide_index=True, height=240)
+
+                if st.button(
+                    f"Criar {len(datas_rec)} evento(s)",
+                    key="admin_rec_criar",
+                    disabled=not datas_rec,
+                ):
+                    registos_novos = []
+                    for data_evento in datas_rec:
+                        campos = {
+                            "Data": data_evento.strftime("%Y-%m-%d"),
+                            "Agenda": rec_agenda,
+                            "Haverá preparação de Lanches?": rec_prepara,
+                        }
+                        if rec_local is not None:
+                            campos["Local"] = rec_local
+                        registos_novos.append(campos)
+
+                    tabela_cal = api.table(BASE_ID, "Calendario")
+                    criados: list[dict] = []
+                    for bloco in em_blocos(registos_novos):
+                        try:
+                            criados.extend(tabela_cal.batch_create(bloco))
+                        except Exception as exc:
+                            st.error(f"Não consegui criar os eventos a partir de {bloco[0]['Data']}: {exc}")
+                            break
+                    if criados:
+                        aplicar_escritas_cache("Calendario", criados=criados)
+                        if len(criados) == len(registos_novos):
+                            st.success(f"{len(criados)} evento(s) criados.")
+                            st.rerun()
+                        st.warning(f"Só {len(criados)} de {len(registos_novos)} evento(s) foram criados.")
+
             st.markdown("##### Editar / cancelar eventos futuros")
             if futuros.empty:
                 st.info("Sem eventos futuros para editar.")
@@ -3385,18 +3058,26 @@ def dashboard_admin(dados: dict):
                         if norm_id:
                             original_map[norm_id] = rec
 
-                    atualizados = 0
-                    removidos = 0
+                    # Estado original indexado por id (evita procurar cada evento em df_manage).
+                    df_original = df_manage.drop_duplicates("ID").set_index("ID")
+                    agenda_original_por_id = df_original["_agenda_raw"].to_dict()
+                    prep_original_por_id = df_original["Preparação"].to_dict()
+                    local_original_por_id = df_original[col_local].to_dict() if col_local else {}
+
+                    # Eventos com qualquer voluntariado associado (mesmo cancelado) não podem ser apagados.
+                    eventos_com_voluntarios: set[str] = set()
+                    if not df_volunt.empty and "Date (calendário)" in df_volunt.columns:
+                        for valor in df_volunt["Date (calendário)"]:
+                            if isinstance(valor, list):
+                                eventos_com_voluntarios.update(valor)
+                            elif isinstance(valor, str) and valor:
+                                eventos_com_voluntarios.add(valor)
+
+                    por_atualizar: list[dict] = []
+                    por_apagar: list[str] = []
                     bloqueados = []
                     tbl_cal = api.table(BASE_ID, "Calendario")
 
-                    def _tem_voluntarios(evento_id: str) -> bool:
-                        if df_volunt.empty or "Date (calendário)" not in df_volunt.columns:
-                            return False
-                        return df_volunt["Date (calendário)"].apply(
-                            lambda v: evento_id in v if isinstance(v, list) else v == evento_id
-                        ).any()
-
                     for row in edited_records:
                         event_id = _normalize_id(row.get("ID"))
                         if not event_id:
@@ -3406,15 +3087,10 @@ def dashboard_admin(dados: dict):
                             continue
 
                         if row.get("Apagar"):
-                            if _tem_voluntarios(event_id):
+                            if event_id in eventos_com_voluntarios:
                                 bloqueados.append((event_id, "Existe voluntariado associado"))
-                                continue
-                            try:
-                                tbl_cal.delete(event_id)
-                            except Exception as exc:
-                                st.error(f"Não consegui apagar o evento {event_id}: {exc}")
                             else:
-                                removidos += 1
+                                por_apagar.append(event_id)
                             continue
 
                         campos_update = {}
@@ -3435,51 +3111,49 @@ def dashboard_admin(dados: dict):
                             if agenda_nova.startswith("[CANCELADO]"):
                                 agenda_nova = agenda_nova.replace("[CANCELADO]", "", 1).strip()
 
-                        agenda_original = (
-                            df_manage.loc[df_manage["ID"] == event_id, "_agenda_raw"].iloc[0]
-                            if event_id in df_manage["ID"].values
-                            else ""
-                        )
-                        if agenda_nova != (agenda_original or ""):
+                        if agenda_nova != (agenda_original_por_id.get(event_id) or ""):
                             campos_update["Agenda"] = agenda_nova
 
                         prep_novo = bool(row.get("Preparação", False))
-                        prep_original = (
-                            bool(df_manage.loc[df_manage["ID"] == event_id, "Preparação"].iloc[0])
-                            if event_id in df_manage["ID"].values
-                            else False
-                        )
+                        prep_original = bool(prep_original_por_id.get(event_id, False))
                         if estado_novo != "Cancelado" and prep_novo != prep_original:
                             campos_update["Haverá preparação de Lanches?"] = prep_novo
 
                         if "Local" in row:
                             local_novo = row.get("Local", "")
-                            local_original = (
-                                df_manage.loc[df_manage["ID"] == event_id, "Local"].iloc[0]
-                                if (col_local and event_id in df_manage["ID"].values)
-                                else ""
-                            )
+                            local_original = local_original_por_id.get(event_id, "")
+                            if pd.isna(local_original):
+                                local_original = ""
                             if (local_novo or "") != (local_original or ""):
                                 campos_update["Local"] = local_novo
 
-                        if not campos_update:
-                            continue
+                        if campos_update:
+                            por_atualizar.append({"id": event_id, "fields": campos_update})
 
+                    atualizados: list[dict] = []
+                    removidos: list[str] = []
+                    for bloco in em_blocos(por_atualizar):
+                        try:
+                            atualizados.extend(tbl_cal.batch_update(bloco))
+                        except Exception as exc:
+                            ids_bloco = ", ".join(registo["id"] for registo in bloco)
+                            st.error(f"Não consegui atualizar os eventos {ids_bloco}: {exc}")
+                    for bloco in em_blocos(por_apagar):
                         try:
-                            tbl_cal.update(event_id, campos_update)
+                            tbl_cal.batch_delete(bloco)
                         except Exception as exc:
-                            st.error(f"Não consegui atualizar o evento {event_id}: {exc}")
+                            st.error(f"Não consegui apagar os eventos {', '.join(bloco)}: {exc}")
                         else:
-                            atualizados += 1
+                            removidos.extend(bloco)
 
                     if atualizados or removidos:
                         mensagens = []
                         if atualizados:
-                            mensagens.append(f"{atualizados} evento(s) atualizados")
+                            mensagens.append(f"{len(atualizados)} evento(s) atualizados")
                         if removidos:
-                            mensagens.append(f"{removidos} evento(s) apagados")
+                            mensagens.append(f"{len(removidos)} evento(s) apagados")
                         st.success("; ".join(mensagens) + ".")
-                        refrescar_dados()
+                        aplicar_escritas_cache("Calendario", atualizados=atualizados, apagados=removidos)
                         st.rerun()
                     else:
                         st.info("Nenhuma alteração para guardar.")
@@ -0,0 +1,313 @@
+"""Persistência local (SQLite) dos snapshots da cache partilhada.
+
+Um restart/redeploy perde a memória do processo; com este ficheiro o primeiro
+utilizador depois do arranque recebe logo o último snapshot conhecido e o loader
+só pede ao Airtable o que mudou entretanto (sincronização incremental).
+
+Cada linha guarda uma tabela ``(base_id, nome, campos)`` com os registos em JSON,
+a versão e os carimbos de sincronização. Falhas de disco nunca bloqueiam a app:
+o store é só uma aceleração e a fonte de verdade continua a ser o Airtable.
+
+As gravações saem do pedido: ``guardar``/``atualizar_sincronizacao``/``remover``
+deixam só o estado mais recente de cada tabela numa fila e uma thread grava-o ao fim
+de ``ATRASO_ESCRITA_SEGUNDOS`` (várias versões seguidas da mesma tabela custam uma
+escrita). ``carregar`` aplica primeiro o que houver pendente para essa tabela; à saída
+do processo a fila é despejada (``gravar_pendentes``).
+
+Dados pessoais: por omissão só são gravadas as tabelas de ``TABELAS_PADRAO`` (sem
+dados pessoais); ``AIRTABLE_SNAPSHOT_TABELAS="A,B"`` escolhe outras e ``"*"`` grava
+todas. Credenciais (``CAMPOS_SENSIVEIS``, p.ex. ``Escuteiros.Senha_Painel``) nunca vão
+para o disco: snapshots que as tenham ficam só em memória (projeções sem esses campos
+continuam a ser gravadas). Linhas antigas de tabelas fora da lista ou com esses campos
+são apagadas ao ler.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+
+CAMINHO_PADRAO = os.path.join(".cache", "airtable_snapshots.sqlite3")
+# Caminho vazio desativa a persistência.
+CAMINHO_STORE = os.environ.get("AIRTABLE_SNAPSHOT_PATH", CAMINHO_PADRAO)
+# Campos nunca persistidos; acrescentam-se outros com AIRTABLE_SNAPSHOT_CAMPOS_SENSIVEIS="A,B".
+CAMPOS_SENSIVEIS = frozenset(
+    {"Senha_Painel"}
+    | {c.strip() for c in os.environ.get("AIRTABLE_SNAPSHOT_CAMPOS_SENSIVEIS", "").split(",") if c.strip()}
+)
+
+# Tabelas sem dados pessoais, gravadas por omissão.
+TABELAS_PADRAO = frozenset({"Recipes", "Publicar Menu do Scouts", "Tipo de Cotas", "Inventario", "Caixas", "Eventos"})
+_TABELAS_ENV = os.environ.get("AIRTABLE_SNAPSHOT_TABELAS")
+# None = todas as tabelas.
+TABELAS_PERSISTIDAS: Optional[frozenset] = (
+    TABELAS_PADRAO
+    if _TABELAS_ENV is None
+    else None
+    if _TABELAS_ENV.strip() == "*"
+    else frozenset(t.strip() for t in _TABELAS_ENV.split(",") if t.strip())
+)
+ATRASO_ESCRITA_SEGUNDOS = 5.0
+
+_Chave = Tuple[str, str, str]
+
+# _LOCK serializa o acesso ao ficheiro; _CONDICAO protege a fila (adquirida depois de _LOCK).
+_LOCK = threading.Lock()
+_CONDICAO = threading.Condition()
+_PENDENTES: Dict[_Chave, Tuple[str, Any]] = {}
+_THREAD: Optional[threading.Thread] = None
+
+
+@dataclass
+class SnapshotGuardado:
+    """Snapshot lido do disco, pronto a hidratar a cache em memória."""
+
+    df: pd.DataFrame
+    versao: int
+    sincronizado_em: Optional[datetime]
+    completo_em_epoch: Optional[float]
+    campos: Optional[Tuple[str, ...]]
+
+
+def ativo() -> bool:
+    return bool(CAMINHO_STORE)
+
+
+def tabela_persistida(nome: str) -> bool:
+    return TABELAS_PERSISTIDAS is None or nome in TABELAS_PERSISTIDAS
+
+
+@contextmanager
+def _ligar() -> Iterator[sqlite3.Connection]:
+    """Ligação curta (uma por operação), com commit no fim e sempre fechada."""
+    pasta = os.path.dirname(CAMINHO_STORE)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    conn = sqlite3.connect(CAMINHO_STORE, timeout=10)
+    try:
+        _criar_schema(conn)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _criar_schema(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            base_id TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            chave_campos TEXT NOT NULL,
+            campos TEXT,
+            versao INTEGER NOT NULL,
+            sincronizado_em TEXT,
+            completo_em REAL,
+            guardado_em REAL NOT NULL,
+            registos TEXT NOT NULL,
+            PRIMARY KEY (base_id, nome, chave_campos)
+        )
+        """
+    )
+
+
+def _chave_campos(campos: Optional[Tuple[str, ...]]) -> str:
+    return json.dumps(list(campos)) if campos is not None else ""
+
+
+def _valor_vazio(valor: Any) -> bool:
+    return valor is None or valor is pd.NA or valor is pd.NaT or (isinstance(valor, float) and math.isnan(valor))
+
+
+def tem_campos_sensiveis(colunas) -> bool:
+    return any(coluna in CAMPOS_SENSIVEIS for coluna in colunas)
+
+
+def dataframe_para_registos(df: pd.DataFrame) -> List[dict]:
+    """Inverso de ``registos_para_dataframe``: volta ao formato `{"id", "fields"}` do Airtable."""
+    if df.empty or "id" not in df.columns:
+        return []
+    registos = []
+    for linha in df.to_dict("records"):
+        registo_id = linha.pop("id")
+        registos.append({"id": registo_id, "fields": {k: v for k, v in linha.items() if not _valor_vazio(v)}})
+    return registos
+
+
+def guardar(
+    base_id: str,
+    nome: str,
+    chave_campos: Optional[Tuple[str, ...]],
+    df: pd.DataFrame,
+    *,
+    versao: int,
+    sincronizado_em: Optional[datetime],
+    completo_em_epoch: Optional[float],
+    campos: Optional[Tuple[str, ...]],
+) -> None:
+    """Agenda a gravação (substituição) do snapshot; com campos sensíveis, apaga o que houver.
+
+    `df` não pode ser alterado depois (os snapshots da cache são substituídos, nunca editados).
+    """
+    if not ativo() or not tabela_persistida(nome):
+        return
+    chave = (base_id, nome, _chave_campos(chave_campos))
+    if tem_campos_sensiveis(df.columns):
+        _agendar(chave, ("remover", None))
+        return
+    dados = {
+        "df": df,
+        "campos": campos,
+        "versao": versao,
+        "sincronizado_em": sincronizado_em,
+        "completo_em_epoch": completo_em_epoch,
+    }
+    _agendar(chave, ("guardar", dados))
+
+
+def atualizar_sincronizacao(
+    base_id: str,
+    nome: str,
+    chave_campos: Optional[Tuple[str, ...]],
+    sincronizado_em: datetime,
+) -> None:
+    """Renova só o carimbo de sincronização (sincronização sem alterações)."""
+    if not ativo() or not tabela_persistida(nome):
+        return
+    chave = (base_id, nome, _chave_campos(chave_campos))
+    with _CONDICAO:
+        pendente = _PENDENTES.get(chave)
+        if pendente is not None and pendente[0] == "guardar":
+            pendente[1]["sincronizado_em"] = sincronizado_em
+            return
+        if pendente is not None and pendente[0] == "remover":
+            return
+    _agendar(chave, ("sincronizacao", sincronizado_em))
+
+
+def remover(base_id: str, nome: str, chave_campos: Optional[Tuple[str, ...]]) -> None:
+    if not ativo():
+        return
+    _agendar((base_id, nome, _chave_campos(chave_campos)), ("remover", None))
+
+
+def carregar(
+    base_id: str,
+    nome: str,
+    chave_campos: Optional[Tuple[str, ...]],
+) -> Optional[SnapshotGuardado]:
+    """Lê o snapshot guardado, ou None se não existir/estiver ilegível."""
+    if not ativo():
+        return None
+    chave = (base_id, nome, _chave_campos(chave_campos))
+    try:
+        with _LOCK:
+            with _CONDICAO:
+                pendente = _PENDENTES.pop(chave, None)
+            if pendente is not None:
+                _executar(chave, pendente)
+            if not os.path.exists(CAMINHO_STORE):
+                return None
+            with _ligar() as conn:
+                linha = conn.execute(
+                    "SELECT campos, versao, sincronizado_em, completo_em, registos FROM snapshots "
+                    "WHERE base_id = ? AND nome = ? AND chave_campos = ?",
+                    chave,
+                ).fetchone()
+        if linha is None:
+            return None
+        campos, versao, sincronizado_em, completo_em, registos = linha
+        df = pd.DataFrame([{"id": r["id"], **r.get("fields", {})} for r in json.loads(registos)])
+        if not tabela_persistida(nome) or tem_campos_sensiveis(df.columns):
+            remover(base_id, nome, chave_campos)  # gravado antes da lista atual
+            return None
+        return SnapshotGuardado(
+            df=df,
+            versao=int(versao),
+            sincronizado_em=datetime.fromisoformat(sincronizado_em) if sincronizado_em else None,
+            completo_em_epoch=completo_em,
+            campos=tuple(json.loads(campos)) if campos else None,
+        )
+    except (OSError, sqlite3.Error, ValueError, KeyError, TypeError):
+        return None
+
+
+def gravar_pendentes() -> None:
+    """Grava já tudo o que está na fila (saída do processo, scripts)."""
+    while True:
+        with _LOCK:
+            with _CONDICAO:
+                if not _PENDENTES:
+                    return
+                chave = next(iter(_PENDENTES))
+                operacao = _PENDENTES.pop(chave)
+            _executar(chave, operacao)
+
+
+def _agendar(chave: _Chave, operacao: Tuple[str, Any]) -> None:
+    global _THREAD
+    with _CONDICAO:
+        _PENDENTES[chave] = operacao
+        if _THREAD is None or not _THREAD.is_alive():
+            if _THREAD is None:
+                atexit.register(gravar_pendentes)
+            _THREAD = threading.Thread(target=_ciclo, name="snapshot-store", daemon=True)
+            _THREAD.start()
+        _CONDICAO.notify()
+
+
+def _ciclo() -> None:
+    while True:
+        with _CONDICAO:
+            while not _PENDENTES:
+                _CONDICAO.wait()
+        # Espera antes de gravar: versões seguintes da mesma tabela substituem a pendente.
+        time.sleep(ATRASO_ESCRITA_SEGUNDOS)
+        gravar_pendentes()
+
+
+def _executar(chave: _Chave, operacao: Tuple[str, Any]) -> None:
+    """Aplica uma operação da fila no ficheiro (chamado com `_LOCK`)."""
+    tipo, dados = operacao
+    try:
+        if tipo == "remover":
+            if not os.path.exists(CAMINHO_STORE):
+                return
+            with _ligar() as conn:
+                conn.execute("DELETE FROM snapshots WHERE base_id = ? AND nome = ? AND chave_campos = ?", chave)
+        elif tipo == "sincronizacao":
+            with _ligar() as conn:
+                conn.execute(
+                    "UPDATE snapshots SET sincronizado_em = ?, guardado_em = ? "
+                    "WHERE base_id = ? AND nome = ? AND chave_campos = ?",
+                    (dados.isoformat(), time.time(), *chave),
+                )
+        else:
+            registos = json.dumps(dataframe_para_registos(dados["df"]), default=str, ensure_ascii=False)
+            with _ligar() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        *chave,
+                        json.dumps(list(dados["campos"])) if dados["campos"] is not None else None,
+                        dados["versao"],
+                        dados["sincronizado_em"].isoformat() if dados["sincronizado_em"] else None,
+                        dados["completo_em_epoch"],
+                        time.time(),
+                        registos,
+                    ),
+                )
+    except (OSError, sqlite3.Error, TypeError, ValueError):
+        pass  # persistência é opcional
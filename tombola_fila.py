@@ -0,0 +1,365 @@
+"""Fila local (write-ahead) das operações de stock da Tômbola.
+
+Nos eventos a rede é fraca: cada saída registada ao balcão custava várias idas ao
+Airtable e uma falha perdia a operação. Aqui a operação é gravada primeiro num diário
+SQLite local (instantâneo) e validada contra uma projeção local do stock
+(stock em cache + operações ainda por sincronizar). Um worker em background por base
+envia o diário ao Airtable em lotes (``tombola_utils.sincronizar_operacoes``), com
+reenvios espaçados e uma chave de idempotência por operação, para que um reenvio
+nunca duplique movimentos.
+
+Estados: ``pendente`` (por enviar), ``aplicando`` (envio iniciado; inventário
+possivelmente escrito), ``inventario_escrito`` (inventário confirmado, falta o
+movimento: um reenvio só cria o movimento), ``sincronizado`` e ``erro`` (rejeitada;
+não volta a ser enviada).
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pyairtable import Api
+
+from tombola_utils import sincronizar_operacoes, tabelas_stock
+
+
+CAMINHO_PADRAO = os.path.join(".cache", "tombola_fila.sqlite3")
+# Caminho vazio desativa a fila (as operações voltam a ser síncronas).
+CAMINHO_FILA = os.environ.get("TOMBOLA_FILA_PATH", CAMINHO_PADRAO)
+
+INTERVALO_WORKER_SEGUNDOS = 10
+LIMITE_POR_CICLO = 50
+ESPERA_MAXIMA_SEGUNDOS = 300
+
+ESTADOS_PENDENTES = ("pendente", "aplicando", "inventario_escrito")
+# Operações cujo delta ainda não está no stock do Airtable (projeção local).
+ESTADOS_POR_APLICAR = ("pendente", "aplicando")
+
+_LOCK = threading.Lock()
+_LOCKS_SINCRONIZACAO: Dict[str, threading.Lock] = {}
+_WORKERS: Dict[str, "_Worker"] = {}
+
+
+@dataclass
+class Operacao:
+    chave: str
+    base_id: str
+    tipo: str
+    item_id: str
+    quantidade: int
+    delta: int
+    executado_por: str
+    evento_id: Optional[str]
+    notas: str
+    estado: str
+    tentativas: int
+    criado_em: float
+    ultimo_erro: Optional[str] = None
+    quantidade_final: Optional[float] = None
+    movimento_id: Optional[str] = None
+    sincronizado_em: Optional[float] = None
+
+
+def ativa() -> bool:
+    return bool(CAMINHO_FILA)
+
+
+@contextmanager
+def _ligar() -> Iterator[sqlite3.Connection]:
+    pasta = os.path.dirname(CAMINHO_FILA)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    conn = sqlite3.connect(CAMINHO_FILA, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS operacoes (
+                chave TEXT PRIMARY KEY,
+                base_id TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                quantidade INTEGER NOT NULL,
+                delta INTEGER NOT NULL,
+                executado_por TEXT NOT NULL,
+                evento_id TEXT,
+                notas TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                tentativas INTEGER NOT NULL DEFAULT 0,
+                proxima_tentativa REAL NOT NULL,
+                criado_em REAL NOT NULL,
+                ultimo_erro TEXT,
+                quantidade_final REAL,
+                movimento_id TEXT,
+                sincronizado_em REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_operacoes_estado ON operacoes (base_id, estado)")
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _operacao(linha: sqlite3.Row) -> Operacao:
+    return Operacao(**{campo: linha[campo] for campo in Operacao.__dataclass_fields__})
+
+
+def deltas_pendentes(base_id: str) -> Dict[str, int]:
+    """Soma dos deltas ainda não sincronizados, por item (projeção local do stock)."""
+    if not ativa():
+        return {}
+    with _LOCK, _ligar() as conn:
+        linhas = conn.execute(
+            "SELECT item_id, SUM(delta) FROM operacoes WHERE base_id = ? AND estado IN (?, ?) GROUP BY item_id",
+            (base_id, *ESTADOS_POR_APLICAR),
+        ).fetchall()
+    return {item_id: int(total) for item_id, total in linhas}
+
+
+def enfileirar(
+    base_id: str,
+    *,
+    tipo: str,
+    item_id: str,
+    quantidade: int,
+    executado_por: str,
+    stock_atual: float,
+    evento_id: Optional[str] = None,
+    notas: str = "",
+) -> Operacao:
+    """Regista uma Entrada/Saída/Ajuste no diário local e acorda o worker.
+
+    `stock_atual` é o stock conhecido (cache); a validação usa-o somado às operações
+    pendentes do mesmo item. Erros de validação levantam ValueError; falhas a gravar
+    o diário propagam-se (a operação não ficou registada).
+    """
+    if tipo not in {"Entrada", "Saída", "Ajuste"}:
+        raise ValueError("Tipo de movimento inválido para ajuste de stock.")
+    if tipo in {"Saída", "Ajuste"} and not (notas or "").strip():
+        raise ValueError("Notas são obrigatórias para Saída, Ajuste e Transferência.")
+    if not (executado_por or "").strip():
+        raise ValueError("ExecutadoPor é obrigatório com o email do utilizador autenticado.")
+    quantidade = int(quantidade)
+    if quantidade <= 0:
+        raise ValueError("A quantidade tem de ser maior que zero.")
+    delta = -quantidade if tipo == "Saída" else quantidade
+
+    agora = time.time()
+    operacao = Operacao(
+        chave=uuid.uuid4().hex,
+        base_id=base_id,
+        tipo=tipo,
+        item_id=item_id,
+        quantidade=quantidade,
+        delta=delta,
+        executado_por=executado_por.strip(),
+        evento_id=evento_id,
+        notas=(notas or "").strip(),
+        estado="pendente",
+        tentativas=0,
+        criado_em=agora,
+    )
+    with _LOCK, _ligar() as conn:
+        (pendente,) = conn.execute(
+            "SELECT COALESCE(SUM(delta), 0) FROM operacoes WHERE base_id = ? AND item_id = ? AND estado IN (?, ?)",
+            (base_id, item_id, *ESTADOS_POR_APLICAR),
+        ).fetchone()
+        if float(stock_atual) + pendente + delta < 0:
+            raise ValueError("Operação inválida: stock não pode ficar negativo.")
+        conn.execute(
+            "INSERT INTO operacoes (chave, base_id, tipo, item_id, quantidade, delta, executado_por, evento_id, "
+            "notas, estado, tentativas, proxima_tentativa, criado_em) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)",
+            (
+                operacao.chave,
+                base_id,
+                tipo,
+                item_id,
+                quantidade,
+                delta,
+                operacao.executado_por,
+                evento_id,
+                operacao.notas,
+                "pendente",
+                agora,
+                agora,
+            ),
+        )
+    worker = _WORKERS.get(base_id)
+    if worker is not None:
+        worker.acordar()
+    return operacao
+
+
+def listar(base_id: str, *, limite: int = 50) -> List[Operacao]:
+    """Operações mais recentes (as pendentes primeiro)."""
+    if not ativa():
+        return []
+    with _LOCK, _ligar() as conn:
+        linhas = conn.execute(
+            "SELECT * FROM operacoes WHERE base_id = ? "
+            "ORDER BY estado IN ('pendente', 'aplicando', 'inventario_escrito') DESC, criado_em DESC LIMIT ?",
+            (base_id, limite),
+        ).fetchall()
+    return [_operacao(linha) for linha in linhas]
+
+
+def resumo(base_id: str) -> Dict[str, int]:
+    if not ativa():
+        return {}
+    with _LOCK, _ligar() as conn:
+        linhas = conn.execute(
+            "SELECT estado, COUNT(*) FROM operacoes WHERE base_id = ? GROUP BY estado", (base_id,)
+        ).fetchall()
+    return {estado: int(total) for estado, total in linhas}
+
+
+def _lock_sincronizacao(base_id: str) -> threading.Lock:
+    with _LOCK:
+        return _LOCKS_SINCRONIZACAO.setdefault(base_id, threading.Lock())
+
+
+def _espera(tentativas: int) -> float:
+    return min(ESPERA_MAXIMA_SEGUNDOS, 5 * 2 ** max(tentativas - 1, 0))
+
+
+def sincronizar(
+    api: Api,
+    base_id: str,
+    *,
+    limite: int = LIMITE_POR_CICLO,
+    tabelas: Optional[Tuple[str, str]] = None,
+) -> Dict[str, int]:
+    """Envia ao Airtable as operações pendentes cuja próxima tentativa já chegou.
+
+    Devolve a contagem de resultados por estado. Uma chamada de cada vez por base.
+    `tabelas` (Inventário, Movimentos) vêm da sessão quando omitidas.
+    """
+    if not ativa():
+        return {}
+    tabelas = tabelas or tabelas_stock()
+    with _lock_sincronizacao(base_id):
+        agora = time.time()
+        with _LOCK, _ligar() as conn:
+            linhas = conn.execute(
+                "SELECT * FROM operacoes WHERE base_id = ? AND estado IN (?, ?, ?) AND proxima_tentativa <= ? "
+                "ORDER BY criado_em LIMIT ?",
+                (base_id, *ESTADOS_PENDENTES, agora, limite),
+            ).fetchall()
+        operacoes = [_operacao(linha) for linha in linhas]
+        if not operacoes:
+            return {}
+
+        def marcar_aplicando(planos: Dict[str, tuple]) -> None:
+            with _LOCK, _ligar() as conn:
+                for quantidade_final, chaves in planos.values():
+                    conn.executemany(
+                        "UPDATE operacoes SET estado = 'aplicando', quantidade_final = ? WHERE chave = ?",
+                        [(quantidade_final, chave) for chave in chaves],
+                    )
+
+        def marcar_inventario_escrito(chaves: List[str]) -> None:
+            with _LOCK, _ligar() as conn:
+                conn.executemany(
+                    "UPDATE operacoes SET estado = 'inventario_escrito' WHERE chave = ?", [(chave,) for chave in chaves]
+                )
+
+        try:
+            resultados = sincronizar_operacoes(
+                api,
+                base_id,
+                [
+                    {
+                        "chave": op.chave,
+                        "tipo": op.tipo,
+                        "item_id": op.item_id,
+                        "quantidade": op.quantidade,
+                        "delta": op.delta,
+                        "executado_por": op.executado_por,
+                        "evento_id": op.evento_id,
+                        "notas": op.notas,
+                        "quantidade_final": op.quantidade_final,
+                        "inventario_escrito": op.estado == "inventario_escrito",
+                    }
+                    for op in operacoes
+                ],
+                antes_de_escrever=marcar_aplicando,
+                inventario_escrito=marcar_inventario_escrito,
+                tabelas=tabelas,
+            )
+        except Exception as exc:
+            # Sem rede/Airtable indisponível: tudo fica para a próxima tentativa.
+            resultados = {op.chave: {"estado": "pendente", "mensagem": str(exc), "movimento_id": None} for op in operacoes}
+
+        contagem: Dict[str, int] = {}
+        agora = time.time()
+        with _LOCK, _ligar() as conn:
+            for op in operacoes:
+                res = resultados.get(op.chave, {"estado": "pendente", "mensagem": "Sem resposta.", "movimento_id": None})
+                contagem[res["estado"]] = contagem.get(res["estado"], 0) + 1
+                if res["estado"] == "sincronizado":
+                    conn.execute(
+                        "UPDATE operacoes SET estado = 'sincronizado', movimento_id = ?, sincronizado_em = ?, "
+                        "ultimo_erro = NULL WHERE chave = ?",
+                        (res["movimento_id"], agora, op.chave),
+                    )
+                elif res["estado"] == "erro":
+                    conn.execute(
+                        "UPDATE operacoes SET estado = 'erro', ultimo_erro = ? WHERE chave = ?",
+                        (res["mensagem"], op.chave),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE operacoes SET tentativas = tentativas + 1, proxima_tentativa = ?, ultimo_erro = ? "
+                        "WHERE chave = ?",
+                        (agora + _espera(op.tentativas + 1), res["mensagem"], op.chave),
+                    )
+        return contagem
+
+
+class _Worker:
+    """Thread daemon que drena a fila de uma base a cada intervalo (ou quando acordada).
+
+    Os nomes das tabelas vêm de quem arranca o worker: a thread não tem sessão Streamlit.
+    """
+
+    def __init__(self, api: Api, base_id: str, tabelas: Tuple[str, str]) -> None:
+        self.api = api
+        self.base_id = base_id
+        self.tabelas = tabelas
+        self._acordar = threading.Event()
+        self._thread = threading.Thread(target=self._ciclo, name=f"tombola-fila-{base_id}", daemon=True)
+        self._thread.start()
+
+    def acordar(self) -> None:
+        self._acordar.set()
+
+    def _ciclo(self) -> None:
+        while True:
+            self._acordar.wait(INTERVALO_WORKER_SEGUNDOS)
+            self._acordar.clear()
+            try:
+                sincronizar(self.api, self.base_id, tabelas=self.tabelas)
+            except Exception:
+                pass  # o diário mantém as operações; o próximo ciclo volta a tentar
+
+
+def iniciar_worker(api: Api, base_id: str) -> None:
+    """Arranca (uma vez por processo e base) o worker que sincroniza a fila.
+
+    Chamar a partir da página: as tabelas do contexto da sessão ficam no worker.
+    """
+    if not ativa():
+        return
+    tabelas = tabelas_stock()
+    with _LOCK:
+        if base_id not in _WORKERS:
+            _WORKERS[base_id] = _Worker(api, base_id, tabelas)
@@ -0,0 +1,256 @@
+"""Reconciliação do stock da Tômbola: Inventário vs. livro de Movimentos.
+
+O stock real vive em ``Inventario.QuantidadeAtual``; ``Movimentos`` é a auditoria.
+Aqui os movimentos são somados por item (Entrada +, Saída −, Ajuste com o sinal de
+``Delta``, Transferência 0) e comparados com o inventário; a caixa esperada é o
+destino da última Transferência. O resultado é um relatório por item e, se pedido,
+a correção do inventário em lote.
+
+Ajustes antigos, gravados antes de existir ``Delta``, não dizem se reduziram ou
+aumentaram o stock: contam como positivos (o sentido por omissão) e o item só é
+dado como ``indeterminado`` se houver diferença (o mesmo quando os movimentos dão
+stock negativo); esses itens nunca são corrigidos automaticamente, tal como os itens
+sem movimentos nenhuns.
+
+Uso na linha de comandos::
+
+    python tombola_reconciliacao.py --contexto airtable_<agrupamento>_<secao> [--corrigir] [--csv relatorio.csv]
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from pyairtable import Api
+
+from airtable_cache import marcar_desatualizado
+from airtable_config import get_tombola_table_ref
+
+
+CAMPOS_MOVIMENTOS = ("Item", "Tipo", "Quantidade", "Delta", "CaixaDestino")
+SINAL_POR_TIPO = {"Entrada": 1, "Saída": -1, "Transferência": 0}
+
+ESTADO_OK = "ok"
+ESTADO_DIVERGENTE = "divergente"
+ESTADO_INDETERMINADO = "indeterminado"
+ESTADO_SEM_MOVIMENTOS = "sem movimentos"
+ESTADO_SEM_ITEM = "sem item"
+
+COLUNAS_RELATORIO = [
+    "item_id",
+    "NomeItem",
+    "QuantidadeAtual",
+    "stock_movimentos",
+    "diferenca",
+    "CaixaAtual",
+    "caixa_movimentos",
+    "caixa_divergente",
+    "movimentos",
+    "ajustes_sem_sentido",
+    "estado",
+]
+
+
+def _primeiro_link(serie: pd.Series) -> pd.Series:
+    """Primeiro id de uma coluna de links (listas); vazio → NaN."""
+    return serie.map(lambda v: v[0] if isinstance(v, list) and v else (v if isinstance(v, str) and v else np.nan))
+
+
+def carregar_movimentos(api: Api, base_id: str, *, tabela: Optional[str] = None) -> pd.DataFrame:
+    """Lê todos os Movimentos página a página, só com os campos da reconciliação.
+
+    Inclui ``createdTime`` (coluna ``_criado_em``) para ordenar as transferências. Numa
+    base sem ``Delta`` lê sem ele: os movimentos contam só por ``Tipo``/``Quantidade``.
+    """
+    nome = tabela or get_tombola_table_ref("MOVIMENTOS", "Movimentos")
+    try:
+        return _ler_movimentos(api, base_id, nome, CAMPOS_MOVIMENTOS)
+    except Exception as exc:
+        if "UNKNOWN_FIELD_NAME" not in str(exc).upper():
+            raise
+        return _ler_movimentos(api, base_id, nome, tuple(campo for campo in CAMPOS_MOVIMENTOS if campo != "Delta"))
+
+
+def _ler_movimentos(api: Api, base_id: str, nome: str, campos_pedidos: tuple) -> pd.DataFrame:
+    colunas: Dict[str, List[Any]] = {"id": [], "_criado_em": [], **{campo: [] for campo in campos_pedidos}}
+    for pagina in api.table(base_id, nome).iterate(page_size=100, fields=list(campos_pedidos)):
+        for registo in pagina:
+            campos = registo.get("fields", {})
+            colunas["id"].append(registo["id"])
+            colunas["_criado_em"].append(registo.get("createdTime"))
+            for campo in campos_pedidos:
+                colunas[campo].append(campos.get(campo))
+    return pd.DataFrame(colunas)
+
+
+def dobrar_movimentos(df_mov: pd.DataFrame) -> pd.DataFrame:
+    """Soma os movimentos por item (índice ``item_id``).
+
+    Colunas: ``stock_movimentos``, ``movimentos``, ``ajustes_sem_sentido`` e
+    ``caixa_movimentos`` (destino da última Transferência; ordem de ``_criado_em`` se
+    existir, senão a ordem das linhas).
+    """
+    vazio = pd.DataFrame(columns=["stock_movimentos", "movimentos", "ajustes_sem_sentido", "caixa_movimentos"])
+    vazio.index.name = "item_id"
+    if df_mov.empty or "Item" not in df_mov.columns:
+        return vazio
+
+    def coluna(nome: str) -> pd.Series:
+        return df_mov[nome] if nome in df_mov.columns else pd.Series(np.nan, index=df_mov.index)
+
+    item_id = _primeiro_link(df_mov["Item"])
+    tipo = coluna("Tipo").astype("string").str.strip()
+    quantidade = pd.to_numeric(coluna("Quantidade"), errors="coerce").fillna(0)
+    delta = pd.to_numeric(coluna("Delta"), errors="coerce")
+
+    sem_sentido = delta.isna() & tipo.eq("Ajuste").fillna(False)
+    por_tipo = tipo.map(SINAL_POR_TIPO).astype(float) * quantidade
+    variacao = delta.fillna(por_tipo).fillna(quantidade.where(sem_sentido, 0))
+
+    dados = pd.DataFrame({"item_id": item_id, "variacao": variacao, "sem_sentido": sem_sentido}).dropna(subset=["item_id"])
+    if dados.empty:
+        return vazio
+    dobra = dados.groupby("item_id").agg(
+        stock_movimentos=("variacao", "sum"),
+        movimentos=("variacao", "size"),
+        ajustes_sem_sentido=("sem_sentido", "sum"),
+    )
+
+    transferencias = pd.DataFrame(
+        {
+            "item_id": item_id,
+            "caixa": _primeiro_link(coluna("CaixaDestino")),
+            "ordem": pd.to_datetime(coluna("_criado_em"), errors="coerce", utc=True),
+            "posicao": np.arange(len(df_mov.index)),
+        }
+    )[tipo.eq("Transferência").fillna(False).to_numpy()].dropna(subset=["item_id", "caixa"])
+    ultima = transferencias.sort_values(["ordem", "posicao"], na_position="first").drop_duplicates("item_id", keep="last")
+    dobra["caixa_movimentos"] = ultima.set_index("item_id")["caixa"]
+    return dobra
+
+
+def reconciliar(df_inv: pd.DataFrame, df_mov: pd.DataFrame) -> pd.DataFrame:
+    """Relatório por item (colunas ``COLUNAS_RELATORIO``), divergências primeiro."""
+    dobra = dobrar_movimentos(df_mov)
+    if df_inv.empty or "id" not in df_inv.columns:
+        inventario = pd.DataFrame(columns=["item_id", "NomeItem", "QuantidadeAtual", "CaixaAtual"])
+    else:
+        inventario = pd.DataFrame(
+            {
+                "item_id": df_inv["id"],
+                "NomeItem": df_inv["NomeItem"] if "NomeItem" in df_inv.columns else "",
+                "QuantidadeAtual": pd.to_numeric(df_inv.get("QuantidadeAtual"), errors="coerce").fillna(0)
+                if "QuantidadeAtual" in df_inv.columns
+                else 0.0,
+                "CaixaAtual": _primeiro_link(df_inv["CaixaAtual"]) if "CaixaAtual" in df_inv.columns else np.nan,
+            }
+        )
+    inventario["_existe"] = True
+
+    rel = inventario.merge(dobra, how="outer", left_on="item_id", right_index=True)
+    existe = rel["_existe"].eq(True)
+    rel["movimentos"] = rel["movimentos"].fillna(0).astype(int)
+    rel["ajustes_sem_sentido"] = rel["ajustes_sem_sentido"].fillna(0).astype(int)
+    rel["stock_movimentos"] = rel["stock_movimentos"].fillna(0)
+    rel["diferenca"] = rel["QuantidadeAtual"] - rel["stock_movimentos"]
+    rel["caixa_divergente"] = rel["caixa_movimentos"].notna() & rel["caixa_movimentos"].ne(rel["CaixaAtual"])
+
+    ha_diferenca = rel["diferenca"].fillna(0).ne(0)
+    rel["estado"] = np.select(
+        [
+            ~existe,
+            rel["movimentos"].eq(0) & ha_diferenca,
+            ha_diferenca & (rel["ajustes_sem_sentido"].gt(0) | rel["stock_movimentos"].lt(0)),
+            ha_diferenca | rel["caixa_divergente"],
+        ],
+        [ESTADO_SEM_ITEM, ESTADO_SEM_MOVIMENTOS, ESTADO_INDETERMINADO, ESTADO_DIVERGENTE],
+        default=ESTADO_OK,
+    )
+    rel["_ordem"] = rel["estado"].eq(ESTADO_OK)
+    rel = rel.sort_values(["_ordem", "estado", "NomeItem"], na_position="last")
+    return rel[COLUNAS_RELATORIO].reset_index(drop=True)
+
+
+def corrigir_divergencias(
+    api: Api,
+    base_id: str,
+    relatorio: pd.DataFrame,
+    *,
+    tabela: Optional[str] = None,
+) -> int:
+    """Repõe no Inventário o stock/caixa dos movimentos para os itens ``divergente``.
+
+    Escreve em lotes (``batch_update``) e devolve o número de itens corrigidos. Deve
+    correr sobre um relatório acabado de gerar: operações feitas entretanto seriam
+    sobrescritas.
+    """
+    divergentes = relatorio[relatorio["estado"] == ESTADO_DIVERGENTE]
+    if divergentes.empty:
+        return 0
+    atualizacoes = []
+    for linha in divergentes.to_dict("records"):
+        campos: Dict[str, Any] = {}
+        if linha["diferenca"] != 0:
+            campos["QuantidadeAtual"] = float(linha["stock_movimentos"])
+        if linha["caixa_divergente"]:
+            campos["CaixaAtual"] = [linha["caixa_movimentos"]]
+        atualizacoes.append({"id": linha["item_id"], "fields": campos})
+
+    nome = tabela or get_tombola_table_ref("INVENTARIO", "Inventario")
+    try:
+        api.table(base_id, nome).batch_update(atualizacoes)
+    finally:
+        marcar_desatualizado(base_id, [nome])
+    return len(atualizacoes)
+
+
+def _resumo(relatorio: pd.DataFrame) -> str:
+    contagem = relatorio["estado"].value_counts()
+    return ", ".join(f"{estado}: {int(total)}" for estado, total in contagem.items()) or "sem itens"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from airtable_client import criar_api
+    from airtable_config import get_available_contexts, get_context_by_key
+
+    parser = argparse.ArgumentParser(description="Reconcilia o Inventário da Tômbola com os Movimentos.")
+    parser.add_argument("--contexto", help="Chave dos secrets (ex.: airtable_<agrupamento>_<secao>).")
+    parser.add_argument("--corrigir", action="store_true", help="Corrige no Inventário os itens divergentes.")
+    parser.add_argument("--csv", help="Grava o relatório completo neste ficheiro CSV.")
+    args = parser.parse_args(argv)
+
+    contexto = get_context_by_key(args.contexto) if args.contexto else None
+    if contexto is None:
+        disponiveis = ", ".join(ctx.key for ctx in get_available_contexts()) or "nenhum"
+        parser.error(f"Contexto inválido ou em falta. Disponíveis: {disponiveis}")
+
+    tabela_inv = contexto.extra("TOMBOLA_TABLE_INVENTARIO") or "Inventario"
+    tabela_mov = contexto.extra("TOMBOLA_TABLE_MOVIMENTOS") or "Movimentos"
+    api = criar_api(contexto.token)
+    df_inv = pd.DataFrame(
+        [
+            {"id": r["id"], **r.get("fields", {})}
+            for r in api.table(contexto.base_id, tabela_inv).all(fields=["NomeItem", "QuantidadeAtual", "CaixaAtual"])
+        ]
+    )
+    relatorio = reconciliar(df_inv, carregar_movimentos(api, contexto.base_id, tabela=tabela_mov))
+
+    print(f"Itens analisados: {len(relatorio.index)} ({_resumo(relatorio)})")
+    problemas = relatorio[relatorio["estado"] != ESTADO_OK]
+    if not problemas.empty:
+        print(problemas.to_string(index=False))
+    if args.csv:
+        relatorio.to_csv(args.csv, index=False)
+        print(f"Relatório gravado em {args.csv}")
+    if args.corrigir:
+        corrigidos = corrigir_divergencias(api, contexto.base_id, relatorio, tabela=tabela_inv)
+        print(f"Itens corrigidos: {corrigidos}")
+    return 1 if (relatorio["estado"] != ESTADO_OK).any() and not args.corrigir else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
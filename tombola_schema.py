@@ -1,28 +1,85 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
+import threading
+import time
+from dataclasses import dataclass, field as dataclass_field
+from typing import Any, Dict, List, Optional, Set
 
 from pyairtable import Api
 
 
-def _table_exists(base, table_ref: str) -> bool:
-    refs = {tbl.id: tbl for tbl in base.tables()}
-    names = {tbl.name: tbl for tbl in base.tables()}
-    return table_ref in refs or table_ref in names
+# O schema muda raramente; um snapshot por base serve todas as sessões durante este tempo.
+SCHEMA_TTL_SEGUNDOS = 600
 
 
-def _get_table(base, table_ref: str):
-    if table_ref.startswith("tbl"):
-        return base.table(table_ref)
-    return base.table(table_ref)
+@dataclass
+class TabelaSchema:
+    id: str
+    name: str
+    fields: Set[str] = dataclass_field(default_factory=set)
 
 
-def _field_exists(table, field_name: str) -> bool:
-    try:
-        schema = table.schema()
-    except Exception:
-        return False
-    return any(field.name == field_name for field in schema.fields)
+@dataclass
+class SchemaSnapshot:
+    """Tabelas e nomes de campos de uma base, obtidos num único pedido à Meta API."""
+
+    tabelas: List[TabelaSchema]
+    obtido_em: float
+
+    def tabela(self, table_ref: str) -> Optional[TabelaSchema]:
+        for tabela in self.tabelas:
+            if table_ref in (tabela.id, tabela.name):
+                return tabela
+        return None
+
+    def expirado(self, ttl: float) -> bool:
+        return time.monotonic() - self.obtido_em > ttl
+
+
+# Protege `_SCHEMAS` e as alterações aos snapshots partilhados. As alterações trocam o
+# set/lista por um novo (copy-on-write), por isso quem está a ler nunca vê meia escrita.
+_LOCK = threading.Lock()
+_SCHEMAS: Dict[str, SchemaSnapshot] = {}
+
+
+def obter_schema(api: Api, base_id: str, *, ttl: float = SCHEMA_TTL_SEGUNDOS, forcar: bool = False) -> SchemaSnapshot:
+    """Snapshot do schema da base, partilhado por processo e renovado após `ttl` segundos."""
+    with _LOCK:
+        snapshot = _SCHEMAS.get(base_id)
+        if snapshot is not None and not forcar and not snapshot.expirado(ttl):
+            return snapshot
+        schema = api.base(base_id).schema(force=True)
+        snapshot = SchemaSnapshot(
+            tabelas=[
+                TabelaSchema(id=tabela.id, name=tabela.name, fields={campo.name for campo in tabela.fields})
+                for tabela in schema.tables
+            ],
+            obtido_em=time.monotonic(),
+        )
+        _SCHEMAS[base_id] = snapshot
+        return snapshot
+
+
+def invalidar_schema(base_id: Optional[str] = None) -> None:
+    with _LOCK:
+        if base_id is None:
+            _SCHEMAS.clear()
+        else:
+            _SCHEMAS.pop(base_id, None)
+
+
+def tabelas_em_falta(api: Api, base_id: str, table_refs: Dict[str, str]) -> List[str]:
+    schema = obter_schema(api, base_id)
+    return [ref for ref in table_refs.values() if schema.tabela(ref) is None]
+
+
+def _table_exists(schema: SchemaSnapshot, table_ref: str) -> bool:
+    return schema.tabela(table_ref) is not None
+
+
+def _field_exists(schema: SchemaSnapshot, table_ref: str, field_name: str) -> bool:
+    tabela = schema.tabela(table_ref)
+    return tabela is not None and field_name in tabela.fields
 
 
 def _normalize_field_options(field_type: str, options: Dict[str, Any] | None) -> Dict[str, Any] | None:
@@ -54,13 +111,38 @@ def _create_field_with_explicit_payload(table, name: str, field_type: str, optio
     table.api.post(table.urls.fields, json=request)
 
 
-def _ensure_field(table, name: str, field_type: str, options: Dict[str, Any] | None = None) -> bool:
-    if _field_exists(table, name):
+def _ensure_field(
+    base,
+    schema: SchemaSnapshot,
+    table_ref: str,
+    name: str,
+    field_type: str,
+    options: Dict[str, Any] | None = None,
+) -> bool:
+    if _field_exists(schema, table_ref, name):
         return False
-    _create_field_with_explicit_payload(table, name, field_type, options=_normalize_field_options(field_type, options))
+    tabela = schema.tabela(table_ref)
+    # Tabela pelo id: evita que o pyairtable vá buscar o schema para resolver o nome.
+    _create_field_with_explicit_payload(
+        base.table(tabela.id), name, field_type, options=_normalize_field_options(field_type, options)
+    )
+    with _LOCK:
+        tabela.fields = tabela.fields | {name}
     return True
 
 
+def _create_table(base, schema: SchemaSnapshot, name: str, primary_field: Dict[str, Any]) -> None:
+    """Cria a tabela e regista-a no snapshot (sem o refetch de schema de `Base.create_table`)."""
+    response = base.api.post(base.urls.tables, json={"name": name, "fields": [primary_field]})
+    nova = TabelaSchema(
+        id=response["id"],
+        name=response.get("name", name),
+        fields={campo["name"] for campo in response.get("fields", [])} or {primary_field["name"]},
+    )
+    with _LOCK:
+        schema.tabelas = [*schema.tabelas, nova]
+
+
 def _primary_field_for_create(fields: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Escolhe um campo primário compatível para criação da tabela.
 
@@ -76,22 +158,40 @@ def _primary_field_for_create(fields: List[Dict[str, Any]]) -> Dict[str, Any]:
 
 
 
-def _ensure_base_fields(table, fields: List[Dict[str, Any]], table_ref: str, created_fields: List[str], errors: List[str]) -> None:
+def _ensure_base_fields(
+    base,
+    schema: SchemaSnapshot,
+    fields: List[Dict[str, Any]],
+    table_ref: str,
+    created_fields: List[str],
+    errors: List[str],
+) -> None:
     for field in fields:
         try:
-            created = _ensure_field(table, field["name"], field["type"], field.get("options"))
+            created = _ensure_field(base, schema, table_ref, field["name"], field["type"], field.get("options"))
             if created:
                 created_fields.append(f"{table_ref}.{field['name']}")
         except Exception as exc:
             errors.append(f"{table_ref}.{field['name']}: falha ao criar campo: {exc}")
 
 
-def ensure_tombola_schema(api: Api, base_id: str, table_refs: Dict[str, str]) -> Dict[str, List[str]]:
+def ensure_tombola_schema(
+    api: Api,
+    base_id: str,
+    table_refs: Dict[str, str],
+    *,
+    forcar: bool = False,
+) -> Dict[str, List[str]]:
     """Cria o schema mínimo da Tômbola numa base nova mantendo compatibilidade.
 
+    Compara o schema pretendido com o snapshot em cache (`obter_schema`) e só chama a
+    Meta API para criar o que falta; com o schema completo não há pedidos extra.
+    `forcar=True` renova o snapshot antes de comparar.
+
     Retorna resumo de ações: tabelas/fields criados e eventuais erros.
     """
     base = api.base(base_id)
+    schema = obter_schema(api, base_id, forcar=forcar)
     created_tables: List[str] = []
     created_fields: List[str] = []
     errors: List[str] = []
@@ -166,6 +266,10 @@ def ensure_tombola_schema(api: Api, base_id: str, table_refs: Dict[str, str]) ->
             {"name": "Quantidade", "type": "number", "options": {"precision": 0}},
             {"name": "OrigemEntrada", "type": "singleLineText"},
             {"name": "Notas", "type": "multilineText"},
+            # Chave da fila offline (tombola_fila): evita movimentos duplicados em reenvios.
+            {"name": "ChaveIdempotencia", "type": "singleLineText"},
+            # Variação assinada do stock; permite reconstruir o stock a partir dos movimentos.
+            {"name": "Delta", "type": "number", "options": {"precision": 0}},
         ],
     }
 
@@ -173,24 +277,23 @@ def ensure_tombola_schema(api: Api, base_id: str, table_refs: Dict[str, str]) ->
     for key, fields in table_defs.items():
         table_ref = table_refs[key]
 
-        if table_ref.startswith("tbl") and not _table_exists(base, table_ref):
+        if table_ref.startswith("tbl") and not _table_exists(schema, table_ref):
             errors.append(f"{key}: referência por ID ({table_ref}) não existe na base.")
             continue
 
-        if not _table_exists(base, table_ref):
+        if not _table_exists(schema, table_ref):
             if table_ref.startswith("tbl"):
                 errors.append(f"{key}: não é possível criar tabela quando referência é ID ({table_ref}).")
                 continue
             try:
-                base.create_table(table_ref, [_primary_field_for_create(fields)])
+                _create_table(base, schema, table_ref, _primary_field_for_create(fields))
                 created_tables.append(table_ref)
             except Exception as exc:
                 errors.append(f"{key}: falha ao criar tabela '{table_ref}': {exc}")
                 continue
 
         try:
-            table = _get_table(base, table_ref)
-            _ensure_base_fields(table, fields, table_ref, created_fields, errors)
+            _ensure_base_fields(base, schema, fields, table_ref, created_fields, errors)
         except Exception as exc:
             errors.append(f"{key}: falha ao validar campos base da tabela '{table_ref}': {exc}")
 
@@ -210,19 +313,19 @@ def ensure_tombola_schema(api: Api, base_id: str, table_refs: Dict[str, str]) ->
     # ids para links
     table_id_by_key: Dict[str, str] = {}
     for key, table_ref in table_refs.items():
-        try:
-            table_id_by_key[key] = _get_table(base, table_ref).id
-        except Exception:
-            pass
+        tabela = schema.tabela(table_ref)
+        if tabela is not None:
+            table_id_by_key[key] = tabela.id
 
     for src_key, field_name, dst_key in link_defs:
         if src_key not in table_id_by_key or dst_key not in table_id_by_key:
             errors.append(f"{src_key}.{field_name}: tabela origem/destino indisponível.")
             continue
         try:
-            table = _get_table(base, table_refs[src_key])
             created = _ensure_field(
-                table,
+                base,
+                schema,
+                table_refs[src_key],
                 field_name,
                 "multipleRecordLinks",
                 options={"linkedTableId": table_id_by_key[dst_key]},
@@ -232,4 +335,8 @@ def ensure_tombola_schema(api: Api, base_id: str, table_refs: Dict[str, str]) ->
         except Exception as exc:
             errors.append(f"{src_key}.{field_name}: falha ao criar campo: {exc}")
 
+    if errors:
+        # O estado real pode divergir do snapshot (falhas parciais); a próxima leitura refaz-o.
+        invalidar_schema(base_id)
+
     return {"created_tables": created_tables, "created_fields": created_fields, "errors": errors}
@@ -1,20 +1,120 @@
 from __future__ import annotations
 
+import threading
+import time
 import unicodedata
-from typing import Any, Dict, Iterable, List, Optional
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field as dataclass_field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from pyairtable import Api
 
+from airtable_cache import marcar_desatualizado
+from airtable_client import em_blocos
 from airtable_config import get_tombola_table_ref
+from data_utils import formula_campo_igual, formula_por_ids
 
 
 TIPOS_MOVIMENTO = {"Entrada", "Saída", "Ajuste", "Transferência"}
+# Campos de Movimentos criados depois pelo auto-schema (precisa de token com escrita de
+# schema). Numa base sem eles os movimentos são gravados sem esses campos.
+CAMPOS_MOVIMENTO_OPCIONAIS = ("Delta", "ChaveIdempotencia")
+# Idade máxima (s) de um snapshot de item fornecido pelo chamador para dispensar a leitura.
+IDADE_MAXIMA_SNAPSHOT_ITEM = 30.0
+# Itens diferentes escritos em simultâneo pelo agendador de stock.
+MAX_ITENS_PARALELOS = 4
+
+
+NOMES_TABELAS_PADRAO = {
+    "INVENTARIO": "Inventario",
+    "CAIXAS": "Caixas",
+    "PATROCINADORES": "Patrocinadores",
+    "REGISTO_PATROCINIOS": "RegistoPatrocinios",
+    "EVENTOS": "Eventos",
+    "MOVIMENTOS": "Movimentos",
+}
+
+
+_CAMPOS_EM_FALTA: Dict[Tuple[str, str], set] = {}
+_LOCK_CAMPOS = threading.Lock()
 
 
 def _tombola_table(table_key: str, default_name: str) -> str:
     return get_tombola_table_ref(table_key, default_name)
 
 
+def campos_movimento_em_falta(base_id: str, nome_movimentos: str) -> Tuple[str, ...]:
+    """Campos de ``CAMPOS_MOVIMENTO_OPCIONAIS`` que a base rejeitou (schema degradado)."""
+    with _LOCK_CAMPOS:
+        em_falta = _CAMPOS_EM_FALTA.get((base_id, nome_movimentos), set())
+        return tuple(campo for campo in CAMPOS_MOVIMENTO_OPCIONAIS if campo in em_falta)
+
+
+def _campo_opcional_rejeitado(exc: Exception) -> Optional[str]:
+    """Campo opcional de Movimentos que não existe na base, segundo o erro do Airtable."""
+    mensagem = str(exc)
+    if "UNKNOWN_FIELD_NAME" not in mensagem.upper() and "INVALID_FILTER_BY_FORMULA" not in mensagem.upper():
+        return None
+    return next((campo for campo in CAMPOS_MOVIMENTO_OPCIONAIS if campo.lower() in mensagem.lower()), None)
+
+
+def _marcar_em_falta(base_id: str, nome_movimentos: str, campo: str) -> None:
+    with _LOCK_CAMPOS:
+        _CAMPOS_EM_FALTA.setdefault((base_id, nome_movimentos), set()).add(campo)
+
+
+def _criar_movimentos(api: Api, base_id: str, nome_movimentos: str, payloads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """``batch_create`` de Movimentos; sem ``Delta``/``ChaveIdempotencia`` na base, repete sem eles."""
+    tabela_mov = api.table(base_id, nome_movimentos)
+    while True:
+        em_falta = campos_movimento_em_falta(base_id, nome_movimentos)
+        try:
+            return tabela_mov.batch_create(
+                [{campo: valor for campo, valor in payload.items() if campo not in em_falta} for payload in payloads]
+            )
+        except Exception as exc:
+            campo = _campo_opcional_rejeitado(exc)
+            if campo is None or campo in em_falta:
+                raise
+            _marcar_em_falta(base_id, nome_movimentos, campo)
+
+
+def tabelas_stock() -> Tuple[str, str]:
+    """Nomes (Inventário, Movimentos) do contexto da sessão atual.
+
+    Threads sem sessão Streamlit veriam os nomes por omissão: resolve-se aqui, na thread
+    do chamador, e passa-se o par a quem escreve em background.
+    """
+    return (
+        _tombola_table("INVENTARIO", NOMES_TABELAS_PADRAO["INVENTARIO"]),
+        _tombola_table("MOVIMENTOS", NOMES_TABELAS_PADRAO["MOVIMENTOS"]),
+    )
+
+
+def invalidar_tabelas(base_id: str, *table_keys: str) -> None:
+    """Marca as tabelas escritas como desatualizadas na cache partilhada (leitura seguinte = delta)."""
+    marcar_desatualizado(base_id, [_tombola_table(chave, NOMES_TABELAS_PADRAO[chave]) for chave in table_keys])
+
+
+def criar_registo(api: Api, base_id: str, table_key: str, campos: Dict[str, Any]) -> Dict[str, Any]:
+    """Cria um registo numa tabela da Tômbola e invalida essa tabela na cache."""
+    try:
+        return api.table(base_id, _tombola_table(table_key, NOMES_TABELAS_PADRAO[table_key])).create(campos)
+    finally:
+        invalidar_tabelas(base_id, table_key)
+
+
+def atualizar_registo(
+    api: Api, base_id: str, table_key: str, record_id: str, campos: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Atualiza um registo numa tabela da Tômbola e invalida essa tabela na cache."""
+    try:
+        return api.table(base_id, _tombola_table(table_key, NOMES_TABELAS_PADRAO[table_key])).update(record_id, campos)
+    finally:
+        invalidar_tabelas(base_id, table_key)
+
+
 def _validar_notas_acao_critica(tipo: str, notas: str) -> None:
     """Stock real vive no Inventário; Movimentos é auditoria e ações críticas exigem notas."""
     if tipo in {"Saída", "Ajuste", "Transferência"} and not (notas or "").strip():
@@ -44,6 +144,35 @@ def _to_float(valor: Any) -> float:
         return 0.0
 
 
+def snapshot_item(registo: Dict[str, Any], *, obtido_em: Optional[float] = None) -> Dict[str, Any]:
+    """Registo de Inventário (`{"id", "fields"}`) com o instante (epoch) em que foi lido."""
+    return {
+        "id": registo["id"],
+        "fields": dict(registo.get("fields", {})),
+        "obtido_em": time.time() if obtido_em is None else float(obtido_em),
+    }
+
+
+def _carregar_item(tabela_inv, item_id: str, item: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Usa o snapshot recebido se for deste item e recente; caso contrário lê o registo (uma vez)."""
+    if (
+        item is not None
+        and item.get("id") == item_id
+        and time.time() - float(item.get("obtido_em") or 0) <= IDADE_MAXIMA_SNAPSHOT_ITEM
+    ):
+        return item
+    return snapshot_item(tabela_inv.get(item_id))
+
+
+def _ler_itens(tabela_inv, item_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Lê ``QuantidadeAtual``/``CaixaAtual`` dos itens indicados (blocos de 10 ids por fórmula)."""
+    itens: Dict[str, Dict[str, Any]] = {}
+    for bloco in em_blocos(list(dict.fromkeys(item_ids))):
+        for registo in tabela_inv.all(formula=formula_por_ids(bloco), fields=["QuantidadeAtual", "CaixaAtual"]):
+            itens[registo["id"]] = registo.get("fields", {})
+    return itens
+
+
 def _first_link_id(valor: Any) -> Optional[str]:
     if isinstance(valor, list) and valor:
         return str(valor[0])
@@ -52,9 +181,7 @@ def _first_link_id(valor: Any) -> Optional[str]:
     return None
 
 
-def criar_movimento(
-    api: Api,
-    base_id: str,
+def _campos_movimento(
     *,
     tipo: str,
     item_id: str,
@@ -66,8 +193,14 @@ def criar_movimento(
     origem_entrada: Optional[str] = None,
     patrocinador_id: Optional[str] = None,
     notas: str = "",
+    chave_idempotencia: Optional[str] = None,
+    delta: Optional[float] = None,
 ) -> Dict[str, Any]:
-    """Stock real vive no Inventário; Movimentos é auditoria de operações."""
+    """Valida e monta o payload de um registo de Movimentos.
+
+    `delta` é a variação assinada do stock (``Delta``); é o que distingue um Ajuste que
+    reduz de um que aumenta na reconciliação (``tombola_reconciliacao``).
+    """
     if tipo not in TIPOS_MOVIMENTO:
         raise ValueError(f"Tipo de movimento inválido: {tipo}")
 
@@ -95,40 +228,259 @@ def criar_movimento(
         campos["Patrocinador"] = [patrocinador_id]
     if notas and notas.strip():
         campos["Notas"] = notas.strip()
+    if chave_idempotencia:
+        campos["ChaveIdempotencia"] = chave_idempotencia
+    if delta is not None:
+        campos["Delta"] = delta
+    return campos
 
-    return api.table(base_id, _tombola_table("MOVIMENTOS", "Movimentos")).create(campos)
 
+def criar_movimento(
+    api: Api,
+    base_id: str,
+    *,
+    tipo: str,
+    item_id: str,
+    quantidade: int,
+    executado_por: str,
+    caixa_origem_id: Optional[str] = None,
+    caixa_destino_id: Optional[str] = None,
+    evento_id: Optional[str] = None,
+    origem_entrada: Optional[str] = None,
+    patrocinador_id: Optional[str] = None,
+    notas: str = "",
+    delta: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Stock real vive no Inventário; Movimentos é auditoria de operações."""
+    campos = _campos_movimento(
+        tipo=tipo,
+        item_id=item_id,
+        quantidade=quantidade,
+        executado_por=executado_por,
+        caixa_origem_id=caixa_origem_id,
+        caixa_destino_id=caixa_destino_id,
+        evento_id=evento_id,
+        origem_entrada=origem_entrada,
+        patrocinador_id=patrocinador_id,
+        notas=notas,
+        delta=delta,
+    )
+    nome_mov = _tombola_table("MOVIMENTOS", NOMES_TABELAS_PADRAO["MOVIMENTOS"])
+    try:
+        return _criar_movimentos(api, base_id, nome_mov, [campos])[0]
+    finally:
+        marcar_desatualizado(base_id, [nome_mov])
+
+
+@dataclass
+class _OperacaoStock:
+    api: Api
+    tabelas: Tuple[str, str]  # (Inventário, Movimentos), resolvidas na sessão do chamador
+    delta: float
+    movimento: Dict[str, Any]
+    caixa_nova: Optional[str]
+    minimo: Optional[float]
+    item: Optional[Dict[str, Any]]
+    futuro: Future = dataclass_field(default_factory=Future)
+
+
+class AgendadorStock:
+    """Serializa as escritas de stock por item dentro do processo.
+
+    Operações sobre o mesmo item nunca se sobrepõem: as que chegam enquanto o item está
+    a ser escrito ficam em fila e são aplicadas juntas (uma leitura, uma escrita do
+    inventário, movimentos em blocos de 10). Itens diferentes correm em paralelo; o
+    ritmo global continua limitado pelo cliente (``airtable_client``). Como o reverso de
+    uma falha também passa pela fila do item, já não pisa escritas de outras sessões.
+
+    Escritas em lote fora da fila (importação, diário offline) usam ``reservar``: ficam
+    com o lock dos itens durante a leitura e a escrita, tal como cada drenagem.
+    """
 
-def _atualizar_inventario_e_movimento(
+    def __init__(self, max_paralelos: int = MAX_ITENS_PARALELOS) -> None:
+        self._lock = threading.Lock()
+        self._filas: Dict[Tuple[str, str], List[_OperacaoStock]] = {}
+        self._ativos: set = set()
+        self._ultima_escrita: Dict[Tuple[str, str], float] = {}
+        self._locks_item: Dict[Tuple[str, str], threading.Lock] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_paralelos, thread_name_prefix="tombola-stock")
+
+    def submeter(
+        self,
+        api: Api,
+        base_id: str,
+        item_id: str,
+        *,
+        delta: float,
+        movimento: Dict[str, Any],
+        caixa_nova: Optional[str] = None,
+        minimo: Optional[float] = None,
+        item: Optional[Dict[str, Any]] = None,
+    ) -> Future:
+        """Enfileira a operação; o futuro devolve o movimento criado ou a exceção."""
+        operacao = _OperacaoStock(api, tabelas_stock(), delta, movimento, caixa_nova, minimo, item)
+        chave = (base_id, item_id)
+        with self._lock:
+            self._filas.setdefault(chave, []).append(operacao)
+            if chave not in self._ativos:
+                self._ativos.add(chave)
+                self._executor.submit(self._drenar, chave)
+        return operacao.futuro
+
+    def _lock_item(self, chave: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._locks_item.setdefault(chave, threading.Lock())
+
+    @contextmanager
+    def reservar(self, base_id: str, item_ids: Iterable[str]) -> Iterator[None]:
+        """Bloqueia os itens (por ordem, sem deadlocks) enquanto o chamador lê e escreve o stock.
+
+        À saída os snapshots anteriores desses itens deixam de ser confiáveis: a drenagem
+        seguinte volta a ler o item do Airtable.
+        """
+        chaves = [(base_id, item_id) for item_id in sorted(set(item_ids))]
+        locks = [self._lock_item(chave) for chave in chaves]
+        obtidos = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                obtidos.append(lock)
+            yield
+        finally:
+            agora = time.time()
+            for chave in chaves:
+                self._ultima_escrita[chave] = agora
+            for lock in reversed(obtidos):
+                lock.release()
+
+    def _drenar(self, chave: Tuple[str, str]) -> None:
+        while True:
+            with self._lock:
+                operacoes = self._filas.pop(chave, [])
+                if not operacoes:
+                    self._ativos.discard(chave)
+                    return
+            try:
+                with self._lock_item(chave):
+                    self._aplicar(chave, operacoes)
+            except Exception as exc:
+                for operacao in operacoes:
+                    if not operacao.futuro.done():
+                        operacao.futuro.set_exception(exc)
+            finally:
+                marcar_desatualizado(chave[0], sorted({nome for op in operacoes for nome in op.tabelas}))
+
+    def _estado_item(self, tabela_inv, chave: Tuple[str, str], operacoes: List[_OperacaoStock]) -> Dict[str, Any]:
+        """Snapshot mais recente dos chamadores, se for fresco e posterior à última escrita; senão lê."""
+        snapshots = [op.item for op in operacoes if op.item is not None and op.item.get("id") == chave[1]]
+        if snapshots:
+            recente = max(snapshots, key=lambda item: float(item.get("obtido_em") or 0))
+            if float(recente.get("obtido_em") or 0) > self._ultima_escrita.get(chave, 0.0):
+                return _carregar_item(tabela_inv, chave[1], recente)["fields"]
+        return tabela_inv.get(chave[1]).get("fields", {})
+
+    def _aplicar(self, chave: Tuple[str, str], operacoes: List[_OperacaoStock]) -> None:
+        base_id, item_id = chave
+        api = operacoes[0].api
+        nome_inv, nome_mov = operacoes[0].tabelas
+        tabela_inv = api.table(base_id, nome_inv)
+        campos_item = self._estado_item(tabela_inv, chave, operacoes)
+        atual = _to_float(campos_item.get("QuantidadeAtual"))
+        caixa_atual = _first_link_id(campos_item.get("CaixaAtual"))
+
+        valor, caixa, aceites = atual, caixa_atual, []
+        for operacao in operacoes:
+            if operacao.minimo is not None and valor < operacao.minimo:
+                operacao.futuro.set_exception(
+                    ValueError("Operação inválida: quantidade transferida excede stock disponível.")
+                )
+                continue
+            if valor + operacao.delta < 0:
+                operacao.futuro.set_exception(ValueError("Operação inválida: stock não pode ficar negativo."))
+                continue
+            valor += operacao.delta
+            caixa = operacao.caixa_nova or caixa
+            aceites.append(operacao)
+        if not aceites:
+            return
+
+        def payload(quantidade: float, caixa_final: Optional[str]) -> Dict[str, Any]:
+            campos: Dict[str, Any] = {"QuantidadeAtual": quantidade}
+            if caixa_final != caixa_atual:
+                campos["CaixaAtual"] = [caixa_final] if caixa_final else []
+            return campos
+
+        def atualizar_snapshots(campos: Dict[str, Any], ops: List[_OperacaoStock]) -> None:
+            for operacao in ops:
+                if operacao.item is not None:
+                    operacao.item["fields"].update(campos)
+                    operacao.item["obtido_em"] = time.time()
+
+        escrito = payload(valor, caixa)
+        try:
+            tabela_inv.update(item_id, escrito)
+        finally:
+            # Só depois da resposta: um snapshot lido durante a escrita fica mais antigo
+            # do que a marca e volta a ser lido do Airtable (também se o pedido falhou).
+            self._ultima_escrita[chave] = time.time()
+        atualizar_snapshots(escrito, aceites)
+
+        falhas: List[Tuple[_OperacaoStock, Exception]] = []
+        for bloco in em_blocos(aceites):
+            try:
+                criados = _criar_movimentos(api, base_id, nome_mov, [operacao.movimento for operacao in bloco])
+            except Exception as exc:
+                falhas.extend((operacao, exc) for operacao in bloco)
+                continue
+            for operacao, criado in zip(bloco, criados):
+                operacao.futuro.set_result(criado)
+        if not falhas:
+            return
+
+        # Repõe só a parte das operações sem movimento; as restantes mantêm-se.
+        falhadas = {id(operacao) for operacao, _ in falhas}
+        mantidas = [operacao for operacao in aceites if id(operacao) not in falhadas]
+        caixa_reposta = caixa_atual
+        for operacao in mantidas:
+            caixa_reposta = operacao.caixa_nova or caixa_reposta
+        reposto = payload(valor - sum(operacao.delta for operacao, _ in falhas), caixa_reposta)
+        try:
+            try:
+                tabela_inv.update(item_id, reposto)
+            finally:
+                self._ultima_escrita[chave] = time.time()
+            atualizar_snapshots(reposto, aceites)
+            mensagem = "Falha ao criar movimento; atualização de inventário revertida."
+        except Exception:
+            for operacao in aceites:
+                if operacao.item is not None:
+                    operacao.item["obtido_em"] = 0.0
+            mensagem = "Falha ao criar movimento e não foi possível repor o inventário automaticamente."
+        for operacao, exc in falhas:
+            erro = RuntimeError(mensagem)
+            erro.__cause__ = exc
+            operacao.futuro.set_exception(erro)
+
+
+_AGENDADOR = AgendadorStock()
+
+
+def _aplicar_no_item(
     api: Api,
     base_id: str,
     *,
     item_id: str,
-    quantidade_atual_anterior: float,
-    quantidade_nova: float,
+    delta: float,
     dados_movimento: Dict[str, Any],
-    caixa_anterior: Optional[str] = None,
     caixa_nova: Optional[str] = None,
+    minimo: Optional[float] = None,
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
-    tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    payload_update: Dict[str, Any] = {"QuantidadeAtual": quantidade_nova}
-    if caixa_nova:
-        payload_update["CaixaAtual"] = [caixa_nova]
-
-    tabela_inv.update(item_id, payload_update)
-    try:
-        return criar_movimento(api, base_id, item_id=item_id, **dados_movimento)
-    except Exception as exc:
-        rollback_payload: Dict[str, Any] = {"QuantidadeAtual": quantidade_atual_anterior}
-        if caixa_nova:
-            rollback_payload["CaixaAtual"] = [caixa_anterior] if caixa_anterior else []
-        try:
-            tabela_inv.update(item_id, rollback_payload)
-        except Exception as rollback_exc:
-            raise RuntimeError(
-                "Falha ao criar movimento e não foi possível repor o inventário automaticamente."
-            ) from rollback_exc
-        raise RuntimeError("Falha ao criar movimento; atualização de inventário revertida.") from exc
+    """Valida o movimento e aplica a operação através do agendador por item (espera pelo fim)."""
+    movimento = _campos_movimento(item_id=item_id, delta=delta, **dados_movimento)
+    return _AGENDADOR.submeter(
+        api, base_id, item_id, delta=delta, movimento=movimento, caixa_nova=caixa_nova, minimo=minimo, item=item
+    ).result()
 
 
 def registrar_entrada(
@@ -144,18 +496,15 @@ def registrar_entrada(
     patrocinador_id: Optional[str] = None,
     origem_entrada: Optional[str] = None,
     notas: str = "",
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     quantidade = _to_int_positivo(quantidade)
-    tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    item = tabela_inv.get(item_id)
-    atual = _to_float(item.get("fields", {}).get("QuantidadeAtual"))
-    novo_valor = atual + quantidade
-    return _atualizar_inventario_e_movimento(
+    return _aplicar_no_item(
         api,
         base_id,
         item_id=item_id,
-        quantidade_atual_anterior=atual,
-        quantidade_nova=novo_valor,
+        delta=quantidade,
+        item=item,
         dados_movimento={
             "tipo": "Entrada",
             "quantidade": quantidade,
@@ -182,20 +531,15 @@ def registrar_saida(
     caixa_destino_id: Optional[str] = None,
     patrocinador_id: Optional[str] = None,
     notas: str = "",
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     quantidade = _to_int_positivo(quantidade)
-    tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    item = tabela_inv.get(item_id)
-    atual = _to_float(item.get("fields", {}).get("QuantidadeAtual"))
-    novo_valor = atual - quantidade
-    if novo_valor < 0:
-        raise ValueError("Operação inválida: stock não pode ficar negativo.")
-    return _atualizar_inventario_e_movimento(
+    return _aplicar_no_item(
         api,
         base_id,
         item_id=item_id,
-        quantidade_atual_anterior=atual,
-        quantidade_nova=novo_valor,
+        delta=-quantidade,
+        item=item,
         dados_movimento={
             "tipo": "Saída",
             "quantidade": quantidade,
@@ -222,20 +566,15 @@ def registrar_ajuste(
     caixa_destino_id: Optional[str] = None,
     patrocinador_id: Optional[str] = None,
     notas: str = "",
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     quantidade = _to_int_positivo(quantidade)
-    tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    item = tabela_inv.get(item_id)
-    atual = _to_float(item.get("fields", {}).get("QuantidadeAtual"))
-    novo_valor = atual - quantidade if reduzir else atual + quantidade
-    if novo_valor < 0:
-        raise ValueError("Operação inválida: stock não pode ficar negativo.")
-    return _atualizar_inventario_e_movimento(
+    return _aplicar_no_item(
         api,
         base_id,
         item_id=item_id,
-        quantidade_atual_anterior=atual,
-        quantidade_nova=novo_valor,
+        delta=-quantidade if reduzir else quantidade,
+        item=item,
         dados_movimento={
             "tipo": "Ajuste",
             "quantidade": quantidade,
@@ -260,23 +599,20 @@ def registrar_transferencia(
     evento_id: Optional[str] = None,
     patrocinador_id: Optional[str] = None,
     notas: str = "",
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     quantidade = _to_int_positivo(quantidade)
     tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    item = tabela_inv.get(item_id)
-    campos_item = item.get("fields", {})
-    caixa_origem_id = _first_link_id(campos_item.get("CaixaAtual"))
-    atual = _to_float(campos_item.get("QuantidadeAtual"))
-    if quantidade > atual:
-        raise ValueError("Operação inválida: quantidade transferida excede stock disponível.")
-    return _atualizar_inventario_e_movimento(
+    item = _carregar_item(tabela_inv, item_id, item)
+    caixa_origem_id = _first_link_id(item["fields"].get("CaixaAtual"))
+    return _aplicar_no_item(
         api,
         base_id,
         item_id=item_id,
-        quantidade_atual_anterior=atual,
-        quantidade_nova=atual,
-        caixa_anterior=caixa_origem_id,
+        delta=0,
         caixa_nova=caixa_destino_id,
+        minimo=quantidade,
+        item=item,
         dados_movimento={
             "tipo": "Transferência",
             "quantidade": quantidade,
@@ -302,8 +638,14 @@ def ajustar_stock_item(
     evento_id: Optional[str] = None,
     origem_entrada: Optional[str] = None,
     patrocinador_id: Optional[str] = None,
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
-    """Stock real vive no Inventário; Movimentos é auditoria de ajustes e saídas."""
+    """Stock real vive no Inventário; Movimentos é auditoria de ajustes e saídas.
+
+    `item` é um snapshot opcional do registo (ver `snapshot_item`); se for recente evita a
+    leitura ao Airtable. O registo é lido no máximo uma vez e partilhado com `registrar_*`,
+    e o snapshot é atualizado no lugar após a escrita.
+    """
     if tipo_movimento not in {"Entrada", "Saída", "Ajuste"}:
         raise ValueError("Tipo de movimento inválido para ajuste de stock.")
 
@@ -311,9 +653,8 @@ def ajustar_stock_item(
         raise ValueError("A alteração de stock não pode ser zero.")
 
     tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    item = tabela_inv.get(item_id)
-    campos_item = item.get("fields", {})
-    caixa_origem_id = _first_link_id(campos_item.get("CaixaAtual"))
+    item = _carregar_item(tabela_inv, item_id, item)
+    caixa_origem_id = _first_link_id(item["fields"].get("CaixaAtual"))
     quantidade = abs(int(delta))
 
     if tipo_movimento == "Entrada":
@@ -330,6 +671,7 @@ def ajustar_stock_item(
             origem_entrada=origem_entrada,
             patrocinador_id=patrocinador_id,
             notas=notas,
+            item=item,
         )
 
     if tipo_movimento == "Saída":
@@ -345,6 +687,7 @@ def ajustar_stock_item(
             caixa_origem_id=caixa_origem_id,
             patrocinador_id=patrocinador_id,
             notas=notas,
+            item=item,
         )
 
     return registrar_ajuste(
@@ -358,6 +701,7 @@ def ajustar_stock_item(
         caixa_origem_id=caixa_origem_id,
         patrocinador_id=patrocinador_id,
         notas=notas,
+        item=item,
     )
 
 
@@ -370,37 +714,30 @@ def transferir_item_caixa(
     quantidade: int,
     executado_por: str,
     notas: str = "",
+    item: Optional[Dict[str, Any]] = None,
 ) -> Dict[str, Any]:
     """Stock real vive no Inventário; Movimentos é auditoria de transferências."""
     quantidade = _to_int_positivo(quantidade)
 
     tabela_inv = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    item = tabela_inv.get(item_id)
-    campos_item = item.get("fields", {})
-    caixa_origem_id = _first_link_id(campos_item.get("CaixaAtual"))
-
-    tabela_inv.update(item_id, {"CaixaAtual": [caixa_destino_id]})
-    try:
-        return criar_movimento(
-            api,
-            base_id,
-            tipo="Transferência",
-            item_id=item_id,
-            caixa_origem_id=caixa_origem_id,
-            caixa_destino_id=caixa_destino_id,
-            quantidade=quantidade,
-            executado_por=executado_por,
-            notas=notas,
-        )
-    except Exception as exc:
-        rollback_payload: Dict[str, Any] = {"CaixaAtual": [caixa_origem_id] if caixa_origem_id else []}
-        try:
-            tabela_inv.update(item_id, rollback_payload)
-        except Exception as rollback_exc:
-            raise RuntimeError(
-                "Falha ao criar movimento e não foi possível repor a caixa do inventário automaticamente."
-            ) from rollback_exc
-        raise RuntimeError("Falha ao criar movimento; atualização de caixa revertida.") from exc
+    item = _carregar_item(tabela_inv, item_id, item)
+    caixa_origem_id = _first_link_id(item["fields"].get("CaixaAtual"))
+    return _aplicar_no_item(
+        api,
+        base_id,
+        item_id=item_id,
+        delta=0,
+        caixa_nova=caixa_destino_id,
+        item=item,
+        dados_movimento={
+            "tipo": "Transferência",
+            "quantidade": quantidade,
+            "executado_por": executado_por,
+            "caixa_origem_id": caixa_origem_id,
+            "caixa_destino_id": caixa_destino_id,
+            "notas": notas,
+        },
+    )
 
 
 def processar_movimentos_lote(
@@ -548,7 +885,42 @@ def normalizar_nome_item(valor: Any) -> str:
     return texto_sem_acentos
 
 
-def encontrar_item_por_nome(registos_inventario: Iterable[Dict[str, Any]], nome_item: str) -> Optional[Dict[str, Any]]:
+class IndiceInventario:
+    """Índice nome normalizado -> registo do Inventário, construído uma vez por lote.
+
+    Normaliza cada `NomeItem` uma única vez; itens criados a meio do lote entram com
+    `adicionar`. Em nomes repetidos ganha o primeiro registo, como na pesquisa linear.
+    """
+
+    def __init__(self, registos: Iterable[Dict[str, Any]] = ()) -> None:
+        self.registos: List[Dict[str, Any]] = []
+        self._por_nome: Dict[str, Dict[str, Any]] = {}
+        for registo in registos:
+            self.adicionar(registo)
+
+    def adicionar(self, registo: Dict[str, Any]) -> None:
+        self.registos.append(registo)
+        nome = normalizar_nome_item(registo.get("fields", {}).get("NomeItem"))
+        if nome:
+            self._por_nome.setdefault(nome, registo)
+
+    def procurar(self, nome_item: Any) -> Optional[Dict[str, Any]]:
+        return self._por_nome.get(normalizar_nome_item(nome_item))
+
+    def ids_por_nome(self) -> Dict[str, str]:
+        """Mapa nome normalizado -> id, para joins vetorizados (`Series.map`)."""
+        return {nome: registo["id"] for nome, registo in self._por_nome.items()}
+
+    def __len__(self) -> int:
+        return len(self.registos)
+
+
+def encontrar_item_por_nome(
+    registos_inventario: IndiceInventario | Iterable[Dict[str, Any]],
+    nome_item: str,
+) -> Optional[Dict[str, Any]]:
+    if isinstance(registos_inventario, IndiceInventario):
+        return registos_inventario.procurar(nome_item)
     alvo = normalizar_nome_item(nome_item)
     if not alvo:
         return None
@@ -560,95 +932,502 @@ def encontrar_item_por_nome(registos_inventario: Iterable[Dict[str, Any]], nome_
     return None
 
 
+def _linha_relatorio(linha: Dict[str, Any], estado: str, mensagem: str) -> Dict[str, Any]:
+    return {
+        "Linha": linha["indice"],
+        "NomeItem": linha["nome_item"],
+        "Tipo": linha["tipo"],
+        "Quantidade": linha["quantidade"],
+        "Estado": estado,
+        "Mensagem": mensagem,
+    }
+
+
+def _planear_item(
+    linhas: List[Dict[str, Any]],
+    item_registo: Optional[Dict[str, Any]],
+    falhar,
+) -> Optional[Dict[str, Any]]:
+    """Valida as linhas de um item contra o stock corrente (local) e devolve o plano de escrita."""
+    campos_item = item_registo.get("fields", {}) if item_registo else {}
+    inicial = _to_float(campos_item.get("QuantidadeAtual")) if item_registo else 0.0
+    plano: Dict[str, Any] = {
+        "item_id": item_registo.get("id") if item_registo else None,
+        "registo": item_registo,
+        "caixa_id": _first_link_id(campos_item.get("CaixaAtual")),
+        "inicial": inicial,
+        "final": inicial,
+        "novo_item": None,
+        "linhas": [],
+    }
+    for linha in linhas:
+        if plano["item_id"] is None and plano["novo_item"] is None:
+            if linha["tipo"] != "Entrada":
+                falhar(linha, "Item não encontrado no inventário para este tipo de movimento.")
+                continue
+            plano["novo_item"] = {
+                "NomeItem": linha["nome_item"],
+                "QuantidadeAtual": 0,
+                "Estado": "Disponível",
+                "Ativo": True,
+            }
+            if linha["categoria"]:
+                plano["novo_item"]["Categoria"] = linha["categoria"]
+            if linha["caixa_destino_id"]:
+                plano["novo_item"]["CaixaAtual"] = [linha["caixa_destino_id"]]
+
+        novo_valor = plano["final"] + linha["delta"]
+        if novo_valor < 0:
+            falhar(linha, "Operação inválida: stock não pode ficar negativo.")
+            continue
+        plano["final"] = novo_valor
+        plano["linhas"].append(linha)
+    return plano if plano["linhas"] else None
+
+
 def processar_movimentos_lote(
     api: Api,
     base_id: str,
     *,
     movimentos: Iterable[Dict[str, Any]],
     executado_por: str,
+    inventario: Optional[IndiceInventario] = None,
 ) -> Dict[str, Any]:
-    """Processa movimentos de inventário em lote e devolve um relatório por linha."""
-    tabela_inventario = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
-    registos_inventario = tabela_inventario.all()
-
-    resultados: list[Dict[str, Any]] = []
-    processados = 0
-    erros = 0
-
-    for movimento in movimentos:
-        indice = movimento.get("indice")
-        nome_item = str(movimento.get("nome_item") or "").strip()
-        tipo = str(movimento.get("tipo") or "").strip()
-        notas = str(movimento.get("notas") or "").strip()
-        categoria = str(movimento.get("categoria") or "").strip()
-        evento_id = movimento.get("evento_id")
+    """Processa movimentos de inventário em lote e devolve um relatório por linha.
+
+    As linhas são agrupadas por item e validadas contra o stock relido do Airtable com os
+    itens reservados no agendador (as operações unitárias esperam pelo fim do lote);
+    as escritas saem em blocos de 10 (`batch_create` de itens novos, `batch_update`
+    do Inventário com o valor final de cada item, `batch_create` dos Movimentos).
+    Se um bloco de Movimentos falhar, o inventário dos itens afetados é reposto.
+
+    `inventario` permite reutilizar o índice já usado na validação; sem ele o
+    Inventário é lido uma vez. Itens criados pelo lote são acrescentados ao índice.
+    Cada movimento aceita ainda `caixa_destino_id`, `patrocinador_id` e
+    `origem_entrada` (por omissão "Importação lote" nas entradas).
+    """
+    if not (executado_por or "").strip():
+        raise ValueError("ExecutadoPor é obrigatório com o email do utilizador autenticado.")
 
+    tabela_inventario = api.table(base_id, _tombola_table("INVENTARIO", "Inventario"))
+    nome_movimentos = _tombola_table("MOVIMENTOS", "Movimentos")
+    if inventario is None:
+        inventario = IndiceInventario(tabela_inventario.all())
+
+    relatorio: Dict[int, Dict[str, Any]] = {}
+
+    def falhar(linha: Dict[str, Any], mensagem: str) -> None:
+        relatorio[linha["posicao"]] = _linha_relatorio(linha, "Erro", mensagem)
+
+    grupos: Dict[str, List[Dict[str, Any]]] = {}
+    for posicao, movimento in enumerate(movimentos):
+        linha = {
+            "posicao": posicao,
+            "indice": movimento.get("indice"),
+            "nome_item": str(movimento.get("nome_item") or "").strip(),
+            "tipo": str(movimento.get("tipo") or "").strip(),
+            "notas": str(movimento.get("notas") or "").strip(),
+            "categoria": str(movimento.get("categoria") or "").strip(),
+            "evento_id": movimento.get("evento_id"),
+            "quantidade": movimento.get("quantidade"),
+            "caixa_destino_id": movimento.get("caixa_destino_id"),
+            "patrocinador_id": movimento.get("patrocinador_id"),
+            "origem_entrada": movimento.get("origem_entrada"),
+        }
         try:
-            quantidade = _to_int_positivo(movimento.get("quantidade"))
-            if tipo not in {"Entrada", "Saída", "Ajuste"}:
+            quantidade = _to_int_positivo(linha["quantidade"])
+            if linha["tipo"] not in {"Entrada", "Saída", "Ajuste"}:
                 raise ValueError("Tipo inválido. Use Entrada, Saída ou Ajuste.")
+            if not linha["nome_item"]:
+                raise ValueError("NomeItem é obrigatório.")
+            _validar_notas_acao_critica(linha["tipo"], linha["notas"])
+        except ValueError as exc:
+            falhar(linha, str(exc))
+            continue
+        linha["quantidade"] = quantidade
+        linha["delta"] = -quantidade if linha["tipo"] == "Saída" else quantidade
+        grupos.setdefault(normalizar_nome_item(linha["nome_item"]), []).append(linha)
+
+    registos = [inventario.procurar(linhas[0]["nome_item"]) for linhas in grupos.values()]
+    item_ids = [registo["id"] for registo in registos if registo is not None and registo.get("id")]
+    with _AGENDADOR.reservar(base_id, item_ids):
+        # Stock relido sob o lock: o índice pode ser anterior a operações de outras sessões.
+        atuais = _ler_itens(tabela_inventario, item_ids)
+        planos = []
+        for linhas, registo in zip(grupos.values(), registos):
+            if registo is not None and registo.get("id") in atuais:
+                registo.setdefault("fields", {}).update(atuais[registo["id"]])
+            plano = _planear_item(linhas, registo, falhar)
+            if plano:
+                planos.append(plano)
+
+        def falhar_plano(plano: Dict[str, Any], mensagem: str) -> None:
+            for linha in plano["linhas"]:
+                falhar(linha, mensagem)
+            plano["linhas"] = []
+
+        novos = [plano for plano in planos if plano["novo_item"] is not None]
+        for bloco in em_blocos(novos):
+            try:
+                criados = tabela_inventario.batch_create([plano["novo_item"] for plano in bloco])
+            except Exception as exc:
+                for plano in bloco:
+                    falhar_plano(plano, f"Falha ao criar item no inventário: {exc}")
+                continue
+            for plano, criado in zip(bloco, criados):
+                plano["item_id"] = criado["id"]
+                plano["registo"] = criado
+                inventario.adicionar(criado)
+
+        aplicados = [plano for plano in planos if plano["linhas"]]
+        for bloco in em_blocos(aplicados):
+            try:
+                tabela_inventario.batch_update(
+                    [{"id": plano["item_id"], "fields": {"QuantidadeAtual": plano["final"]}} for plano in bloco]
+                )
+            except Exception as exc:
+                for plano in bloco:
+                    falhar_plano(plano, f"Falha ao atualizar inventário: {exc}")
+                continue
+            for plano in bloco:
+                # Mantém o índice coerente com o Airtable se for reutilizado.
+                plano["registo"].setdefault("fields", {})["QuantidadeAtual"] = plano["final"]
+
+        pendentes = sorted(
+            ((linha, plano) for plano in aplicados for linha in plano["linhas"]),
+            key=lambda par: par[0]["posicao"],
+        )
+        reposicoes: Dict[str, Dict[str, Any]] = {}
+        for bloco in em_blocos(pendentes):
+            payloads = [
+                _campos_movimento(
+                    tipo=linha["tipo"],
+                    item_id=plano["item_id"],
+                    quantidade=linha["quantidade"],
+                    executado_por=executado_por,
+                    caixa_origem_id=None if linha["caixa_destino_id"] else plano["caixa_id"],
+                    caixa_destino_id=linha["caixa_destino_id"],
+                    evento_id=linha["evento_id"],
+                    patrocinador_id=linha["patrocinador_id"],
+                    origem_entrada=(linha["origem_entrada"] or "Importação lote") if linha["tipo"] == "Entrada" else None,
+                    notas=linha["notas"],
+                    delta=linha["delta"],
+                )
+                for linha, plano in bloco
+            ]
+            try:
+                _criar_movimentos(api, base_id, nome_movimentos, payloads)
+            except Exception as exc:
+                for linha, plano in bloco:
+                    reposicao = reposicoes.setdefault(plano["item_id"], {"plano": plano, "delta": 0, "linhas": []})
+                    reposicao["delta"] += linha["delta"]
+                    reposicao["linhas"].append((linha, exc))
+                continue
+            for linha, _ in bloco:
+                relatorio[linha["posicao"]] = _linha_relatorio(linha, "OK", "Processado com sucesso.")
+
+        for bloco in em_blocos(list(reposicoes.values())):
+            try:
+                tabela_inventario.batch_update(
+                    [
+                        {"id": r["plano"]["item_id"], "fields": {"QuantidadeAtual": r["plano"]["final"] - r["delta"]}}
+                        for r in bloco
+                    ]
+                )
+                mensagem = "Falha ao criar movimento; atualização de inventário revertida."
+                for r in bloco:
+                    r["plano"]["registo"]["fields"]["QuantidadeAtual"] = r["plano"]["final"] - r["delta"]
+            except Exception:
+                mensagem = "Falha ao criar movimento e não foi possível repor o inventário automaticamente."
+            for reposicao in bloco:
+                for linha, exc in reposicao["linhas"]:
+                    falhar(linha, f"{mensagem} ({exc})")
+
+    if planos:
+        invalidar_tabelas(base_id, "INVENTARIO", "MOVIMENTOS")
+
+    resultados = [relatorio[posicao] for posicao in sorted(relatorio)]
+    erros = sum(1 for linha in resultados if linha["Estado"] == "Erro")
+    return {
+        "total": len(resultados),
+        "processados": len(resultados) - erros,
+        "erros": erros,
+        "resultados": resultados,
+    }
 
-            item_registo = encontrar_item_por_nome(registos_inventario, nome_item)
-            item_id = item_registo.get("id") if item_registo else None
 
-            if not item_id:
-                if tipo != "Entrada":
-                    raise ValueError("Item não encontrado no inventário para este tipo de movimento.")
-
-                payload_item = {
-                    "NomeItem": nome_item,
-                    "QuantidadeAtual": 0,
-                    "Estado": "Disponível",
-                    "Ativo": True,
-                }
-                if categoria:
-                    payload_item["Categoria"] = categoria
-                novo_item = tabela_inventario.create(payload_item)
-                item_id = novo_item["id"]
-                registos_inventario.append(novo_item)
-
-            delta = quantidade
-            if tipo == "Saída":
-                delta = -quantidade
-
-            ajustar_stock_item(
-                api,
-                base_id,
-                item_id=item_id,
-                delta=delta,
-                executado_por=executado_por,
-                tipo_movimento=tipo,
-                evento_id=evento_id,
-                notas=notas,
-                origem_entrada="Importação lote" if tipo == "Entrada" else None,
+def processar_patrocinios_lote(
+    api: Api,
+    base_id: str,
+    *,
+    registos: Iterable[Dict[str, Any]],
+    executado_por: str,
+    inventario: Optional[IndiceInventario] = None,
+    patrocinadores: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, Any]]:
+    """Converte registos de RegistoPatrocinios em stock, em lote, com resultado por registo.
+
+    Os patrocinadores em falta (`PatrocinadorNome` sem link) são criados de uma vez;
+    as entradas seguem pelo mesmo motor de `processar_movimentos_lote` (itens
+    resolvidos/criados em bloco e stock agregado por item) e os registos convertidos
+    são marcados `Processado` com `batch_update`. `patrocinadores` é o mapa nome
+    normalizado -> id já conhecido pelo chamador.
+    """
+    patrocinadores = dict(patrocinadores or {})
+    resultados: Dict[str, Dict[str, Any]] = {}
+    validos: List[Dict[str, Any]] = []
+
+    def resultado(registo_id: str, descricao: str, sucesso: bool, mensagem: str) -> None:
+        resultados[registo_id] = {
+            "Registo": registo_id,
+            "DescricaoItem": descricao or registo_id,
+            "Resultado": "Sucesso" if sucesso else "Erro",
+            "Mensagem": mensagem,
+        }
+
+    registos = list(registos)
+    for registo in registos:
+        campos = registo.get("fields", {})
+        descricao = str(campos.get("DescricaoItem") or "").strip()
+        if campos.get("Processado"):
+            resultado(registo["id"], descricao, False, "Este patrocínio já tinha sido processado.")
+            continue
+        try:
+            quantidade = _to_int_positivo(campos.get("Quantidade"))
+        except ValueError:
+            quantidade = 0
+        if not descricao or quantidade <= 0:
+            resultado(
+                registo["id"], descricao, False, "Registo inválido: DescricaoItem e Quantidade > 0 são obrigatórios."
             )
-            processados += 1
-            resultados.append(
-                {
-                    "Linha": indice,
-                    "NomeItem": nome_item,
-                    "Tipo": tipo,
-                    "Quantidade": quantidade,
-                    "Estado": "OK",
-                    "Mensagem": "Processado com sucesso.",
-                }
+            continue
+        validos.append(registo)
+
+    nomes_em_falta: Dict[str, str] = {}
+    for registo in validos:
+        campos = registo["fields"]
+        nome = str(campos.get("PatrocinadorNome") or "").strip()
+        chave = normalizar_nome_item(nome)
+        if not _first_link_id(campos.get("Patrocinador")) and chave and chave not in patrocinadores:
+            nomes_em_falta.setdefault(chave, nome)
+    if nomes_em_falta:
+        tabela_patrocinadores = api.table(base_id, _tombola_table("PATROCINADORES", "Patrocinadores"))
+        try:
+            for bloco in em_blocos(list(nomes_em_falta.items())):
+                criados = tabela_patrocinadores.batch_create([{"Nome": nome} for _, nome in bloco])
+                for (chave, _), criado in zip(bloco, criados):
+                    patrocinadores[chave] = criado["id"]
+        except Exception:
+            pass  # como antes: sem patrocinador resolvido a entrada segue sem link
+        finally:
+            invalidar_tabelas(base_id, "PATROCINADORES")
+
+    movimentos = []
+    for registo in validos:
+        campos = registo["fields"]
+        movimentos.append(
+            {
+                "indice": registo["id"],
+                "nome_item": str(campos.get("DescricaoItem") or "").strip(),
+                "tipo": "Entrada",
+                "quantidade": campos.get("Quantidade"),
+                "notas": str(campos.get("Observacoes") or "").strip(),
+                "categoria": str(campos.get("Categoria") or "").strip(),
+                "evento_id": _first_link_id(campos.get("Evento")),
+                "caixa_destino_id": _first_link_id(campos.get("CaixaSugerida")),
+                "patrocinador_id": _first_link_id(campos.get("Patrocinador"))
+                or patrocinadores.get(normalizar_nome_item(campos.get("PatrocinadorNome"))),
+                "origem_entrada": "Patrocínio",
+            }
+        )
+
+    convertidos: List[str] = []
+    descricoes = {registo["id"]: str(registo["fields"].get("DescricaoItem") or "").strip() for registo in validos}
+    if movimentos:
+        relatorio = processar_movimentos_lote(
+            api, base_id, movimentos=movimentos, executado_por=executado_por, inventario=inventario
+        )
+        for linha in relatorio["resultados"]:
+            if linha["Estado"] == "OK":
+                convertidos.append(linha["Linha"])
+            else:
+                resultado(linha["Linha"], descricoes[linha["Linha"]], False, linha["Mensagem"])
+
+    if convertidos:
+        tabela_registos = api.table(base_id, _tombola_table("REGISTO_PATROCINIOS", "RegistoPatrocinios"))
+        try:
+            for bloco in em_blocos(convertidos):
+                try:
+                    tabela_registos.batch_update(
+                        [{"id": registo_id, "fields": {"Processado": True, "Estado": "Recebido"}} for registo_id in bloco]
+                    )
+                except Exception as exc:
+                    for registo_id in bloco:
+                        resultado(
+                            registo_id,
+                            descricoes[registo_id],
+                            False,
+                            f"Stock atualizado, mas não foi possível marcar o registo como processado: {exc}",
+                        )
+                    continue
+                for registo_id in bloco:
+                    resultado(registo_id, descricoes[registo_id], True, "Patrocínio processado com sucesso.")
+        finally:
+            invalidar_tabelas(base_id, "REGISTO_PATROCINIOS")
+
+    return [resultados[registo["id"]] for registo in registos if registo["id"] in resultados]
+
+
+def sincronizar_operacoes(
+    api: Api,
+    base_id: str,
+    operacoes: List[Dict[str, Any]],
+    *,
+    antes_de_escrever=None,
+    inventario_escrito=None,
+    tabelas: Optional[Tuple[str, str]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Aplica no Airtable operações de stock registadas offline (ver ``tombola_fila``).
+
+    Cada operação traz `chave` (idempotência), `tipo`, `item_id`, `quantidade`, `delta`,
+    `executado_por`, `evento_id`, `notas`, `inventario_escrito` (o diário confirmou a
+    escrita do inventário numa tentativa anterior: só falta o movimento) e, se uma
+    tentativa anterior foi interrompida sem confirmação, `quantidade_final`. O movimento é criado com `ChaveIdempotencia`, pelo
+    que operações já presentes em Movimentos não são repetidas. Inventário e Movimentos
+    são escritos em blocos de 10, com os itens reservados no agendador de stock (leitura
+    e escrita sem operações unitárias pelo meio). `antes_de_escrever(planos)` é chamado com
+    `{item_id: (quantidade_final, [chaves])}` antes de atualizar o inventário, para o
+    diário registar a tentativa; `inventario_escrito(chaves)` logo que o inventário dessas
+    operações fica escrito, para um reenvio não as voltar a somar.
+
+    Devolve `{chave: {"estado": "sincronizado"|"erro"|"pendente", "mensagem", "movimento_id"}}`;
+    "pendente" significa falha temporária (a repetir). Falhas de leitura propagam a exceção.
+    `tabelas` são os nomes (Inventário, Movimentos) do contexto (ver ``tabelas_stock``);
+    obrigatório quando corre fora da sessão, como no worker da fila.
+    """
+    nome_inv, nome_mov = tabelas or tabelas_stock()
+    tabela_inv = api.table(base_id, nome_inv)
+    tabela_mov = api.table(base_id, nome_mov)
+    resultados: Dict[str, Dict[str, Any]] = {}
+
+    def resultado(chave: str, estado: str, mensagem: str = "", movimento_id: Optional[str] = None) -> None:
+        resultados[chave] = {"estado": estado, "mensagem": mensagem, "movimento_id": movimento_id}
+
+    for bloco in em_blocos([op["chave"] for op in operacoes]):
+        # Sem o campo na base não há como detetar movimentos já criados (reenvios podem duplicá-los).
+        if "ChaveIdempotencia" in campos_movimento_em_falta(base_id, nome_mov):
+            break
+        try:
+            registos = tabela_mov.all(
+                formula=formula_campo_igual("ChaveIdempotencia", bloco), fields=["ChaveIdempotencia"]
             )
         except Exception as exc:
-            erros += 1
-            resultados.append(
+            if _campo_opcional_rejeitado(exc) != "ChaveIdempotencia":
+                raise
+            _marcar_em_falta(base_id, nome_mov, "ChaveIdempotencia")
+            break
+        for registo in registos:
+            chave = registo.get("fields", {}).get("ChaveIdempotencia")
+            if chave:
+                resultado(chave, "sincronizado", "Já existia no Airtable.", registo["id"])
+
+    restantes = [op for op in operacoes if op["chave"] not in resultados]
+    item_ids = list(dict.fromkeys(op["item_id"] for op in restantes))
+    with _AGENDADOR.reservar(base_id, item_ids):
+        itens = _ler_itens(tabela_inv, item_ids)
+        planos: Dict[str, Dict[str, Any]] = {}
+        for op in restantes:
+            if op["item_id"] not in itens:
+                resultado(op["chave"], "erro", "Item não encontrado no inventário.")
+                continue
+            campos_item = itens[op["item_id"]]
+            plano = planos.setdefault(
+                op["item_id"],
                 {
-                    "Linha": indice,
-                    "NomeItem": nome_item,
-                    "Tipo": tipo,
-                    "Quantidade": movimento.get("quantidade"),
-                    "Estado": "Erro",
-                    "Mensagem": str(exc),
-                }
+                    "atual": _to_float(campos_item.get("QuantidadeAtual")),
+                    "caixa_id": _first_link_id(campos_item.get("CaixaAtual")),
+                    "ops": [],
+                },
+            )
+            plano["ops"].append(op)
+
+        for item_id, plano in planos.items():
+            # Tentativa interrompida sem confirmação no diário: só se dá como escrita se o
+            # stock ainda for o valor final que essa tentativa ia gravar.
+            anteriores = [
+                op for op in plano["ops"] if not op.get("inventario_escrito") and op.get("quantidade_final") is not None
+            ]
+            ja_aplicadas = bool(anteriores) and all(
+                op["quantidade_final"] == plano["atual"] for op in anteriores
+            )
+            valor = plano["atual"]
+            plano["aceites"] = []
+            plano["por_escrever"] = []
+            for op in plano["ops"]:
+                if op.get("inventario_escrito") or (ja_aplicadas and op.get("quantidade_final") is not None):
+                    plano["aceites"].append(op)
+                    continue
+                if valor + op["delta"] < 0:
+                    resultado(op["chave"], "erro", "Operação inválida: stock não pode ficar negativo.")
+                    continue
+                valor += op["delta"]
+                plano["aceites"].append(op)
+                plano["por_escrever"].append(op["chave"])
+            plano["final"] = valor
+
+        planos = {item_id: plano for item_id, plano in planos.items() if plano["aceites"]}
+        if antes_de_escrever is not None and planos:
+            antes_de_escrever(
+                {item_id: (p["final"], p["por_escrever"]) for item_id, p in planos.items() if p["por_escrever"]}
             )
 
-    return {
-        "total": processados + erros,
-        "processados": processados,
-        "erros": erros,
-        "resultados": resultados,
-    }
+        def confirmar(escritos: List[Dict[str, Any]]) -> None:
+            chaves = [chave for p in escritos for chave in p["por_escrever"]]
+            if inventario_escrito is not None and chaves:
+                inventario_escrito(chaves)
+
+        try:
+            confirmar([p for p in planos.values() if p["final"] == p["atual"]])
+            a_atualizar = [(item_id, p) for item_id, p in planos.items() if p["final"] != p["atual"]]
+            for bloco in em_blocos(a_atualizar):
+                try:
+                    tabela_inv.batch_update(
+                        [{"id": item_id, "fields": {"QuantidadeAtual": p["final"]}} for item_id, p in bloco]
+                    )
+                except Exception as exc:
+                    for item_id, p in bloco:
+                        for op in p["aceites"]:
+                            resultado(op["chave"], "pendente", f"Falha ao atualizar inventário: {exc}")
+                        p["aceites"] = []
+                    continue
+                confirmar([p for _, p in bloco])
+
+            pendentes_mov = [(op, p) for p in planos.values() for op in p["aceites"]]
+            for bloco in em_blocos(pendentes_mov):
+                try:
+                    payloads = [
+                        _campos_movimento(
+                            tipo=op["tipo"],
+                            item_id=op["item_id"],
+                            quantidade=op["quantidade"],
+                            executado_por=op["executado_por"],
+                            caixa_origem_id=p["caixa_id"],
+                            evento_id=op.get("evento_id"),
+                            notas=op.get("notas") or "",
+                            chave_idempotencia=op["chave"],
+                            delta=op["delta"],
+                        )
+                        for op, p in bloco
+                    ]
+                    criados = _criar_movimentos(api, base_id, nome_mov, payloads)
+                except Exception as exc:
+                    for op, _ in bloco:
+                        resultado(op["chave"], "pendente", f"Falha ao criar movimento: {exc}")
+                    continue
+                for (op, _), criado in zip(bloco, criados):
+                    resultado(op["chave"], "sincronizado", "", criado["id"])
+        finally:
+            if planos:
+                marcar_desatualizado(base_id, [nome_inv, nome_mov])
+
+    return resultados